@@ -183,16 +183,16 @@ rsoil=np.array(rsoil[:,1])
 rsoil=np.repeat(rsoil[:,np.newaxis], N_samples_canopy, axis=1)
 
 # Run nadir observations 
-[_,_,_,_,_,_,_,_,_,_,_,_,_,_,
-                 rdot,_,_,rsot,_,_,_]=FourSAIL.FourSAIL_vec(input_param['LAI'],
-                                                           input_param['hotspot'], 
-                                                           lidf,
-                                                           np.ones(N_samples_canopy)*37.,
-                                                           np.zeros(N_samples_canopy), 
-                                                           np.zeros(N_samples_canopy),
-                                                           r.T,
-                                                           t.T,
-                                                           rsoil)
+rdot,rsot=FourSAIL.FourSAIL_vec(input_param['LAI'],
+                                input_param['hotspot'], 
+                                lidf,
+                                np.ones(N_samples_canopy)*37.,
+                                np.zeros(N_samples_canopy), 
+                                np.zeros(N_samples_canopy),
+                                r.T,
+                                t.T,
+                                rsoil,
+                                outputs=FourSAIL.REFLECTANCE_OUTPUTS)
 
 
 rho_canopy = rdot*0.2 + rsot * (1.0 - 0.2)
@@ -203,16 +203,16 @@ rho_canopy = gaussian_filter1d(rho_canopy, sigma, axis=0)
 rho_canopy_nadir = rho_canopy.T
 
 # Run oblique observations
-[_,_,_,_,_,_,_,_,_,_,_,_,_,_,
-                 rdot,_,_,rsot,_,_,_]=FourSAIL.FourSAIL_vec(input_param['LAI'],
-                                                           input_param['hotspot'], 
-                                                           lidf,
-                                                           np.ones(N_samples_canopy)*37.,
-                                                           np.ones(N_samples_canopy)*40., 
-                                                           np.zeros(N_samples_canopy),
-                                                           r.T,
-                                                           t.T,
-                                                           rsoil)
+rdot,rsot=FourSAIL.FourSAIL_vec(input_param['LAI'],
+                                input_param['hotspot'], 
+                                lidf,
+                                np.ones(N_samples_canopy)*37.,
+                                np.ones(N_samples_canopy)*40., 
+                                np.zeros(N_samples_canopy),
+                                r.T,
+                                t.T,
+                                rsoil,
+                                outputs=FourSAIL.REFLECTANCE_OUTPUTS)
 
 
 rho_canopy = rdot*0.2 + rsot * (1.0 - 0.2)
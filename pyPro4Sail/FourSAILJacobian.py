@@ -19,6 +19,9 @@ PACKAGE CONTENTS
 Ancillary functions
 -------------------
 * :func:`JacCalcLIDF_Campbell` Calculates the Jacobian of the Leaf Inclination Distribution Function based on the [Campbell1990] ellipsoidal LIDF distribution.
+* :func:`JacCalcLIDF_Campbell_vec` Calculates the [Campbell1990] LIDF and its Jacobian for arrays of mean leaf angles.
+* :func:`CalcLIDF_Campbell_table` Tabulated [Campbell1990] LIDF, aimed for computing speed.
+* :func:`JacCalcLIDF_Campbell_table` Tabulated [Campbell1990] LIDF and its Jacobian, aimed for computing speed.
 * :func:`volscatt` Colume scattering functions and interception coefficients.
 * :func:`JacJfunc1` Jacobian  of the J1 function.
 * :func:`JacJfunc2` Jacobian of the J2 function.
@@ -39,28 +42,42 @@ EXAMPLE
     rho_canopy = rdot*skyl+rsot*(1-skyl)
     
 """
+from functools import lru_cache
+
 import numpy as np
 
+from pyPro4Sail.FourSAIL import lidf_kernels, leaf_angles, CalcLIDF_Campbell, LIDF_CACHE_SIZE
+
+# Range and step (degrees) of the mean leaf angle grid of the tabulated Campbell LIDF
+CAMPBELL_TABLE_RANGE=(0.,90.)
+CAMPBELL_TABLE_STEP=0.05
+
 params4SAIL=('LAI','hotspot','leaf_angle')
 paramsPro4SAIL=('N_leaf','Cab','Car','Cbrown','Cw','Cm','Ant','LAI','hotspot','leaf_angle') 
 
-def JacCalcLIDF_Campbell(alpha,n_elements=18):
+def JacCalcLIDF_Campbell(alpha,n_elements=18,quadrature='bins'):
     '''Calculate the Leaf Inclination Distribution Function based on the 
     mean angle of [Campbell1990] ellipsoidal LIDF distribution.
 
+    The LIDFs and Jacobians of the last :data:`FourSAIL.LIDF_CACHE_SIZE` mean
+    leaf angles are kept in memory, so repeated calls with the same angle are
+    not recomputed.
+
     Parameters
     ----------
     alpha : float
         Mean leaf angle (degrees) use 57 for a spherical LIDF.
     n_elements : int
         Total number of equally spaced inclination angles .
+    quadrature : str, optional
+        leaf inclination quadrature, see :func:`FourSAIL.leaf_angles`.
     
     Returns
     -------
-    Delta_lidf : list
-        Jacobian of the Leaf Inclination Distribution Function for n_elements equally spaced angles.
     lidf : list
         Leaf Inclination Distribution Function for n_elements equally spaced angles.
+    Delta_lidf : list
+        Jacobian of the Leaf Inclination Distribution Function for n_elements equally spaced angles.
         
     References
     ----------
@@ -74,7 +91,14 @@ def JacCalcLIDF_Campbell(alpha,n_elements=18):
         ISSN 0168-1923, http://dx.doi.org/10.1016/0168-1923(90)90030-A.
     '''
     
-    alpha=float(alpha)
+    lidf, Delta_lidf = _jac_campbell_lidf(float(alpha),int(n_elements),quadrature)
+    return list(lidf), list(Delta_lidf)
+
+@lru_cache(maxsize=LIDF_CACHE_SIZE)
+def _jac_campbell_lidf(alpha,n_elements,quadrature):
+    if quadrature != 'bins':
+        lidf, Delta_lidf = JacCalcLIDF_Campbell_vec(alpha,n_elements,quadrature)
+        return tuple(lidf[:,0].tolist()), tuple(Delta_lidf[:,0].tolist())
     excent=np.exp(-1.6184e-5*alpha**3.+2.1145e-3*alpha**2.-1.2390e-1*alpha+3.2491)
     Delta_excent=np.exp(-1.6184e-5*alpha**3.+2.1145e-3*alpha**2.-1.2390e-1*alpha+3.2491)*(3*-1.6184e-5*alpha**2+
                     2.*2.1145e-3*alpha-1.2390e-1)
@@ -135,15 +159,181 @@ def JacCalcLIDF_Campbell(alpha,n_elements=18):
                 Delta_freq.append(Delta_freq_i)
     sum0 = sum(freq)
     Delta_sum0=sum(Delta_freq)
-    lidf=[]
-    Delta_lidf=[]
-    for i in range(n_elements):
-        lidf.append(float(freq[i])/sum0)
-        Delta_lidf.append(float(Delta_freq[i]*sum0-freq[i]*Delta_sum0)/sum0**2)
+    lidf=tuple(float(freq[i])/sum0 for i in range(n_elements))
+    Delta_lidf=tuple(float(Delta_freq[i]*sum0-freq[i]*Delta_sum0)/sum0**2 for i in range(n_elements))
+    
+    return lidf, Delta_lidf
+
+def JacCalcLIDF_Campbell_vec(alpha,n_elements=18,quadrature='bins'):
+    '''Calculate the [Campbell1990] ellipsoidal LIDF and its derivative
+    with respect to the mean leaf angle for an array of mean leaf angles.
+
+    Parameters
+    ----------
+    alpha : float or 1D array
+        Mean leaf angles (degrees).
+    n_elements : int
+        Total number of equally spaced inclination angles .
+    quadrature : str, optional
+        leaf inclination quadrature, see :func:`FourSAIL.leaf_angles`.
+    
+    Returns
+    -------
+    lidf : 2D array
+        Leaf Inclination Distribution Functions, size n_elements x n_alpha.
+    Delta_lidf : 2D array
+        Derivatives of the LIDFs with respect to the mean leaf angle (per degree),
+        size n_elements x n_alpha.
+    '''
     
+    alpha=np.asarray(alpha,dtype=float).reshape(-1)
+    excent=np.exp(-1.6184e-5*alpha**3.+2.1145e-3*alpha**2.-1.2390e-1*alpha+3.2491)
+    Delta_excent=excent*(3*-1.6184e-5*alpha**2+2.*2.1145e-3*alpha-1.2390e-1)
+    if quadrature != 'bins':
+        # Ellipsoidal density at the quadrature nodes
+        angles,weights=leaf_angles(n_elements,quadrature)
+        tl=np.radians(angles)[:,np.newaxis]
+        sin_tl=np.sin(tl)
+        denom=np.cos(tl)**2.+excent**2.*sin_tl**2.
+        freq=weights[:,np.newaxis]*sin_tl/denom**2.
+        Delta_freq=-4.*freq*excent*Delta_excent*sin_tl**2./denom
+    else:
+        freq,Delta_freq=_campbell_bins(excent,Delta_excent,n_elements)
+    sum0=np.sum(freq,axis=0)
+    Delta_sum0=np.sum(Delta_freq,axis=0)
+    lidf=freq/sum0
+    Delta_lidf=(Delta_freq*sum0-freq*Delta_sum0)/sum0**2
+    
+    return lidf, Delta_lidf
+
+def _campbell_bins(excent,Delta_excent,n_elements):
+    # Cumulative functions at the n_elements+1 inclination angle boundaries
+    tl=np.radians(np.arange(n_elements+1)*90.0/n_elements)[:,np.newaxis]
+    tan2=np.tan(tl)**2.
+    x=excent/np.sqrt(1.+excent**2.*tan2)
+    Delta_x=Delta_excent/(1.+excent**2.*tan2)**1.5
+    cum=np.zeros(x.shape)
+    Delta_cum=np.zeros(x.shape)
+    index=excent == 1.
+    cum[:,index]=np.cos(tl)
+    for index in (excent > 1.,excent < 1.):
+        if not np.any(index):
+            continue
+        e=excent[index]
+        x_i=x[:,index]
+        Delta_x_i=Delta_x[:,index]
+        alph2=e**2./np.abs(1.-e**2.)
+        Delta_alph2=np.sign(1.-e**2.)*2.*e*Delta_excent[index]/(1.-e**2.)**2.
+        if e[0] > 1.:
+            alpx=np.sqrt(alph2+x_i**2.)
+            Delta_alpx=0.5*(Delta_alph2+2.*x_i*Delta_x_i)/alpx
+            cum[:,index]=x_i*alpx+alph2*np.log(x_i+alpx)
+            Delta_cum[:,index]=(Delta_x_i*alpx+x_i*Delta_alpx+Delta_alph2*np.log(x_i+alpx)
+                +alph2*(Delta_x_i+Delta_alpx)/(x_i+alpx))
+        else:
+            alph=np.sqrt(alph2)
+            Delta_alph=0.5*Delta_alph2/alph
+            almx=np.sqrt(alph2-x_i**2.)
+            Delta_almx=0.5*(Delta_alph2-2.*x_i*Delta_x_i)/almx
+            cum[:,index]=x_i*almx+alph2*np.arcsin(x_i/alph)
+            Delta_cum[:,index]=(Delta_x_i*almx+x_i*Delta_almx+Delta_alph2*np.arcsin(x_i/alph)
+                +alph2*(Delta_x_i*alph-x_i*Delta_alph)/(alph**2*np.sqrt(1.-(x_i/alph)**2)))
+    sign=np.sign(cum[:-1]-cum[1:])
+    freq=sign*(cum[:-1]-cum[1:])
+    Delta_freq=sign*(Delta_cum[:-1]-Delta_cum[1:])
+    return freq, Delta_freq
+
+@lru_cache(maxsize=None)
+def _campbell_table(n_elements,quadrature):
+    start,stop=CAMPBELL_TABLE_RANGE
+    n_nodes=int(round((stop-start)/CAMPBELL_TABLE_STEP))+1
+    lidf,Delta_lidf=JacCalcLIDF_Campbell_vec(np.linspace(start,stop,n_nodes),n_elements,quadrature)
+    # Node x leaf angle layout so that the interpolation reads contiguous rows
+    lidf=np.ascontiguousarray(lidf.T)
+    Delta_lidf=np.ascontiguousarray(Delta_lidf.T)*CAMPBELL_TABLE_STEP
+    lidf.flags.writeable=False
+    Delta_lidf.flags.writeable=False
     return lidf, Delta_lidf
 
-def JacFourSAIL(lai,hotspot,lidf,tts,tto,psi,rho,tau,rsoil,Delta_rho=None,Delta_tau=None):
+def _interpolate_campbell(alpha,n_elements,quadrature,jacobian):
+    start,stop=CAMPBELL_TABLE_RANGE
+    lidf,Delta_lidf=_campbell_table(n_elements,quadrature)
+    u=(alpha-start)/CAMPBELL_TABLE_STEP
+    k=min(int(u),lidf.shape[0]-2)
+    t=u-k
+    # Cubic Hermite basis on the grid cell, the node slopes are per grid step
+    t2=t*t
+    t3=t2*t
+    value=((2.*t3-3.*t2+1.)*lidf[k]+(t3-2.*t2+t)*Delta_lidf[k]
+        +(3.*t2-2.*t3)*lidf[k+1]+(t3-t2)*Delta_lidf[k+1])
+    if not jacobian:
+        return value
+    Delta_value=((6.*t2-6.*t)*(lidf[k]-lidf[k+1])+(3.*t2-4.*t+1.)*Delta_lidf[k]
+        +(3.*t2-2.*t)*Delta_lidf[k+1])/CAMPBELL_TABLE_STEP
+    return value, Delta_value
+
+def CalcLIDF_Campbell_table(alpha,n_elements=18,quadrature='bins'):
+    '''Tabulated [Campbell1990] ellipsoidal LIDF, aimed for computing speed.
+
+    The LIDF and its derivative are tabulated once every
+    :data:`CAMPBELL_TABLE_STEP` degrees within :data:`CAMPBELL_TABLE_RANGE`,
+    and interpolated with cubic Hermite polynomials, which keeps the LIDF
+    normalised. Mean leaf angles out of the table range use the exact
+    :func:`FourSAIL.CalcLIDF_Campbell`.
+
+    Parameters
+    ----------
+    alpha : float
+        Mean leaf angle (degrees) use 57 for a spherical LIDF.
+    n_elements : int
+        Total number of equally spaced inclination angles .
+    quadrature : str, optional
+        leaf inclination quadrature, see :func:`FourSAIL.leaf_angles`.
+    
+    Returns
+    -------
+    lidf : 1D array
+        Leaf Inclination Distribution Function for n_elements equally spaced angles.
+    '''
+    
+    alpha=float(alpha)
+    if not CAMPBELL_TABLE_RANGE[0] <= alpha <= CAMPBELL_TABLE_RANGE[1]:
+        return np.array(CalcLIDF_Campbell(alpha,n_elements,quadrature))
+    return _interpolate_campbell(alpha,int(n_elements),quadrature,False)
+
+def JacCalcLIDF_Campbell_table(alpha,n_elements=18,quadrature='bins'):
+    '''Tabulated [Campbell1990] ellipsoidal LIDF and its Jacobian, aimed for
+    computing speed.
+
+    See :func:`CalcLIDF_Campbell_table`, the Jacobian is the derivative of the
+    interpolating polynomial. Mean leaf angles out of the table range use the
+    exact :func:`JacCalcLIDF_Campbell`.
+
+    Parameters
+    ----------
+    alpha : float
+        Mean leaf angle (degrees) use 57 for a spherical LIDF.
+    n_elements : int
+        Total number of equally spaced inclination angles .
+    quadrature : str, optional
+        leaf inclination quadrature, see :func:`FourSAIL.leaf_angles`.
+    
+    Returns
+    -------
+    lidf : 1D array
+        Leaf Inclination Distribution Function for n_elements equally spaced angles.
+    Delta_lidf : 1D array
+        Jacobian of the Leaf Inclination Distribution Function for n_elements equally spaced angles.
+    '''
+    
+    alpha=float(alpha)
+    if not CAMPBELL_TABLE_RANGE[0] <= alpha <= CAMPBELL_TABLE_RANGE[1]:
+        lidf, Delta_lidf = JacCalcLIDF_Campbell(alpha,n_elements,quadrature)
+        return np.array(lidf), np.array(Delta_lidf)
+    return _interpolate_campbell(alpha,int(n_elements),quadrature,True)
+
+def JacFourSAIL(lai,hotspot,lidf,tts,tto,psi,rho,tau,rsoil,Delta_rho=None,Delta_tau=None,
+                quadrature='bins'):
     ''' Runs 4SAIL canopy radiative transfer model.
     
     Parameters
@@ -166,6 +356,8 @@ def JacFourSAIL(lai,hotspot,lidf,tts,tto,psi,rho,tau,rsoil,Delta_rho=None,Delta_
         leaf transmittance.
     rsoil : array_like
         soil lambertian reflectance.
+    quadrature : str, optional
+        leaf inclination quadrature of lidf, see :func:`FourSAIL.leaf_angles`.
     
     Returns
     -------
@@ -296,7 +488,8 @@ def JacFourSAIL(lai,hotspot,lidf,tts,tto,psi,rho,tau,rsoil,Delta_rho=None,Delta_
      Delta_ko, 
      Delta_bf, 
      Delta_sob, 
-     Delta_sof] = Jac_weighted_sum_over_lidf(lidf, Delta_lidf, tts, tto, psi, leaf_params, n_params)
+     Delta_sof] = Jac_weighted_sum_over_lidf(lidf, Delta_lidf, tts, tto, psi, leaf_params, n_params,
+                                             quadrature)
 
     # Geometric factors to be used later with rho and tau
     sdb=0.5*(ks+bf)
@@ -517,49 +710,20 @@ def JacFourSAIL(lai,hotspot,lidf,tts,tto,psi,rho,tau,rsoil,Delta_rho=None,Delta_
             Delta_rso,Delta_rsos,Delta_rsod,Delta_rddt,Delta_rsdt,Delta_rdot,
             Delta_rsodt,Delta_rsost,Delta_rsot,Delta_gammasdf,Delta_gammasdb,Delta_gammaso]
 
-def Jac_weighted_sum_over_lidf(lidf, Delta_lidf, tts, tto, psi, leaf_params, n_params):
+def Jac_weighted_sum_over_lidf(lidf, Delta_lidf, tts, tto, psi, leaf_params, n_params,
+                               quadrature='bins'):
     
-    cts   = np.cos(np.radians(tts))
-    cto   = np.cos(np.radians(tto))
-    ctscto  = cts*cto
-
-    #Initialise sums
-    ks=0.
-    Delta_ks=np.zeros(n_params)
-    ko=0.
-    Delta_ko=np.zeros(n_params)
-    bf=0.
-    Delta_bf=np.zeros(n_params)    
-    sob=0.
-    Delta_sob=np.zeros(n_params)
-    sof=0.
-    Delta_sof=np.zeros(n_params)
+    # Cached per-angle coefficients of this geometry
+    kernels=lidf_kernels(tts, tto, psi, len(lidf), quadrature)
     # Weighted sums over LIDF
-    n_angles=len(lidf)
-    angle_step=float(90.0/n_angles)
-    litab=[float(angle)*angle_step+(angle_step/2.0) for angle in range(n_angles)]
-    for i,ili in enumerate(litab):
-        ttl=float(ili)
-        cttl=np.cos(np.radians(ttl))
-        # SAIL volume scattering phase function gives interception and portions to be multiplied by rho and tau
-        chi_s, chi_o, frho, ftau = volscatt(tts, tto, psi, ttl)
-        # Extinction coefficients
-        ksli=chi_s/cts
-        koli=chi_o/cto
-        # Area scattering coefficient fractions
-        sobli=frho*np.pi/ctscto
-        sofli=ftau*np.pi/ctscto
-        bfli=cttl**2.
-        ks+=ksli*float(lidf[i])
-        Delta_ks[leaf_params+2]+=ksli*float(Delta_lidf[i])
-        ko+=koli*float(lidf[i])
-        Delta_ko[leaf_params+2]+=koli*float(Delta_lidf[i])
-        bf+=bfli*float(lidf[i])
-        Delta_bf[leaf_params+2]+=bfli*float(Delta_lidf[i])
-        sob+=sobli*float(lidf[i])
-        Delta_sob[leaf_params+2]+=sobli*float(Delta_lidf[i])
-        sof+=sofli*float(lidf[i])
-        Delta_sof[leaf_params+2]+=sofli*float(Delta_lidf[i])
+    ks, ko, bf, sob, sof = np.dot(kernels, np.asarray(lidf, dtype=float).reshape(-1))
+    # Only the leaf angle parameter changes the LIDF
+    Delta_ks, Delta_ko, Delta_bf, Delta_sob, Delta_sof = np.zeros((5, n_params))
+    [Delta_ks[leaf_params+2],
+     Delta_ko[leaf_params+2],
+     Delta_bf[leaf_params+2],
+     Delta_sob[leaf_params+2],
+     Delta_sof[leaf_params+2]] = np.dot(kernels, np.asarray(Delta_lidf, dtype=float).reshape(-1))
     
     return ks, ko, bf, sob, sof, Delta_ks, Delta_ko, Delta_bf, Delta_sob, Delta_sof
 
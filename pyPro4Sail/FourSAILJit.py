@@ -0,0 +1,285 @@
+# -*- coding: utf-8 -*-
+"""
+DESCRIPTION
+===========
+Compiled per-wavelength 4SAIL kernels, used when `Numba <https://numba.pydata.org>`_
+is installed.
+
+The canopy reflectance of one canopy at a few observations and bands, as
+needed by :func:`cost_functions.FCost_ProSail_wl`, is computed in a single
+fused loop over observations and bands. The leaf angle weighted coefficients
+and the hotspot terms are computed once per observation, and the scalar
+4SAIL equations of :func:`FourSAIL.FourSAIL_wl` once per band. Without Numba
+the same quantities are computed with the NumPy :func:`FourSAIL.FourSAIL_vec`.
+
+PACKAGE CONTENTS
+================
+* :data:`HAS_NUMBA` True if the compiled kernels are available.
+* :func:`canopy_reflectance_wl` Canopy reflectance factors of a canopy for several observations and bands.
+"""
+import math
+
+import numpy as np
+
+from pyPro4Sail import FourSAIL
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# Whether the compiled kernels are available
+HAS_NUMBA = numba is not None
+# Computational backends of canopy_reflectance_wl
+BACKENDS = ('numba', 'numpy')
+
+def _jit(function):
+    # Compiled by Numba if installed, the plain Python function otherwise.
+    # The numpy error model keeps the inf/nan semantics of the NumPy code
+    if numba is None:
+        return function
+    return numba.njit(cache=True, error_model='numpy')(function)
+
+@_jit
+def _volscatt(tts, tto, psi, ttl):
+    # Scalar FourSAIL.volscatt
+    cts = math.cos(math.radians(tts))
+    cto = math.cos(math.radians(tto))
+    sts = math.sin(math.radians(tts))
+    sto = math.sin(math.radians(tto))
+    psir = math.radians(psi)
+    cospsi = math.cos(psir)
+    cttl = math.cos(math.radians(ttl))
+    sttl = math.sin(math.radians(ttl))
+    cs = cttl*cts
+    co = cttl*cto
+    ss = sttl*sts
+    so = sttl*sto
+    cosbts = 5.
+    if abs(ss) > 1e-6:
+        cosbts = -cs/ss
+    cosbto = 5.
+    if abs(so) > 1e-6:
+        cosbto = -co/so
+    if abs(cosbts) < 1.0:
+        bts = math.acos(cosbts)
+        ds = ss
+    else:
+        bts = math.pi
+        ds = cs
+    chi_s = 2./math.pi*((bts-math.pi*0.5)*cs+math.sin(bts)*ss)
+    if abs(cosbto) < 1.0:
+        bto = math.acos(cosbto)
+        do_ = so
+    elif tto < 90.:
+        bto = math.pi
+        do_ = co
+    else:
+        bto = 0.0
+        do_ = -co
+    chi_o = 2.0/math.pi*((bto-math.pi*0.5)*co+math.sin(bto)*so)
+    btran1 = abs(bts-bto)
+    btran2 = math.pi-abs(bts+bto-math.pi)
+    if psir <= btran1:
+        bt1 = psir
+        bt2 = btran1
+        bt3 = btran2
+    else:
+        bt1 = btran1
+        if psir <= btran2:
+            bt2 = psir
+            bt3 = btran2
+        else:
+            bt2 = btran2
+            bt3 = psir
+    t1 = 2.*cs*co+ss*so*cospsi
+    t2 = 0.
+    if bt2 > 0.:
+        t2 = math.sin(bt2)*(2.*ds*do_+ss*so*math.cos(bt1)*math.cos(bt3))
+    denom = 2.*math.pi**2
+    frho = max(0., ((math.pi-bt2)*t1+t2)/denom)
+    ftau = max(0., (-bt2*t1+t2)/denom)
+    return chi_s, chi_o, frho, ftau
+
+@_jit
+def _weighted_sums(lidf, angles, tts, tto, psi):
+    # Scalar FourSAIL.weighted_sum_over_lidf
+    cts = math.cos(math.radians(tts))
+    cto = math.cos(math.radians(tto))
+    ctscto = cts*cto
+    ks = ko = bf = sob = sof = 0.
+    for i in range(lidf.shape[0]):
+        ttl = angles[i]
+        cttl = math.cos(math.radians(ttl))
+        chi_s, chi_o, frho, ftau = _volscatt(tts, tto, psi, ttl)
+        ks += lidf[i]*chi_s/cts
+        ko += lidf[i]*chi_o/cto
+        bf += lidf[i]*cttl**2
+        sob += lidf[i]*frho*math.pi/ctscto
+        sof += lidf[i]*ftau*math.pi/ctscto
+    return ks, ko, bf, sob, sof
+
+@_jit
+def _hotspot(hotspot, lai, ko, ks, dso, tss, n_steps):
+    # Scalar FourSAIL.hotspot_calculations_vec, exponential Simpson integration
+    alf = 1e36
+    if hotspot > 0.:
+        alf = (dso/hotspot)*2./(ks+ko)
+    if alf == 0.:
+        # The pure hotspot
+        return tss, (1.-tss)/(ks*lai)
+    fhot = lai*math.sqrt(ko*ks)
+    fint = (1.-math.exp(-alf))/n_steps
+    x1 = 0.
+    y1 = 0.
+    f1 = 1.
+    sumint = 0.
+    for step in range(1, n_steps+1):
+        if step < n_steps:
+            x2 = -math.log(1.-step*fint)/alf
+        else:
+            x2 = 1.
+        y2 = -(ko+ks)*lai*x2+fhot*(1.-math.exp(-alf*x2))/alf
+        f2 = math.exp(y2)
+        sumint += (f2-f1)*(x2-x1)/(y2-y1)
+        x1 = x2
+        y1 = y2
+        f1 = f2
+    if math.isnan(sumint):
+        sumint = 0.
+    return f1, sumint
+
+@_jit
+def _jfunc1(k, l, t):
+    # FourSAIL.Jfunc1_wl
+    del_ = (k-l)*t
+    if abs(del_) > 1e-3:
+        return (math.exp(-l*t)-math.exp(-k*t))/(k-l)
+    return 0.5*t*(math.exp(-k*t)+math.exp(-l*t))*(1.-(del_**2.)/12.)
+
+@_jit
+def _jfunc2(k, l, t):
+    # FourSAIL.Jfunc2_wl
+    return (1.-math.exp(-(k+l)*t))/(k+l)
+
+@_jit
+def _reflectance(lai, ks, ko, bf, sob, sof, tss, too, tsstoo, sumint, rho, tau, rsoil):
+    # rdot and rsot of FourSAIL.FourSAIL_wl for a single band, with the same
+    # guards as FourSAIL.FourSAIL_vec so both backends agree on degenerate inputs
+    if lai <= 0:
+        return rsoil, rsoil
+    sigb = max(1e-36, 0.5*(1.+bf)*rho+0.5*(1.-bf)*tau)
+    att = 1.-max(1e-36, 0.5*(1.-bf)*rho+0.5*(1.+bf)*tau)
+    m = math.sqrt(att**2-sigb**2)
+    sb = 0.5*(ks+bf)*rho+0.5*(ks-bf)*tau
+    sf = 0.5*(ks-bf)*rho+0.5*(ks+bf)*tau
+    vb = 0.5*(ko+bf)*rho+0.5*(ko-bf)*tau
+    vf = 0.5*(ko-bf)*rho+0.5*(ko+bf)*tau
+    w = sob*rho+sof*tau
+    e1 = math.exp(-m*lai)
+    e2 = e1**2
+    rinf = (att-m)/sigb
+    rinf2 = rinf**2
+    re = rinf*e1
+    denom = 1.-rinf2*e2
+    J1ks = _jfunc1(ks, m, lai)
+    J2ks = _jfunc2(ks, m, lai)
+    J1ko = _jfunc1(ko, m, lai)
+    J2ko = _jfunc2(ko, m, lai)
+    Pss = (sf+sb*rinf)*J1ks
+    Qss = (sf*rinf+sb)*J2ks
+    Pv = (vf+vb*rinf)*J1ko
+    Qv = (vf*rinf+vb)*J2ko
+    tdd = (1.-rinf2)*e1/denom
+    rdd = rinf*(1.-e2)/denom
+    tsd = (Pss-re*Qss)/denom
+    tdo = (Pv-re*Qv)/denom
+    rdo = (Qv-re*Pv)/denom
+    z = _jfunc2(ks, ko, lai)
+    Tv1 = (vf*rinf+vb)*(z-J1ks*too)/(ko+m)
+    Tv2 = (vf+vb*rinf)*(z-J1ko*tss)/(ks+m)
+    # Multiple and single scattering contributions to the bidirectional reflectance
+    rsod = (Tv1*(sf+sb*rinf)+Tv2*(sf*rinf+sb)-(rdo*Qss+tdo*Pss)*rinf)/(1.-rinf2)
+    rso = w*lai*sumint+rsod
+    # Interaction with the soil
+    dn = max(1e-36, 1.-rsoil*rdd)
+    rdot = rdo+tdd*rsoil*(tdo+too)/dn
+    rsodt = ((tss+tsd)*tdo+(tsd+tss*rsoil*rdd)*too)*rsoil/dn
+    rsot = rso+tsstoo*rsoil+rsodt
+    return rdot, rsot
+
+@_jit
+def _canopy_reflectance(lai, hotspot, lidf, angles, tts, tto, psi, rho, tau, rsoil, skyl, n_steps):
+    # Fused loop over observations and bands
+    n_obs = tts.shape[0]
+    n_wl = rho.shape[0]
+    rho_canopy = np.empty((n_obs, n_wl))
+    for obs in range(n_obs):
+        # Structure and geometry terms, common to all the bands
+        ks, ko, bf, sob, sof = _weighted_sums(lidf, angles, tts[obs], tto[obs], psi[obs])
+        tss = math.exp(-ks*lai)
+        too = math.exp(-ko*lai)
+        tants = math.tan(math.radians(tts[obs]))
+        tanto = math.tan(math.radians(tto[obs]))
+        dso = math.sqrt(max(0., tants**2+tanto**2
+                            -2.*tants*tanto*math.cos(math.radians(psi[obs]))))
+        tsstoo, sumint = _hotspot(hotspot, lai, ko, ks, dso, tss, n_steps)
+        for band in range(n_wl):
+            rdot, rsot = _reflectance(lai, ks, ko, bf, sob, sof, tss, too, tsstoo, sumint,
+                                      rho[band], tau[band], rsoil[band])
+            rho_canopy[obs, band] = rdot*skyl[obs, band]+rsot*(1.-skyl[obs, band])
+    return rho_canopy
+
+def canopy_reflectance_wl(lai, hotspot, lidf, tts, tto, psi, rho, tau, rsoil, skyl,
+                          hotspot_steps=FourSAIL.HOTSPOT_STEPS, backend=None, quadrature='bins'):
+    '''Canopy reflectance factors of a canopy for several observations and bands.
+
+    Parameters
+    ----------
+    lai : float
+        Leaf Area Index.
+    hotspot : float
+        Hotspot parameter.
+    lidf : array_like
+        Leaf Inclination Distribution at regular angle steps.
+    tts, tto, psi : array_like
+        Sun Zenith, View Zenith and relative Sun-View Azimuth Angles (degrees)
+        of each observation, size n_obs.
+    rho, tau, rsoil : array_like
+        leaf reflectance, leaf transmittance and soil reflectance, size n_wl.
+    skyl : float or array_like
+        ratio of diffuse radiation, broadcast to n_obs x n_wl.
+    hotspot_steps : int, optional
+        number of steps in the integration of the hotspot effect.
+    backend : str, optional
+        'numba' for the compiled kernels or 'numpy' for :func:`FourSAIL.FourSAIL_vec`.
+        Default 'numba' if Numba is installed, 'numpy' otherwise.
+    quadrature : str, optional
+        leaf inclination quadrature of lidf, see :func:`FourSAIL.leaf_angles`.
+
+    Returns
+    -------
+    rho_canopy : 2D array
+        canopy reflectance factors, size n_obs x n_wl.
+    '''
+
+    if backend is None:
+        backend = 'numba' if HAS_NUMBA else 'numpy'
+    if backend not in BACKENDS:
+        raise ValueError('Unknown backend %s, valid backends are %s' % (backend, ', '.join(BACKENDS)))
+    tts, tto, psi = (np.ravel(angle).astype(float) for angle in np.broadcast_arrays(tts, tto, psi))
+    rho, tau, rsoil = (np.ravel(spectrum).astype(float) for spectrum in (rho, tau, rsoil))
+    skyl = np.broadcast_to(np.asarray(skyl, dtype=float), (tts.size, rho.size))
+    if backend == 'numba':
+        if not HAS_NUMBA:
+            raise ImportError('The numba backend requires Numba to be installed')
+        lidf = np.ravel(lidf).astype(float)
+        angles, _ = FourSAIL.leaf_angles(lidf.size, quadrature)
+        return _canopy_reflectance(float(lai), float(hotspot), lidf, angles, tts, tto, psi,
+                                   rho, tau, rsoil, np.ascontiguousarray(skyl),
+                                   int(hotspot_steps))
+    rdot, rsot = FourSAIL.FourSAIL_vec(lai, hotspot, np.ravel(lidf), tts, tto, psi,
+                                       rho, tau, rsoil, hotspot_steps=hotspot_steps,
+                                       outputs=FourSAIL.REFLECTANCE_OUTPUTS,
+                                       quadrature=quadrature)
+    return (rdot*skyl.T+rsot*(1.-skyl.T)).T
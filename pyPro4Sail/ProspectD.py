@@ -16,11 +16,18 @@ PACKAGE CONTENTS
 ================
 * :func:`Prospect5` Runs PROSPECT5 leaf radiative transfer model.
 * :func:`Prospect5_wl` Runs PROSPECT5 leaf radiative transfer model for a specific wavelenght, aimed for computing speed.
+* :func:`ProspectD` Runs PROSPECT-D leaf radiative transfer model.
+* :func:`ProspectD_wl` Runs PROSPECT-D leaf radiative transfer model for a specific wavelenght.
+* :func:`ProspectD_bands` Runs PROSPECT-D leaf radiative transfer model for a precomputed set of bands, aimed for computing speed.
+* :func:`ProspectD_bands_vec` Runs PROSPECT-D for an array of leaves and a precomputed set of bands.
+* :class:`ProspectDEngine` Reusable PROSPECT-D model for repeated batch runs with preallocated outputs.
 
 Ancillary functions
 -------------------
 * :func:`tav` Average transmittivity at the leaf surface. 
 * :func:`tav_wl` Average transmittivity at the leaf surface for :func:`Prospect5_wl`.
+* :func:`get_band_index` Position of a set of wavelenghts in the PROSPECT spectral library.
+* :func:`interface_coefficients` Cached reflectivity and transmissivity at the leaf interface.
 
 EXAMPLE
 =======
@@ -35,13 +42,78 @@ EXAMPLE
 
 # Extinction coefficients and refractive index
 from pyPro4Sail import spectral_lib
-from scipy.special import expi, expn
 import numpy as np
 
 wls,refr_index,Cab_k,Car_k,Cbrown_k,Cw_k,Cm_k,Ant_k=spectral_lib
 
 paramsProspect5=('N_leaf','Cab','Car','Cbrown','Cw','Cm', 'Ant')
 
+def expi(x):
+    '''Exponential integral Ei, scipy.special is only imported on first use.'''
+    from scipy.special import expi as _expi
+    return _expi(x)
+
+# Coefficients of the Abramowitz and Stegun (1964) approximations of E1,
+# eq. 5.1.53 for 0<x<=1 and eq. 5.1.56 for x>1
+_E1_SMALL=(-0.57721566, 0.99999193, -0.24991055, 0.05519968, -0.00976004, 0.00107857)
+_E1_NUM=(0.2677737343, 8.6347608925, 18.0590169730, 8.5733287401)
+_E1_DEN=(3.9584969228, 21.0996530827, 25.6329561486, 9.5733223454)
+
+def exp1_fast(x):
+    '''Polynomial and rational approximation of the exponential integral E1.
+
+    About eight times faster than :func:`scipy.special.expi`. The absolute error
+    is below 2e-7 for 0<x<=1 and the relative error of x*exp(x)*E1(x) is below
+    2e-8 for x>1, so the absolute error of the PROSPECT transmission term
+    k**2*E1(k) is bounded by 2e-7 (4e-8 measured) for any k>0.
+
+    Parameters
+    ----------
+    x : float or array_like
+        positive argument.
+
+    Returns
+    -------
+    e1 : float or array_like
+        exponential integral E1(x)=-Ei(-x).
+
+    References
+    ----------
+    .. [Abramowitz64] Abramowitz M., Stegun I.A. (1964), Handbook of Mathematical
+        Functions, National Bureau of Standards, eqs. 5.1.53 and 5.1.56.
+    '''
+    x=np.asarray(x, dtype=float)
+    e1=np.empty(x.shape)
+    small=x<=1.
+    xs=x[small]
+    a0,a1,a2,a3,a4,a5=_E1_SMALL
+    e1[small]=a0+xs*(a1+xs*(a2+xs*(a3+xs*(a4+xs*a5))))-np.log(xs)
+    xl=x[~small]
+    b4,b3,b2,b1=_E1_NUM
+    c4,c3,c2,c1=_E1_DEN
+    e1[~small]=(np.exp(-xl)/xl*(b4+xl*(b3+xl*(b2+xl*(b1+xl))))
+                /(c4+xl*(c3+xl*(c2+xl*(c1+xl)))))
+    return e1[()]
+
+def exp1(x, fast_expint=False):
+    '''Exponential integral E1(x)=-Ei(-x) used in the PROSPECT transmission.
+
+    Parameters
+    ----------
+    x : float or array_like
+        positive argument.
+    fast_expint : bool, optional
+        use the approximation of :func:`exp1_fast` instead of scipy.
+
+    Returns
+    -------
+    e1 : float or array_like
+        exponential integral E1(x).
+    '''
+    if fast_expint:
+        return exp1_fast(x)
+    return -expi(-x)
+
 def Prospect5(Nleaf,Cab,Car,Cbrown,Cw,Cm):
     '''PROSPECT 5 Plant leaf reflectance and transmittance modeled 
     from 400 nm to 2500 nm (1 nm step).
@@ -117,7 +189,8 @@ def Prospect5(Nleaf,Cab,Car,Cbrown,Cw,Cm):
     
     alpha=40.
     # reflectance and transmittance of one layer
-    rho, tau, Ra, Ta = refl_trans_one_layer (alpha, refr_index, trans)
+    rho, tau, Ra, Ta = refl_trans_one_layer (alpha, refr_index, trans,
+                                             interface=interface_coefficients(alpha))
     # reflectance and transmittance of multiple layers
     rho, tau = reflectance_N_layers_Stokes(rho, tau, Ra, Ta, Nleaf)
     
@@ -205,7 +278,8 @@ def Prospect5_vec(Nleaf,Cab,Car,Cbrown,Cw,Cm):
     
     alpha=40.
     # reflectance and transmittance of one layer
-    rho, tau, Ra, Ta = refl_trans_one_layer (alpha, refr_index, trans)
+    rho, tau, Ra, Ta = refl_trans_one_layer (alpha, refr_index, trans,
+                                             interface=interface_coefficients(alpha))
     # reflectance and transmittance of multiple layers
     rho, tau = reflectance_N_layers_Stokes_vec(rho, tau, Ra, Ta, Nleaf)
     
@@ -307,7 +381,7 @@ def Prospect5_wl(wl,Nleaf,Cab,Car,Cbrown,Cw,Cm):
     return wl, rho, tau
     
     
-def ProspectD(Nleaf,Cab,Car,Cbrown,Cw,Cm, Ant):
+def ProspectD(Nleaf,Cab,Car,Cbrown,Cw,Cm, Ant, fast_expint=False):
     '''PROSPECT 5 Plant leaf reflectance and transmittance modeled 
     from 400 nm to 2500 nm (1 nm step).
 
@@ -325,6 +399,9 @@ def ProspectD(Nleaf,Cab,Car,Cbrown,Cw,Cm, Ant):
         equivalent water thickness (g cm-2 or cm).
     Cm  : float
         dry matter content (g cm-2).
+    fast_expint : bool, optional
+        use the approximation of :func:`exp1_fast` for the exponential integral
+        in the transmission, faster but with an absolute error up to 2e-7.
 
     Returns
     -------
@@ -376,13 +453,14 @@ def ProspectD(Nleaf,Cab,Car,Cbrown,Cw,Cm, Ant):
         +Cm*np.array(Cm_k)+Ant*np.array(Ant_k))/Nleaf
     k[k<=0]=0
     
-    trans=(1.-k)*np.exp(-k)-k**2.*expi(-k)
+    trans=(1.-k)*np.exp(-k)+k**2.*exp1(k, fast_expint)
     #trans=(1.-k)*np.exp(-k)+k**2.*expn(1.,k)
     trans[k<=0.0]=1.0
     
     alpha=40.
     # reflectance and transmittance of one layer
-    rho, tau, Ra, Ta = refl_trans_one_layer (alpha, refr_index, trans)
+    rho, tau, Ra, Ta = refl_trans_one_layer (alpha, refr_index, trans,
+                                             interface=interface_coefficients(alpha))
     # reflectance and transmittance of multiple layers
     rho, tau = reflectance_N_layers_Stokes(rho, tau, Ra, Ta, Nleaf)
     
@@ -451,7 +529,7 @@ def reflectance_N_layers_Stokes_vec(r, t, Ra, Ta, Nleaf):
     
     return refl, tran
     
-def ProspectD_vec(Nleaf,Cab,Car,Cbrown,Cw,Cm, Ant):
+def ProspectD_vec(Nleaf,Cab,Car,Cbrown,Cw,Cm, Ant, fast_expint=False):
     '''PROSPECT 5 Plant leaf reflectance and transmittance modeled 
     from 400 nm to 2500 nm (1 nm step).
 
@@ -469,6 +547,9 @@ def ProspectD_vec(Nleaf,Cab,Car,Cbrown,Cw,Cm, Ant):
         equivalent water thickness (g cm-2 or cm).
     Cm  : float
         dry matter content (g cm-2).
+    fast_expint : bool, optional
+        use the approximation of :func:`exp1_fast` for the exponential integral
+        in the transmission, faster but with an absolute error up to 2e-7.
 
     Returns
     -------
@@ -529,19 +610,20 @@ def ProspectD_vec(Nleaf,Cab,Car,Cbrown,Cw,Cm, Ant):
         +Cm*np.array(Cm_k)+Ant*np.array(Ant_k))/Nleaf
     k[k<=0]=0
      
-    trans=(1.-k)*np.exp(-k)+k**2.*(-expi(-k))
+    trans=(1.-k)*np.exp(-k)+k**2.*exp1(k, fast_expint)
     trans[k<=0.0]=1.0
     
     alpha=40.
     # reflectance and transmittance of one layer
-    rho, tau, Ra, Ta = refl_trans_one_layer (alpha, refr_index, trans)
+    rho, tau, Ra, Ta = refl_trans_one_layer (alpha, refr_index, trans,
+                                             interface=interface_coefficients(alpha))
     # reflectance and transmittance of multiple layers
     rho, tau = reflectance_N_layers_Stokes_vec(rho, tau, Ra, Ta, Nleaf)
     
     return l, rho, tau
 
 
-def ProspectD_wl(wl,Nleaf,Cab,Car,Cbrown,Cw,Cm, Ant):
+def ProspectD_wl(wl,Nleaf,Cab,Car,Cbrown,Cw,Cm, Ant, fast_expint=False):
     '''PROSPECT 5 Plant leaf reflectance and transmittance modeled 
     from a single given wavelenght. Aimed for computation speed.
 
@@ -561,6 +643,9 @@ def ProspectD_wl(wl,Nleaf,Cab,Car,Cbrown,Cw,Cm, Ant):
         equivalent water thickness (g cm-2 or cm).
     Cm  : float
         dry matter content (g cm-2).
+    fast_expint : bool, optional
+        use the approximation of :func:`exp1_fast` for the exponential integral
+        in the transmission, faster but with an absolute error up to 2e-7.
 
     Returns
     -------
@@ -606,32 +691,459 @@ def ProspectD_wl(wl,Nleaf,Cab,Car,Cbrown,Cw,Cm, Ant):
     # chestnut (D) 1.826   47.7  0.000307  0.004305
     #==============================================================================
 
-    wl_index=wls==wl
-    Cab_abs=float(Cab_k[wl_index])
-    Car_abs=float(Car_k[wl_index])
-    Cbrown_abs=float(Cbrown_k[wl_index])
-    Cw_abs=float(Cw_k[wl_index])
-    Cm_abs=float(Cm_k[wl_index])
-    Ant_abs=float(Ant_k[wl_index])
-    n=float(refr_index[wl_index])
+    # Single band run of the band-subset model
+    wl_index=get_band_index(wl)
+    _, rho, tau = ProspectD_bands(wl_index,Nleaf,Cab,Car,Cbrown,Cw,Cm, Ant,
+                                  fast_expint=fast_expint)
     
-    k=(Cab*Cab_abs+Car*Car_abs+Cbrown*Cbrown_abs
-        +Cw*Cw_abs+Cm*Cm_abs+Ant*Ant_abs)/Nleaf
-    if k<=0.: 
-        trans=1.0
-    else:
-        trans=(1.-k)*np.exp(-k)+(k**2)*(-expi(-k))
-        if trans <0.0:trans=0.0
+    return wl, float(rho[0]), float(tau[0])
+
+# Absorption coefficients and refractive index for each band subset, keyed by band indices
+_band_cache = {}
+
+def get_band_index(wl):
+    '''Indices of the simulated wavelengths in the PROSPECT spectral library.
+
+    Compute them once and pass them to :func:`ProspectD_bands` or
+    :func:`ProspectD_bands_vec` to run PROSPECT only at those wavelengths.
+
+    Parameters
+    ----------
+    wl : float or array_like
+        wavelenghts (nm) to simulate, must be in the 400-2500 nm, 1 nm step grid.
+
+    Returns
+    -------
+    band_index : 1D array of int
+        position of each wavelenght in :data:`wls`, same order as ``wl``.
+    '''
+    wl=np.atleast_1d(np.asarray(wl, dtype=float))
+    band_index=np.searchsorted(wls, wl)
+    valid=band_index<len(wls)
+    valid[valid]=wls[band_index[valid]]==wl[valid]
+    if not np.all(valid):
+        raise ValueError('Wavelengths %s not in the PROSPECT spectral library'%wl[~valid])
+    return band_index
+
+def band_coefficients(band_index):
+    '''Subset of the PROSPECT-D coefficients at the given bands.
+
+    Parameters
+    ----------
+    band_index : array_like of int
+        position of the bands in :data:`wls`, see :func:`get_band_index`.
+
+    Returns
+    -------
+    l : 1D array
+        wavelenghts (nm).
+    nr : 1D array
+        refractive index.
+    K : 2D array
+        specific absorption coefficients of Cab, Car, Cbrown, Cw, Cm and Ant,
+        size 6 x n_bands.
+    '''
+    key=tuple(int(i) for i in np.atleast_1d(band_index))
+    try:
+        return _band_cache[key]
+    except KeyError:
+        pass
+    index=np.asarray(key, dtype=int)
+    l=np.array(wls)[index]
+    nr=np.array(refr_index)[index]
+    K=np.array([np.array(Cab_k)[index],
+                np.array(Car_k)[index],
+                np.array(Cbrown_k)[index],
+                np.array(Cw_k)[index],
+                np.array(Cm_k)[index],
+                np.array(Ant_k)[index]])
+    for value in (l, nr, K):
+        value.setflags(write=False)
+    _band_cache[key]=l, nr, K
+    return l, nr, K
+
+def ProspectD_bands(band_index,Nleaf,Cab,Car,Cbrown,Cw,Cm, Ant, fast_expint=False):
+    '''PROSPECT D Plant leaf reflectance and transmittance modeled 
+    only at a precomputed subset of bands. Aimed for computation speed
+    when inverting multispectral data.
+
+    Parameters
+    ----------    
+    band_index : array_like of int
+        position of the bands to simulate, see :func:`get_band_index`.
+    N   : float
+        leaf structure parameter.
+    Cab : float
+        chlorophyll a+b content (mug cm-2).
+    Car : float
+        carotenoids content (mug cm-2).
+    Cbrown : float
+        brown pigments concentration (unitless).
+    Cw  : float
+        equivalent water thickness (g cm-2 or cm).
+    Cm  : float
+        dry matter content (g cm-2).
+    Ant : float
+        anthocyanins content (mug cm-2).
+    fast_expint : bool, optional
+        use the approximation of :func:`exp1_fast` for the exponential integral
+        in the transmission, faster but with an absolute error up to 2e-7.
+
+    Returns
+    -------
+    l : array_like
+        wavelenght (nm).
+    rho : array_like
+        leaf reflectance .
+    tau : array_like
+        leaf transmittance .
+    '''
+    l, nr, K = band_coefficients(band_index)
+    k=np.dot((Cab,Car,Cbrown,Cw,Cm,Ant), K)/Nleaf
+    k[k<=0]=0
+    
+    trans=(1.-k)*np.exp(-k)+k**2.*exp1(k, fast_expint)
+    trans[k<=0.0]=1.0
     
     alpha=40.
     # reflectance and transmittance of one layer
-    rho, tau, Ra, Ta = refl_trans_one_layer (alpha, n, trans)
+    rho, tau, Ra, Ta = refl_trans_one_layer (alpha, nr, trans,
+                                             interface=interface_coefficients(alpha, band_index))
     # reflectance and transmittance of multiple layers
     rho, tau = reflectance_N_layers_Stokes(rho, tau, Ra, Ta, Nleaf)
     
-    return wl, rho, tau
+    return l, rho, tau
+
+def ProspectD_bands_vec(band_index,Nleaf,Cab,Car,Cbrown,Cw,Cm, Ant, fast_expint=False):
+    '''PROSPECT D Plant leaf reflectance and transmittance modeled 
+    only at a precomputed subset of bands, for an array of leaves.
+
+    Parameters
+    ----------    
+    band_index : array_like of int
+        position of the bands to simulate, see :func:`get_band_index`.
+    N   : 1D array
+        leaf structure parameter.
+    Cab : 1D array
+        chlorophyll a+b content (mug cm-2).
+    Car : 1D array
+        carotenoids content (mug cm-2).
+    Cbrown : 1D array
+        brown pigments concentration (unitless).
+    Cw  : 1D array
+        equivalent water thickness (g cm-2 or cm).
+    Cm  : 1D array
+        dry matter content (g cm-2).
+    Ant : 1D array
+        anthocyanins content (mug cm-2).
+    fast_expint : bool, optional
+        use the approximation of :func:`exp1_fast` for the exponential integral
+        in the transmission, faster but with an absolute error up to 2e-7.
+
+    Returns
+    -------
+    l : 1D array
+        wavelenght (nm).
+    rho : 2D array
+        leaf reflectance, size n_leaves x n_bands.
+    tau : 2D array
+        leaf transmittance, size n_leaves x n_bands.
+    '''
+    l, nr, K = band_coefficients(band_index)
+    # Vectorize the inputs
+    Nleaf=np.asarray(Nleaf, dtype=float)[:,np.newaxis]
+    params=np.column_stack((Cab,Car,Cbrown,Cw,Cm,Ant)).astype(float)
+    k=np.dot(params, K)/Nleaf
+    k[k<=0]=0
+     
+    trans=(1.-k)*np.exp(-k)+k**2.*exp1(k, fast_expint)
+    trans[k<=0.0]=1.0
+    
+    alpha=40.
+    # reflectance and transmittance of one layer
+    rho, tau, Ra, Ta = refl_trans_one_layer (alpha, nr, trans,
+                                             interface=interface_coefficients(alpha, band_index))
+    # reflectance and transmittance of multiple layers
+    rho, tau = reflectance_N_layers_Stokes_vec(rho, tau, Ra, Ta, Nleaf)
+    
+    return l, rho, tau
+
+class ProspectDEngine(object):
+    '''Reusable PROSPECT-D model for repeated runs on a fixed set of wavelengths.
+
+    The specific absorption coefficients are stacked in a single 7 x n_wl
+    matrix (the first row, for N_leaf, is zero), so the absorption of a batch
+    of leaves is a single matrix product with the parameter rows. Interface
+    coefficients and intermediate arrays are computed once and reused, and the
+    outputs are written in caller-supplied or pooled buffers.
+
+    Parameters
+    ----------
+    band_index : array_like of int, optional
+        position of the bands to simulate, see :func:`get_band_index`.
+        Default the full spectrum (400-2500 nm).
+    fast_expint : bool, optional
+        use the approximation of :func:`exp1_fast` for the exponential integral.
+    alpha : float, optional
+        maximum incidence angle (degrees) at the leaf surface.
+    grid : float or 1D array, optional
+        run on a coarser spectral grid instead, either the band centres (nm)
+        or the step (nm) of a regular grid between 400 and 2500 nm. The
+        coefficients are band-averaged with
+        :func:`spectral_library.get_spectra_grid`.
+
+    Examples
+    --------
+    >>> engine = ProspectDEngine()
+    >>> params = np.array([[1.5, 40., 8., 0., 0.01, 0.009, 1.]])
+    >>> rho, tau = engine.run(params)
+    '''
+
+    def __init__(self, band_index=None, fast_expint=False, alpha=40., grid=None):
+        if grid is not None:
+            if band_index is not None:
+                raise ValueError('band_index and grid cannot be used together')
+            from pyPro4Sail.spectral_library import get_spectra_grid
+            wl, nr, Cab, Car, Cbrown, Cw, Cm, Ant = get_spectra_grid(grid)
+            K = np.array([Cab, Car, Cbrown, Cw, Cm, Ant])
+            interface = calc_interface(alpha, nr)
+        elif band_index is None:
+            wl = np.array(wls)
+            K = np.array([Cab_k, Car_k, Cbrown_k, Cw_k, Cm_k, Ant_k])
+            interface = interface_coefficients(alpha)
+        else:
+            band_index = np.atleast_1d(band_index)
+            wl, _, K = band_coefficients(band_index)
+            interface = interface_coefficients(alpha, band_index)
+        self.wl = wl
+        self.band_index = band_index
+        self.fast_expint = fast_expint
+        # Rows in paramsProspect5 order, N_leaf does not contribute to absorption
+        self.K = np.zeros((len(paramsProspect5), len(wl)))
+        self.K[1:] = K
+        self.K.setflags(write=False)
+        talf, ralf, t12, r12, t21, r21 = interface
+        self._ralf = ralf
+        self._r12 = r12
+        self._r21 = r21
+        self._talf_t21 = talf*t21
+        self._t12_t21 = t12*t21
+        self._workspace = None
+
+    def get_workspace(self, n_leaves):
+        '''Pooled intermediate and output arrays for a batch of n_leaves.'''
+        shape = (n_leaves, len(self.wl))
+        if self._workspace is None or self._workspace['k'].shape != shape:
+            self._workspace = dict((name, np.empty(shape)) for name in
+                                   ('k', 'trans', 'w1', 'w2', 'w3',
+                                    'Ra', 'Ta', 'r', 't', 'rho', 'tau'))
+            self._workspace['mask'] = np.empty(shape, dtype=bool)
+        return self._workspace
+
+    def run(self, params, rho=None, tau=None):
+        '''Leaf reflectance and transmittance for a batch of leaves.
 
-def refl_trans_one_layer (alpha, nr, tau):
+        Parameters
+        ----------
+        params : 2D array
+            PROSPECT-D parameters, one leaf per row in the order of
+            :data:`paramsProspect5` (N_leaf, Cab, Car, Cbrown, Cw, Cm, Ant).
+        rho, tau : 2D array, optional
+            output arrays of size n_leaves x n_wl. If not given the pooled
+            buffers of the engine are used, which are overwritten by the next call.
+
+        Returns
+        -------
+        rho : 2D array
+            leaf reflectance, size n_leaves x n_wl.
+        tau : 2D array
+            leaf transmittance, size n_leaves x n_wl.
+        '''
+        params = np.atleast_2d(np.asarray(params, dtype=float))
+        ws = self.get_workspace(params.shape[0])
+        if rho is None:
+            rho = ws['rho']
+        if tau is None:
+            tau = ws['tau']
+        k, trans, w1, w2, w3 = ws['k'], ws['trans'], ws['w1'], ws['w2'], ws['w3']
+        Ra, Ta, r, t, mask = ws['Ra'], ws['Ta'], ws['r'], ws['t'], ws['mask']
+        Nleaf = params[:, :1]
+
+        # Absorption
+        np.dot(params, self.K, out=k)
+        k /= Nleaf
+        np.less_equal(k, 0., out=mask)
+        k[mask] = 0.
+
+        # Transmission (1-k)*exp(-k)+k**2*E1(k)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            np.negative(k, out=w1)
+            np.exp(w1, out=w1)
+            np.subtract(1., k, out=trans)
+            trans *= w1
+            if self.fast_expint:
+                w2[...] = exp1_fast(k)
+            else:
+                from scipy.special import expi as _expi
+                np.negative(k, out=w2)
+                _expi(w2, out=w2)
+                np.negative(w2, out=w2)
+            w2 *= k
+            w2 *= k
+            trans += w2
+        trans[mask] = 1.
+
+        # Reflectance and transmittance of one layer, see refl_trans_one_layer
+        np.multiply(trans, self._r21, out=w1)
+        np.square(w1, out=w1)
+        np.subtract(1., w1, out=w1)
+        np.multiply(trans, self._talf_t21, out=Ta)
+        Ta /= w1
+        np.multiply(trans, self._r21, out=Ra)
+        Ra *= Ta
+        Ra += self._ralf
+        np.multiply(trans, self._t12_t21, out=t)
+        t /= w1
+        np.multiply(trans, self._r21, out=r)
+        r *= t
+        r += self._r12
+
+        # Reflectance and transmittance of N layers, see reflectance_N_layers_Stokes
+        # k and trans are reused to store b and a
+        a, b = trans, k
+        np.add(r, t, out=w1)
+        w1 += 1.
+        np.subtract(r, t, out=w2)
+        w2 += 1.
+        w1 *= w2
+        np.subtract(t, r, out=w2)
+        w2 += 1.
+        w1 *= w2
+        np.add(r, t, out=w2)
+        np.subtract(1., w2, out=w2)
+        w1 *= w2
+        np.sqrt(w1, out=w1)
+        np.square(r, out=w2)
+        np.square(t, out=w3)
+        w2 -= w3
+        np.add(w1, w2, out=a)
+        a += 1.
+        np.multiply(r, 2., out=w3)
+        a /= w3
+        np.subtract(w1, w2, out=b)
+        b += 1.
+        np.multiply(t, 2., out=w3)
+        b /= w3
+        # b**(N-1), (b**(N-1))**2 and a**2
+        np.power(b, Nleaf-1., out=b)
+        np.square(b, out=w1)
+        np.square(a, out=w2)
+        np.multiply(w2, w1, out=w3)
+        w3 -= 1.
+        # Rsub in w1 and Tsub in w2
+        w1 -= 1.
+        w1 *= a
+        w1 /= w3
+        w2 -= 1.
+        w2 *= b
+        w2 /= w3
+        # Case of zero absorption
+        np.add(r, t, out=w3)
+        np.greater_equal(w3, 1., out=mask)
+        if mask.any():
+            t_j = t[mask]
+            N_j = np.broadcast_to(Nleaf, mask.shape)[mask]
+            w2[mask] = t_j/(t_j+(1.-t_j)*(N_j-1.))
+            w1[mask] = 1.-w2[mask]
+
+        # Combine top layer with next N-1 layers
+        np.multiply(w1, r, out=w3)
+        np.subtract(1., w3, out=w3)
+        np.multiply(Ta, w2, out=tau)
+        tau /= w3
+        np.multiply(Ta, w1, out=rho)
+        rho *= t
+        rho /= w3
+        rho += Ra
+        return rho, tau
+
+def calc_interface(alpha, nr):
+    '''Reflectivity and transmissivity at the leaf interface.
+
+    Parameters
+    ----------
+    alpha : float
+        maximum incidence angle (degrees).
+    nr : array_like
+        refractive index.
+
+    Returns
+    -------
+    talf, ralf : array_like
+        transmissivity and reflectivity for incidence angles up to alpha.
+    t12, r12 : array_like
+        transmissivity and reflectivity from the outside to the leaf (isotropic).
+    t21, r21 : array_like
+        transmissivity and reflectivity from the leaf to the outside (isotropic).
+    '''
+    talf = tav (alpha, nr)
+    ralf = 1.0-talf
+    t12 = tav (90., nr)
+    r12 = 1. - t12
+    t21 = t12/nr**2
+    r21 = 1-t21
+    return talf, ralf, t12, r12, t21, r21
+
+# Interface coefficients for the PROSPECT refractive index, keyed by (alpha, wavelength indices)
+_interface_cache = {}
+
+def interface_coefficients(alpha=40., wl_index=None):
+    '''Cached reflectivity and transmissivity at the leaf interface.
+
+    The interface coefficients only depend on alpha and the (fixed) refractive
+    index, so they are computed once per alpha and wavelength subset and
+    reused in every PROSPECT call.
+
+    Parameters
+    ----------
+    alpha : float
+        maximum incidence angle (degrees).
+    wl_index : int or array_like of int, optional
+        indices of the simulated wavelengths in :data:`wls`,
+        default use the full spectrum (400-2500 nm).
+
+    Returns
+    -------
+    interface : tuple
+        (talf, ralf, t12, r12, t21, r21), see :func:`calc_interface`.
+        Floats for a single wavelength index, read-only arrays otherwise.
+    '''
+    if wl_index is None:
+        key = None
+    elif np.ndim(wl_index) == 0:
+        key = int(wl_index)
+    else:
+        key = tuple(int(i) for i in wl_index)
+    key = (float(alpha), key)
+    try:
+        return _interface_cache[key]
+    except KeyError:
+        pass
+
+    if key[1] is None:
+        nr = np.array(refr_index)
+    else:
+        nr = np.array(refr_index)[np.asarray(key[1])]
+    interface = calc_interface(key[0], nr)
+    if np.ndim(nr) == 0:
+        interface = tuple(float(value) for value in interface)
+    else:
+        for value in interface:
+            value.setflags(write=False)
+    _interface_cache[key] = interface
+    return interface
+
+def refl_trans_one_layer (alpha, nr, tau, interface=None):
     # ***********************************************************************
     # reflectance and transmittance of one layer
     # ***********************************************************************
@@ -639,14 +1151,12 @@ def refl_trans_one_layer (alpha, nr, tau):
     # Interaction of isotropic ligth with a compact plant leaf, J. Opt.
     # Soc. Am., 59(10):1376-1379.
     # ***********************************************************************
-    # reflectivity and transmissivity at the interface
+    # reflectivity and transmissivity at the interface, use the precomputed
+    # coefficients from interface_coefficients if available
     #-------------------------------------------------   
-    talf = tav (alpha, nr)
-    ralf = 1.0-talf
-    t12 = tav (90., nr)
-    r12 = 1. - t12
-    t21 = t12/nr**2
-    r21 = 1-t21
+    if interface is None:
+        interface = calc_interface(alpha, nr)
+    talf, ralf, t12, r12, t21, r21 = interface
 
     # top surface side
     denom = 1. - r21**2 * tau**2
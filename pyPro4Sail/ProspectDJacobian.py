@@ -16,6 +16,7 @@ PACKAGE CONTENTS
 ================
 * :func:`JacProspectD` Computes the PROSPECTD Jacobian.
 * :func:`JacProspectD_wl` Computes the PROSPECTD Jacobian for a specific wavelenght, aimed for computing speed.
+* :func:`JacProspectD_vec` Computes the PROSPECTD Jacobian for an array of leaves, full spectrum or a precomputed set of bands.
 
 Ancillary functions
 -------------------
@@ -35,14 +36,19 @@ EXAMPLE
 
 # Extinction coefficients and refractive index
 from pyPro4Sail import spectral_lib
-from scipy.special import expn, expi
+from pyPro4Sail.ProspectD import interface_coefficients, exp1, band_coefficients
 import numpy as np
 
 wls,refr_index,Cab_k,Car_k,Cbrown_k,Cw_k,Cm_k,Ant_k=spectral_lib
 
 paramsProspectD=('N_leaf','Cab','Car','Cbrown','Cw','Cm', 'Ant')
 
-def JacProspectD(Nleaf,Cab,Car,Cbrown,Cw,Cm, Ant):
+def expn(n, x):
+    '''Generalized exponential integral En, scipy.special is only imported on first use.'''
+    from scipy.special import expn as _expn
+    return _expn(n, x)
+
+def JacProspectD(Nleaf,Cab,Car,Cbrown,Cw,Cm, Ant, fast_expint=False):
     '''PROSPECT 5 Plant leaf reflectance and transmittance modeled 
     from 400 nm to 2500 nm (1 nm step).
 
@@ -60,6 +66,9 @@ def JacProspectD(Nleaf,Cab,Car,Cbrown,Cw,Cm, Ant):
         equivalent water thickness (g cm-2 or cm).
     Cm  : float
         dry matter content (g cm-2).
+    fast_expint : bool, optional
+        use the approximation of :func:`ProspectD.exp1_fast` for the exponential
+        integral in the transmission, faster but with an absolute error up to 2e-7.
 
     Returns
     -------
@@ -109,13 +118,16 @@ def JacProspectD(Nleaf,Cab,Car,Cbrown,Cw,Cm, Ant):
                         np.array(Cw_k)/float(Nleaf),
                         np.array(Cm_k)/float(Nleaf),
                         np.array(Ant_k)/float(Nleaf)])
+    Delta_k[:,k<=0]=0
     k[k<=0]=0
-    Delta_k[k<=0]=0    
-    trans=(1.-k)*np.exp(-k) + k**2.*expn(1,k)
+    # E0(k)=exp(-k)/k, E1(k) from scipy or the fast approximation
+    e1=exp1(k, fast_expint)
+    e0=np.exp(-k)/k
+    trans=(1.-k)*np.exp(-k) + k**2.*e1
     Delta_trans = -Delta_k * (np.exp(-k) + (1.-k)*np.exp(-k) 
-                            - 2.*k*expn(1,k) + k**2 *expn(0,k))
+                            - 2.*k*e1 + k**2 *e0)
     trans[k<=0]=1
-    Delta_trans[k<=0]=0    
+    Delta_trans[:,k<=0]=0    
     
     # reflectance and transmittance of one layer
     alpha=40.
@@ -130,7 +142,8 @@ def JacProspectD(Nleaf,Cab,Car,Cbrown,Cw,Cm, Ant):
      Delta_Ta] = Jac_refl_trans_one_layer (alpha, 
                                            refr_index, 
                                            trans, 
-                                           Delta_trans)          
+                                           Delta_trans,
+                                           interface=interface_coefficients(alpha))
      
 
     # reflectance and transmittance of multiple layers
@@ -146,6 +159,107 @@ def JacProspectD(Nleaf,Cab,Car,Cbrown,Cw,Cm, Ant):
     
     return l, rho, tau, Delta_rho, Delta_tau
 
+def JacProspectD_vec(Nleaf,Cab,Car,Cbrown,Cw,Cm,Ant,fast_expint=False,band_index=None):
+    '''PROSPECT D Plant leaf reflectance, transmittance and their Jacobians
+    for an array of leaves.
+
+    All the leaf parameters but N only act through the absorption k, so the
+    derivatives are propagated through the leaf layers with respect to k and N
+    only, sharing the transmission and Stokes intermediates with the forward
+    model, and scaled by dk/dparameter at the end.
+
+    Parameters
+    ----------
+    N   : float or 1D array
+        leaf structure parameter.
+    Cab : float or 1D array
+        chlorophyll a+b content (mug cm-2).
+    Car : float or 1D array
+        carotenoids content (mug cm-2).
+    Cbrown : float or 1D array
+        brown pigments concentration (unitless).
+    Cw  : float or 1D array
+        equivalent water thickness (g cm-2 or cm).
+    Cm  : float or 1D array
+        dry matter content (g cm-2).
+    Ant : float or 1D array
+        anthocyanins content (mug cm-2).
+    fast_expint : bool, optional
+        use the approximation of :func:`ProspectD.exp1_fast` for the exponential
+        integral in the transmission, faster but with an absolute error up to 2e-7.
+    band_index : array_like of int, optional
+        position of the bands to simulate, see :func:`ProspectD.get_band_index`,
+        default simulate the full spectrum (400-2500 nm).
+
+    Returns
+    -------
+    l : 1D array
+        wavelenght (nm).
+    rho : 2D array
+        leaf reflectance, size n_leaves x n_wl.
+    tau : 2D array
+        leaf transmittance, size n_leaves x n_wl.
+    Delta_rho : 3D array
+        Jacobian of the leaf reflectance, size n_leaves x 7 x n_wl,
+        in the order of :data:`paramsProspectD`.
+    Delta_tau : 3D array
+        Jacobian of the leaf transmittance, size n_leaves x 7 x n_wl.
+    '''
+
+    if band_index is None:
+        l=np.array(wls)
+        nr=np.array(refr_index)
+        K=np.array([Cab_k,Car_k,Cbrown_k,Cw_k,Cm_k,Ant_k],dtype=float)
+    else:
+        l,nr,K=band_coefficients(band_index)
+    # Vectorize the inputs
+    Nleaf,Cab,Car,Cbrown,Cw,Cm,Ant=np.broadcast_arrays(*[np.asarray(param,dtype=float).reshape(-1)
+                                            for param in (Nleaf,Cab,Car,Cbrown,Cw,Cm,Ant)])
+    params=np.column_stack((Cab,Car,Cbrown,Cw,Cm,Ant))
+    Nleaf=Nleaf[:,np.newaxis]
+    k=np.dot(params,K)/Nleaf
+    absorbing=k>0
+    k[~absorbing]=0
+    # E1(k) from scipy or the fast approximation, dtrans/dk=2*(k*E1(k)-exp(-k))
+    e1=exp1(k, fast_expint)
+    expk=np.exp(-k)
+    trans=(1.-k)*expk+k**2.*e1
+    Delta_trans=2.*(k*e1-expk)
+    trans[~absorbing]=1
+    Delta_trans[~absorbing]=0
+
+    # reflectance and transmittance of one layer, derivatives with respect to k
+    alpha=40.
+    r,t,Ra,Ta,Delta_r,Delta_t,Delta_Ra,Delta_Ta=Jac_refl_trans_one_layer(alpha,
+                                                    nr,
+                                                    trans,
+                                                    Delta_trans,
+                                                    interface=interface_coefficients(alpha,band_index))
+
+    # reflectance and transmittance of multiple layers, the derivatives are
+    # computed along N (row 0, with dk/dN=-k/N) and along k (row 1)
+    Delta_kN=-k/Nleaf
+    rho,tau,Delta_rho_layers,Delta_tau_layers=Jac_reflectance_N_layers_Stokes_vec(r,
+                                    t,
+                                    Ra,
+                                    Ta,
+                                    Nleaf,
+                                    np.stack((Delta_r*Delta_kN,Delta_r)),
+                                    np.stack((Delta_t*Delta_kN,Delta_t)),
+                                    np.stack((Delta_Ra*Delta_kN,Delta_Ra)),
+                                    np.stack((Delta_Ta*Delta_kN,Delta_Ta)))
+
+    # chain rule with dk/dparam=K/N for the leaf constituents
+    Delta_kparams=K/Nleaf[:,:,np.newaxis]
+    Delta_rho=np.empty((rho.shape[0],7,rho.shape[1]))
+    Delta_rho[:,0]=Delta_rho_layers[0]
+    Delta_rho[:,1:]=Delta_rho_layers[1][:,np.newaxis]*Delta_kparams
+    Delta_tau=np.empty(Delta_rho.shape)
+    Delta_tau[:,0]=Delta_tau_layers[0]
+    Delta_tau[:,1:]=Delta_tau_layers[1][:,np.newaxis]*Delta_kparams
+
+    return l, rho, tau, Delta_rho, Delta_tau
+
 def Jac_reflectance_N_layers_Stokes(r90, 
                                     t90, 
                                     Ra, 
@@ -203,7 +317,62 @@ def Jac_reflectance_N_layers_Stokes(r90,
     
     return rho, tau, Delta_rho, Delta_tau
 
-def Jac_refl_trans_one_layer (alpha, nr, tau, Delta_tau):
+def Jac_reflectance_N_layers_Stokes_vec(r,t,Ra,Ta,Nleaf,Delta_r,Delta_t,Delta_Ra,Delta_Ta):
+    #==============================================================================
+    # reflectance and transmittance of N layers for an array of leaves, same
+    # formulation as ProspectD.reflectance_N_layers_Stokes_vec. The Delta arrays
+    # stack the derivatives along their first axis, the first row is the one
+    # with respect to N.
+    # Stokes G.G. (1862), On the intensity of the light reflected from
+    # or transmitted through a pile of plates, Proc. Roy. Soc. Lond.,
+    # 11:545-556.
+    #==============================================================================
+    Delta_N=np.zeros((Delta_r.shape[0],)+(1,)*r.ndim)
+    Delta_N[0]=1.
+
+    D=np.sqrt((1.+r+t)*(1.+r-t)*(1.-r+t)*(1.-r-t))
+    Delta_D=-2.*(r*(1.-r**2+t**2)*Delta_r+t*(1.+r**2-t**2)*Delta_t)/D
+    a=(1.+r**2-t**2+D)/(2.*r)
+    Delta_a=(2.*r*Delta_r-2.*t*Delta_t+Delta_D-2.*a*Delta_r)/(2.*r)
+    b=(1.-r**2+t**2+D)/(2.*t)
+    Delta_b=(-2.*r*Delta_r+2.*t*Delta_t+Delta_D-2.*b*Delta_t)/(2.*t)
+
+    bNm1=np.power(b,Nleaf-1.)
+    Delta_bNm1=bNm1*((Nleaf-1.)*Delta_b/b+np.log(b)*Delta_N)
+    bN2=bNm1**2
+    Delta_bN2=2.*bNm1*Delta_bNm1
+    a2=a**2
+    Delta_a2=2.*a*Delta_a
+    denom=a2*bN2-1.
+    Delta_denom=Delta_a2*bN2+a2*Delta_bN2
+    Rsub=a*(bN2-1.)/denom
+    Delta_Rsub=(Delta_a*(bN2-1.)+a*Delta_bN2-Rsub*Delta_denom)/denom
+    Tsub=bNm1*(a2-1.)/denom
+    Delta_Tsub=(Delta_bNm1*(a2-1.)+bNm1*Delta_a2-Tsub*Delta_denom)/denom
+
+    # Case of zero absorption
+    j=r+t>=1.
+    if np.any(j):
+        Nleaf=np.broadcast_to(Nleaf,r.shape)
+        S=t+(1.-t)*(Nleaf-1.)
+        Delta_S=(2.-Nleaf)*Delta_t+(1.-t)*Delta_N
+        Tsub[j]=t[j]/S[j]
+        Rsub[j]=1.-Tsub[j]
+        Delta_Tsub[:,j]=(Delta_t[:,j]-Tsub[j]*Delta_S[:,j])/S[j]
+        Delta_Rsub[:,j]=-Delta_Tsub[:,j]
+
+    # Reflectance and transmittance of the leaf: combine top layer with next N-1 layers
+    denom=1.-Rsub*r
+    Delta_denom=-(Delta_Rsub*r+Rsub*Delta_r)
+    tau=Ta*Tsub/denom
+    Delta_tau=(Delta_Ta*Tsub+Ta*Delta_Tsub-tau*Delta_denom)/denom
+    rho=Ra+Ta*Rsub*t/denom
+    Delta_rho=Delta_Ra+(Delta_Ta*Rsub*t+Ta*Delta_Rsub*t+Ta*Rsub*Delta_t
+                        -(rho-Ra)*Delta_denom)/denom
+
+    return rho, tau, Delta_rho, Delta_tau
+
+def Jac_refl_trans_one_layer (alpha, nr, tau, Delta_tau, interface=None):
     # ***********************************************************************
     # reflectance and transmittance of one layer
     # ***********************************************************************
@@ -211,14 +380,18 @@ def Jac_refl_trans_one_layer (alpha, nr, tau, Delta_tau):
     # Interaction of isotropic ligth with a compact plant leaf, J. Opt.
     # Soc. Am., 59(10):1376-1379.
     # ***********************************************************************
-    # reflectivity and transmissivity at the interface
+    # reflectivity and transmissivity at the interface, use the precomputed
+    # coefficients from ProspectD.interface_coefficients if available
     #-------l, ------------------------------------------   
-    talf = tav (alpha, nr)
-    ralf = 1.0-talf
-    t12 = tav (90., nr)
-    r12 = 1. - t12
-    t21 = t12/nr**2
-    r21 = 1-t21
+    if interface is None:
+        talf = tav (alpha, nr)
+        ralf = 1.0-talf
+        t12 = tav (90., nr)
+        r12 = 1. - t12
+        t21 = t12/nr**2
+        r21 = 1-t21
+    else:
+        talf, ralf, t12, r12, t21, r21 = interface
 
     # top surface side
     denom = 1. - r21**2 * tau**2
@@ -237,7 +410,7 @@ def Jac_refl_trans_one_layer (alpha, nr, tau, Delta_tau):
     
     return r, t, Ra, Ta, Delta_r, Delta_t, Delta_Ra, Delta_Ta
 
-def JacProspectD_wl(wl,Nleaf,Cab,Car,Cbrown,Cw,Cm,Ant):
+def JacProspectD_wl(wl,Nleaf,Cab,Car,Cbrown,Cw,Cm,Ant, fast_expint=False):
     '''PROSPECT 5 Plant leaf reflectance and transmittance modeled 
     from a single given wavelenght. Aimed for computation speed.
 
@@ -257,6 +430,9 @@ def JacProspectD_wl(wl,Nleaf,Cab,Car,Cbrown,Cw,Cm,Ant):
         equivalent water thickness (g cm-2 or cm).
     Cm  : float
         dry matter content (g cm-2).
+    fast_expint : bool, optional
+        use the approximation of :func:`ProspectD.exp1_fast` for the exponential
+        integral in the transmission, faster but with an absolute error up to 2e-7.
 
     Returns
     -------
@@ -306,7 +482,7 @@ def JacProspectD_wl(wl,Nleaf,Cab,Car,Cbrown,Cw,Cm,Ant):
     # chestnut (D) 1.826   47.7  0.000307  0.004305
     #==============================================================================
 
-    wl_index=wls.index(wl)
+    wl_index=int(np.flatnonzero(wls==wl)[0])
     Cab_abs=float(Cab_k[wl_index])
     Car_abs=float(Car_k[wl_index])
     Cbrown_abs=float(Cbrown_k[wl_index])
@@ -331,9 +507,12 @@ def JacProspectD_wl(wl,Nleaf,Cab,Car,Cbrown,Cw,Cm,Ant):
                     Cm_abs/float(Nleaf),
                     Ant_abs/float(Nleaf)])
         
-    trans=(1.-k)*np.exp(-k) + k**2.*expn(1,k)
+    # E0(k)=exp(-k)/k, E1(k) from scipy or the fast approximation
+    e1=exp1(k, fast_expint)
+    e0=np.exp(-k)/k
+    trans=(1.-k)*np.exp(-k) + k**2.*e1
     Delta_trans = -Delta_k * (np.exp(-k) + (1.-k)*np.exp(-k) 
-                            - 2.*k*expn(1,k) + k**2 *expn(0,k))
+                            - 2.*k*e1 + k**2 *e0)
     
     # reflectance and transmittance of one layer
     alpha=40.
@@ -348,7 +527,8 @@ def JacProspectD_wl(wl,Nleaf,Cab,Car,Cbrown,Cw,Cm,Ant):
      Delta_Ta] = Jac_refl_trans_one_layer (alpha, 
                                            n, 
                                            trans, 
-                                           Delta_trans)          
+                                           Delta_trans,
+                                           interface=interface_coefficients(alpha, wl_index))
      
     #==============================================================================
     # reflectance and transmittance of one layer
@@ -1,2 +1,21 @@
-from .spectral_library import get_spectra
-spectral_lib = get_spectra()
\ No newline at end of file
+import importlib
+
+# Submodules and the PROSPECT-D spectral library are loaded on first access,
+# so that importing a forward model does not pull in the rest of the package
+_SUBMODULES = ('FourSAIL', 'FourSAILJacobian', 'ProspectD', 'ProspectDJacobian',
+               'FourSAILJit', 'pyPro4SAIL', 'cost_functions', 'ann_inversion', 'cma',
+               'spectral_library')
+
+def __getattr__(name):
+    if name == 'spectral_lib':
+        from .spectral_library import get_spectra
+        value = get_spectra()
+    elif name in _SUBMODULES:
+        value = importlib.import_module('.' + name, __name__)
+    else:
+        raise AttributeError("module %r has no attribute %r" % (__name__, name))
+    globals()[name] = value
+    return value
+
+def __dir__():
+    return sorted(set(globals()) | {'spectral_lib'} | set(_SUBMODULES))
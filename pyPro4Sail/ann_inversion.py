@@ -5,19 +5,14 @@ Created on Fri Jun 10 16:56:25 2016
 @author: hector
 """
 import numpy as np
-import sklearn.neural_network as ann_sklearn
 import pickle
-from sklearn.decomposition import PCA
-from sklearn.preprocessing import StandardScaler, MinMaxScaler, MaxAbsScaler
 from collections import OrderedDict
-from scipy.stats import pearsonr
-import matplotlib.pyplot as plt
-import matplotlib
 import pyPro4Sail.ProspectD as ProspectD 
 import pyPro4Sail.FourSAIL as FourSAIL 
+import pyPro4Sail.spectral_library as spectral_library
 import numpy.random as rnd
-from scipy.stats import gamma
-from scipy.ndimage.filters import gaussian_filter1d
+# sklearn, matplotlib and scipy are imported within the functions that use them
+# so that importing this module does not load them
 
 UNIFORM_DIST = 1
 GAUSSIAN_DIST = 2
@@ -89,7 +84,6 @@ LOG_MEAN = np.array([ 0.45475538,  3.52688334,  2.12818934, -4.60373468, -5.3695
 font = {'family' : 'monospace',
         'size'   : 8}
 
-matplotlib.rc('font', **font)
 prospect_bounds = {'N_leaf': (MIN_N_LEAF, MAX_N_LEAF),
                    'Cab': (MIN_CAB, MAX_CAB),
                    'Car': (MIN_CAR, MAX_CAR),
@@ -192,6 +186,10 @@ def train_ann(X_array,
              outfile=None,
              regressor_opts={'activation': 'logistic'}):
 
+    import sklearn.neural_network as ann_sklearn
+    from sklearn.decomposition import PCA
+    from sklearn.preprocessing import StandardScaler, MinMaxScaler, MaxAbsScaler
+
     print('Fitting Artificial Neural Network')
 
     Y_array = np.asarray(Y_array)
@@ -276,6 +274,12 @@ def test_ann(X_array,
              outfile=None,
              param_names=None):
     
+    from scipy.stats import pearsonr
+    import matplotlib
+    import matplotlib.pyplot as plt
+
+    matplotlib.rc('font', **font)
+
     print('Testing ANN fit')
     
     X_array = np.asarray(X_array)
@@ -335,6 +339,8 @@ def build_prospect_database(n_simulations,
                             outfile=None):
             
     
+    from scipy.stats import gamma
+
     print ('Build ProspectD database')
     input_param=dict()
     for param in param_bounds:
@@ -395,6 +401,8 @@ def build_prosail_database(n_simulations,
                            outfile=None):
             
     
+    from scipy.stats import gamma
+
     print ('Build ProspectD+4SAIL database')
     input_param=dict()
     for param in param_bounds:
@@ -442,7 +450,18 @@ def simulate_prospectD_lut(input_param,
                            srf=None,
                            outfile=None):            
     
-    [wls,r,t]=ProspectD.ProspectD_vec(input_param['N_leaf'],
+    from scipy.ndimage import gaussian_filter1d
+
+    if type(srf)==str:
+        srf=spectral_library.get_sensor_response(srf)
+    if isinstance(srf, spectral_library.SensorResponse):
+        # Run PROSPECT only at the wavelengths covered by the sensor bands
+        [wls,r,t]=ProspectD.ProspectD_bands_vec(srf.support,input_param['N_leaf'],
+                input_param['Cab'], input_param['Car'],
+                input_param['Cbrown'],input_param['Cw'],
+                input_param['Cm'],input_param['Ant'])
+    else:
+        [wls,r,t]=ProspectD.ProspectD_vec(input_param['N_leaf'],
                 input_param['Cab'], input_param['Car'],
                 input_param['Cbrown'],input_param['Cw'],
                 input_param['Cm'],input_param['Ant'])
@@ -450,7 +469,11 @@ def simulate_prospectD_lut(input_param,
     rho_leaf=[]
     tau_leaf=[]
 
-    if srf:
+    if isinstance(srf, spectral_library.SensorResponse):
+        rho_leaf=spectral_library.convolve_srf(r, srf)
+        tau_leaf=spectral_library.convolve_srf(t, srf)
+
+    elif srf:
         if type(srf)==float or type(srf)==int:
             wls_sim=np.asarray(wls_sim)
             #Convolve spectra by full width half maximum
@@ -498,24 +521,57 @@ def simulate_prosail_lut(input_param,
                          calc_FAPAR=False,
                          reduce_4sail=False):            
     
+    from scipy.ndimage import gaussian_filter1d
+
     print ('Starting Simulations')
 
-    # Calculate the lidf
-    lidf = FourSAIL.CalcLIDF_Campbell_vec(input_param['leaf_angle'])
-    #for i,wl in enumerate(wls_wim):
-    [wls,r,t] = ProspectD.ProspectD_vec(input_param['N_leaf'],
-                                        input_param['Cab'],
-                                        input_param['Car'],
-                                        input_param['Cbrown'],
-                                        input_param['Cw'],
-                                        input_param['Cm'],
-                                        input_param['Ant'])
+    if type(rsoil_vec) == str or type(rsoil_vec) == int:
+        # Same soil from the soil spectral library for all simulations, broadcast by FourSAIL_vec
+        _, rsoil_vec = spectral_library.get_soil_spectrum(rsoil_vec)
+        rsoil_vec = rsoil_vec[:, np.newaxis]
+
+    # Calculate the lidf, Verhoef's bimodal LIDF if its (LIDFa, LIDFb) parameters are given
+    if 'LIDFa' in input_param and 'LIDFb' in input_param:
+        lidf = FourSAIL.CalcLIDF_Verhoef_vec(input_param['LIDFa'], input_param['LIDFb'])
+    else:
+        lidf = FourSAIL.CalcLIDF_Campbell_vec(input_param['leaf_angle'])
+    if type(srf) == str:
+        srf = spectral_library.get_sensor_response(srf)
+    sensor_response = isinstance(srf, spectral_library.SensorResponse)
+    if sensor_response:
+        # Run the models only at the wavelengths covered by the sensor bands,
+        # and at the PAR region if fAPAR is needed
+        wl_index = srf.support
+        if calc_FAPAR:
+            wl_index = np.union1d(wl_index,
+                                  ProspectD.get_band_index(np.arange(400, 701)))
+        srf_index = np.searchsorted(wl_index, srf.support)
+        rsoil_vec = np.asarray(rsoil_vec)[wl_index]
+        if np.ndim(skyl) != 0:
+            skyl = np.asarray(skyl)[wl_index, np.newaxis]
+        [wls,r,t] = ProspectD.ProspectD_bands_vec(wl_index,
+                                                  input_param['N_leaf'],
+                                                  input_param['Cab'],
+                                                  input_param['Car'],
+                                                  input_param['Cbrown'],
+                                                  input_param['Cw'],
+                                                  input_param['Cm'],
+                                                  input_param['Ant'])
+    else:
+        #for i,wl in enumerate(wls_wim):
+        [wls,r,t] = ProspectD.ProspectD_vec(input_param['N_leaf'],
+                                            input_param['Cab'],
+                                            input_param['Car'],
+                                            input_param['Cbrown'],
+                                            input_param['Cw'],
+                                            input_param['Cm'],
+                                            input_param['Ant'])
      
     r = r.T
     t = t.T 
     
-    if type(skyl) == float:
-        skyl = skyl * np.ones(r.shape)
+    if np.ndim(skyl) == 0:
+        skyl = np.full((r.shape[0], 1), skyl)
 
     if calc_FAPAR:
         par_index = wls<=700
@@ -531,7 +587,15 @@ def simulate_prosail_lut(input_param,
     tau_leaf = []
     skyl_rho = []
     rsoil = []
-    if srf and reduce_4sail:
+    if sensor_response:
+        # 4SAIL is run at every simulated wavelength and the canopy
+        # reflectance is convolved with the sensor response afterwards
+        rho_leaf = r
+        tau_leaf = t
+        skyl_rho = skyl
+        rsoil = rsoil_vec
+
+    elif srf and reduce_4sail:
         if type(srf) == float or type(srf) == int:
 
             wls_sim = np.asarray(wls_sim)
@@ -575,35 +639,16 @@ def simulate_prosail_lut(input_param,
     skyl_rho = np.asarray(skyl_rho)
     rsoil = np.asarray(rsoil)
     
-    [_, 
-     _, 
-     _, 
-     _, 
-     _, 
-     _, 
-     _, 
-     _, 
-     _, 
-     _, 
-     _, 
-     _, 
-     _, 
-     _, 
-     rdot,
-     _, 
-     _,
-     rsot, 
-     _, 
-     _, 
-     _] = FourSAIL.FourSAIL_vec(input_param['LAI'],
-                                input_param['hotspot'],
-                                lidf,
-                                np.ones(input_param['LAI'].shape) * sza,
-                                np.ones(input_param['LAI'].shape) * vza,
-                                np.ones(input_param['LAI'].shape) * psi,
-                                rho_leaf,
-                                tau_leaf,
-                                rsoil)
+    rdot, rsot = FourSAIL.FourSAIL_vec(input_param['LAI'],
+                                       input_param['hotspot'],
+                                       lidf,
+                                       sza,
+                                       vza,
+                                       psi,
+                                       rho_leaf,
+                                       tau_leaf,
+                                       rsoil,
+                                       outputs=FourSAIL.REFLECTANCE_OUTPUTS)
     
                 
     r2 = rdot * skyl_rho + rsot * (1 - skyl_rho)
@@ -614,7 +659,7 @@ def simulate_prosail_lut(input_param,
                                                     input_param['LAI'],
                                                     lidf,
                                                     input_param['hotspot'],
-                                                    np.ones(input_param['LAI'].shape) * sza,
+                                                    sza,
                                                     rho_leaf_fapar,
                                                     tau_leaf_fapar,
                                                     rsoil_vec_fapar)
@@ -633,7 +678,10 @@ def simulate_prosail_lut(input_param,
             
     
     rho_canopy = []      
-    if srf and not reduce_4sail:
+    if sensor_response:
+        rho_canopy = spectral_library.convolve_srf(r2[srf_index].T, srf).T
+
+    elif srf and not reduce_4sail:
         if type(srf) == float or type(srf) == int:
             #Convolve spectra by full width half maximum
             sigma = fwhm2sigma(srf)
@@ -727,34 +775,20 @@ def calc_fapar_4sail(skyl,
         sinvza = np.sin(np.radians(vza))
         
         [tss,
-         _,
-         _,
          rdd,
          tdd,
-         _,
          tsd,
-         _,
-         _,
-         _,
-         _,
-         _,
-         _,
-         _,
          rdot,
-         _,
-         _,
-         rsot,
-         _,
-         _,
-         _] = FourSAIL.FourSAIL_vec(LAI,
-                                    hotspot,
-                                    lidf,
-                                    sza,
-                                    np.ones(LAI.shape) * vza,
-                                    np.ones(LAI.shape) * psi,
-                                    rho_leaf,
-                                    tau_leaf,
-                                    rsoil)
+         rsot] = FourSAIL.FourSAIL_vec(LAI,
+                                       hotspot,
+                                       lidf,
+                                       sza,
+                                       vza,
+                                       psi,
+                                       rho_leaf,
+                                       tau_leaf,
+                                       rsoil,
+                                       outputs=('tss', 'rdd', 'tdd', 'tsd', 'rdot', 'rsot'))
         
         # Downwelling solar beam radiation at ground level (beam transmissnion)
         Es_1 = tss * Es
@@ -28,10 +28,11 @@ PACKAGE CONTENTS
 * :func:`FCostJac_PROSPECT` Cost Function and Jacobian for inverting PROSPEC5 based on the Mean Squared Error of observed vs. modeled reflectances.
 ''' 
   
-from pyPro4Sail import FourSAIL, ProspectD, FourSAILJacobian, ProspectDJacobian
+from pyPro4Sail import FourSAIL, ProspectD, FourSAILJacobian, ProspectDJacobian, FourSAILJit, spectral_library
 import numpy as np
 
-def FCost_ProSail_wl(x0,ObjParam,FixedValues,n_obs,rho_canopy,vza,sza,psi,skyl,rsoil,wls,scale):
+def FCost_ProSail_wl(x0,ObjParam,FixedValues,n_obs,rho_canopy,vza,sza,psi,skyl,rsoil,wls,scale,
+                     backend=None,n_angles=18,quadrature='bins'):
     ''' Cost Function for inverting PROSPEC5 + 4SAIL based on the Mean
     Square Error of observed vs. modeled reflectances and scaled [0,1] parameters
         
@@ -62,6 +63,14 @@ def FCost_ProSail_wl(x0,ObjParam,FixedValues,n_obs,rho_canopy,vza,sza,psi,skyl,r
     scale : list
         minimum and scale tuple (min,scale) for each objective parameter.
     
+    backend : str, optional
+        'numba' or 'numpy' backend of :func:`FourSAILJit.canopy_reflectance_wl`,
+        default the compiled Numba kernels if Numba is installed.
+    n_angles : int, optional
+        number of leaf inclination angles of the LIDF.
+    quadrature : str, optional
+        leaf inclination quadrature, see :func:`FourSAIL.leaf_angles`.
+    
     Returns
     -------
     mse : float
@@ -81,30 +90,24 @@ def FCost_ProSail_wl(x0,ObjParam,FixedValues,n_obs,rho_canopy,vza,sza,psi,skyl,r
         else:
             input_parameters[param]=FixedValues[j]
             j=j+1
-    # Start processing    
-    n_wl=len(wls)
-    error= np.zeros(n_obs*n_wl)
     #Calculate LIDF
-    lidf=FourSAIL.CalcLIDF_Campbell(float(input_parameters['leaf_angle']))
-    i=0
-    for obs in range(n_obs):
-        j=0
-        for wl in wls:
-            [l,r,t]=ProspectD.ProspectD_wl(wl,input_parameters['N_leaf'],
-                input_parameters['Cab'],input_parameters['Car'],input_parameters['Cbrown'], 
-                input_parameters['Cw'],input_parameters['Cm'],input_parameters['Ant'])
-            [_,_,_,_,_,_,_,_,_,_,_,_,_,_,rdot,
-                 _,_,rsot,_,_,_]=FourSAIL.FourSAIL_wl(input_parameters['LAI'],
-                 input_parameters['hotspot'],lidf,float(sza[obs]),float(vza[obs]),
-                float(psi[obs]),r,t,float(rsoil[j]))
-            r2=rdot*float(skyl[obs,j])+rsot*(1-float(skyl[obs,j]))
-            error[i]=(r2-rho_canopy[obs,j])**2
-            i+=1
-            j+=1
+    lidf=FourSAILJacobian.CalcLIDF_Campbell_table(float(input_parameters['leaf_angle']),
+                                                  n_angles,quadrature)
+    # Leaf optical properties do not depend on the observation, run PROSPECT once
+    [l,rho,tau]=ProspectD.ProspectD_bands(ProspectD.get_band_index(wls),input_parameters['N_leaf'],
+        input_parameters['Cab'],input_parameters['Car'],input_parameters['Cbrown'], 
+        input_parameters['Cw'],input_parameters['Cm'],input_parameters['Ant'])
+    # 4SAIL for all the observations and bands in a single call
+    n_wl=len(wls)
+    r2=FourSAILJit.canopy_reflectance_wl(input_parameters['LAI'],input_parameters['hotspot'],
+        lidf,sza[:n_obs],vza[:n_obs],psi[:n_obs],rho,tau,rsoil[:n_wl],
+        np.asarray(skyl)[:n_obs,:n_wl],backend=backend,quadrature=quadrature)
+    error=(r2-np.asarray(rho_canopy)[:n_obs,:n_wl])**2
     mse=0.5*np.mean(error)
     return mse
 
-def FCost_ProSail(x0,ObjParam,FixedValues,n_obs,rho_canopy,vza,sza,psi,skyl,rsoil,wls,scale):
+def FCost_ProSail(x0,ObjParam,FixedValues,n_obs,rho_canopy,vza,sza,psi,skyl,rsoil,wls,scale,
+                  srf=None,n_angles=18,quadrature='bins'):
     ''' Cost Function and for inverting PROSPEC5 + 4SAIL based on the Mean
     Square Error of observed vs. modeled reflectances and scaled [0,1] parameters
         
@@ -134,6 +137,14 @@ def FCost_ProSail(x0,ObjParam,FixedValues,n_obs,rho_canopy,vza,sza,psi,skyl,rsoi
         wavebands used in the inversion. The size must be equal to n_wls.
     scale : list
         minimum and scale tuple (min,scale) for each objective parameter.
+    srf : str or SensorResponse, optional
+        sensor spectral response, see :func:`spectral_library.get_sensor_response`.
+        If given, wls is ignored, rho_canopy and skyl are per sensor band and
+        rsoil covers 400-2500 nm (or only the srf support wavelengths).
+    n_angles : int, optional
+        number of leaf inclination angles of the LIDF.
+    quadrature : str, optional
+        leaf inclination quadrature, see :func:`FourSAIL.leaf_angles`.
         
     Returns
     -------
@@ -156,21 +167,33 @@ def FCost_ProSail(x0,ObjParam,FixedValues,n_obs,rho_canopy,vza,sza,psi,skyl,rsoi
             input_parameters[param]=FixedValues[j]
             j=j+1
     # Start processing    
-    n_wl=len(wls)
+    if srf is not None:
+        # Run the models only at the wavelengths seen by the sensor
+        if not isinstance(srf, spectral_library.SensorResponse):
+            srf=spectral_library.get_sensor_response(srf)
+        band_index=srf.support
+        n_wl=len(srf.bands)
+        rsoil=np.asarray(rsoil)
+        if rsoil.shape[-1]!=band_index.size:
+            rsoil=rsoil[band_index]
+    else:
+        band_index=ProspectD.get_band_index(wls)
+        n_wl=len(wls)
     error= np.zeros(n_obs*n_wl)
     #Calculate LIDF
-    lidf=FourSAIL.CalcLIDF_Campbell(float(input_parameters['leaf_angle']))
+    lidf=FourSAILJacobian.CalcLIDF_Campbell_table(float(input_parameters['leaf_angle']),
+                                                  n_angles,quadrature)
+    # Leaf optical properties do not depend on the observation, run PROSPECT once
+    [l,r,t]=ProspectD.ProspectD_bands(band_index,input_parameters['N_leaf'],
+            input_parameters['Cab'],input_parameters['Car'],input_parameters['Cbrown'], 
+            input_parameters['Cw'],input_parameters['Cm'],input_parameters['Ant'])
     for obs in range(n_obs):
-        [l,r,t]=ProspectD.ProspectD(input_parameters['N_leaf'],
-                input_parameters['Cab'],input_parameters['Car'],input_parameters['Cbrown'], 
-                input_parameters['Cw'],input_parameters['Cm'],input_parameters['Ant'])
-        k=[k for k,wl in enumerate(l) if float(wl) in wls]
-        r=r[k]
-        t=t[k]
-        [_,_,_,_,_,_,_,_,_,_,_,_,_,_,rdot,
-             _,_,rsot,_,_,_]=FourSAIL.FourSAIL(input_parameters['LAI'],
+        rdot,rsot=FourSAIL.FourSAIL(input_parameters['LAI'],
              input_parameters['hotspot'],lidf,float(sza[obs]),float(vza[obs]),
-            float(psi[obs]),r,t,rsoil)
+            float(psi[obs]),r,t,rsoil,outputs=FourSAIL.REFLECTANCE_OUTPUTS,quadrature=quadrature)
+        if srf is not None:
+            rdot=spectral_library.convolve_srf(rdot, srf)
+            rsot=spectral_library.convolve_srf(rsot, srf)
         r2=rdot*np.asarray(skyl[obs])+rsot*(1.-np.asarray(skyl[obs]))
         error[obs*n_wl:(obs+1)*n_wl]=(r2-rho_canopy[obs])**2
     mse=0.5*np.mean(error)
@@ -187,7 +210,10 @@ def FCostJac_ProSail(x0,
                      skyl,
                      rsoil,
                      wls,
-                     scale):
+                     scale,
+                     srf=None,
+                     n_angles=18,
+                     quadrature='bins'):
     ''' Cost Function and its Jacobian for inverting PROSPEC5 + 4SAIL based on the Mean
     Square Error of observed vs. modeled reflectances and scaled [0,1] parameters
         
@@ -217,6 +243,14 @@ def FCostJac_ProSail(x0,
         wavebands used in the inversion. The size must be equal to n_wls.
     scale : list
         minimum and scale tuple (min,scale) for each objective parameter.
+    srf : str or SensorResponse, optional
+        sensor spectral response, see :func:`spectral_library.get_sensor_response`.
+        If given, wls is ignored, rho_canopy and skyl are per sensor band and
+        rsoil covers 400-2500 nm (or only the srf support wavelengths).
+    n_angles : int, optional
+        number of leaf inclination angles of the LIDF.
+    quadrature : str, optional
+        leaf inclination quadrature, see :func:`FourSAIL.leaf_angles`.
     
     Returns
     -------
@@ -241,25 +275,31 @@ def FCostJac_ProSail(x0,
             j=j+1
     
     # Start processing    
+    if srf is not None:
+        if not isinstance(srf, spectral_library.SensorResponse):
+            srf=spectral_library.get_sensor_response(srf)
+        k = srf.support
+        rsoil = np.asarray(rsoil)
+        if rsoil.shape[-1] != k.size:
+            rsoil = rsoil[k]
+    else:
+        k = ProspectD.get_band_index(wls)
     error= []
     Delta_error = []
     #Calculate LIDF
-    lidf, Jac_lidf = FourSAILJacobian.JacCalcLIDF_Campbell(float(input_parameters['leaf_angle']))
+    lidf, Jac_lidf = FourSAILJacobian.JacCalcLIDF_Campbell_table(float(input_parameters['leaf_angle']),
+                                                                 n_angles,quadrature)
+    # Leaf optical properties do not depend on the observation, run PROSPECT once
+    l, r, t, Jac_r, Jac_t = ProspectDJacobian.JacProspectD_vec(input_parameters['N_leaf'],
+                                                               input_parameters['Cab'],
+                                                               input_parameters['Car'],
+                                                               input_parameters['Cbrown'],
+                                                               input_parameters['Cw'],
+                                                               input_parameters['Cm'],
+                                                               input_parameters['Ant'],
+                                                               band_index=k)
+    r, t, Jac_r, Jac_t = r[0], t[0], Jac_r[0], Jac_t[0]
     for obs in range(n_obs):
-        l, r, t, Jac_r, Jac_t = ProspectDJacobian.JacProspectD(input_parameters['N_leaf'],
-                                                                 input_parameters['Cab'],
-                                                                 input_parameters['Car'],
-                                                                 input_parameters['Cbrown'],
-                                                                 input_parameters['Cw'],
-                                                                 input_parameters['Cm'],
-                                                                 input_parameters['Ant'])
-                                                             
-        k = [k for k, wl in enumerate(l) if float(wl) in wls]
-        r = r[k]
-        t = t[k]
-        Jac_r = Jac_r[:,k]
-        Jac_t = Jac_t[:,k]
-        
         [_,_,_,_,_,_,_,_,_,_,_,_,_,_,
          rdot,_,_,rsot,_,_,_,_,_,_,_,_,_,_,_,_,_,_,_,_,_,
          Delta_rdot,_,_,Delta_rsot,_,_,_] = FourSAILJacobian.JacFourSAIL(input_parameters['LAI'], 
@@ -272,8 +312,12 @@ def FCostJac_ProSail(x0,
                                                                          t,
                                                                          rsoil,
                                                                          Jac_r,
-                                                                         Jac_t)
+                                                                         Jac_t,
+                                                                         quadrature=quadrature)
         
+        if srf is not None:
+            rdot, rsot, Delta_rdot, Delta_rsot = (spectral_library.convolve_srf(value, srf)
+                                                  for value in (rdot, rsot, Delta_rdot, Delta_rsot))
         r2 = rdot*np.array(skyl[obs]) + rsot*(1.-np.array(skyl[obs]))
         Delta_r2 = Delta_rdot[param_index]*np.array(skyl[obs]) + Delta_rsot[param_index]*(1.-np.array(skyl[obs]))
         
@@ -325,18 +369,15 @@ def FCost_PROSPECTS_wl(x0,ObjParam,FixedValues,rho_leaf,wls,scale):
             input_parameters[param]=FixedValues[j]
             j=j+1
     # Start processing    
-    n_wl=len(wls)
-    error= np.zeros(n_wl)
-    for i,wl in enumerate(wls):
-        [l,r,t]=ProspectD.ProspectD_wl(wl,input_parameters['N_leaf'],
-            input_parameters['Cab'],input_parameters['Car'],input_parameters['Cbrown'], 
-            input_parameters['Cw'],input_parameters['Cm'],input_parameters['Ant'])
-        error[i]=(r-rho_leaf[i])**2
+    [l,r,t]=ProspectD.ProspectD_bands(ProspectD.get_band_index(wls),input_parameters['N_leaf'],
+        input_parameters['Cab'],input_parameters['Car'],input_parameters['Cbrown'], 
+        input_parameters['Cw'],input_parameters['Cm'],input_parameters['Ant'])
+    error=(r-np.asarray(rho_leaf))**2
     mse=0.5*np.mean(error)
 
     return mse
 
-def FCost_PROSPECTD(x0,ObjParam,FixedValues,rho_leaf,wls,scale):
+def FCost_PROSPECTD(x0,ObjParam,FixedValues,rho_leaf,wls,scale,srf=None):
     ''' Cost Function for inverting PROSPECT5  the Root MeanSquare Error of 
     observed vs. modeled reflectances and scaled [0,1] parameters.
         
@@ -354,6 +395,9 @@ def FCost_PROSPECTD(x0,ObjParam,FixedValues,rho_leaf,wls,scale):
         wavebands used in the inversion. The size is n_wls.
     scale : list
         minimum and scale tuple (min,scale) for each objective parameter.
+    srf : str or SensorResponse, optional
+        sensor spectral response, see :func:`spectral_library.get_sensor_response`.
+        If given, wls is ignored and rho_leaf is per sensor band.
     
     Returns
     -------
@@ -375,15 +419,22 @@ def FCost_PROSPECTD(x0,ObjParam,FixedValues,rho_leaf,wls,scale):
             input_parameters[param]=FixedValues[j]
             j=j+1
     # Start processing   
-    [l,r,t]=ProspectD.ProspectD(input_parameters['N_leaf'],
+    if srf is not None:
+        if not isinstance(srf, spectral_library.SensorResponse):
+            srf=spectral_library.get_sensor_response(srf)
+        band_index=srf.support
+    else:
+        band_index=ProspectD.get_band_index(wls)
+    [l,r,t]=ProspectD.ProspectD_bands(band_index,input_parameters['N_leaf'],
             input_parameters['Cab'],input_parameters['Car'],input_parameters['Cbrown'], 
             input_parameters['Cw'],input_parameters['Cm'],input_parameters['Ant'])
-    k=[k for k,wl in enumerate(l) if float(wl) in wls]
-    error=(r[k]-rho_leaf)**2
+    if srf is not None:
+        r=spectral_library.convolve_srf(r, srf)
+    error=(r-rho_leaf)**2
     mse=0.5*np.mean(error)
     return mse
     
-def FCostJac_PROSPECTD(x0,ObjParam,FixedValues,rho_leaf,wls,scale):
+def FCostJac_PROSPECTD(x0,ObjParam,FixedValues,rho_leaf,wls,scale,srf=None):
     ''' Cost Function for inverting PROSPECT5  the Root MeanSquare Error of 
     observed vs. modeled reflectances and scaled [0,1] parameters.
         
@@ -401,6 +452,9 @@ def FCostJac_PROSPECTD(x0,ObjParam,FixedValues,rho_leaf,wls,scale):
         wavebands used in the inversion. The size is n_wls.
     scale : list
         minimum and scale tuple (min,scale) for each objective parameter.
+    srf : str or SensorResponse, optional
+        sensor spectral response, see :func:`spectral_library.get_sensor_response`.
+        If given, wls is ignored and rho_leaf is per sensor band.
     
     Returns
     -------
@@ -424,13 +478,24 @@ def FCostJac_PROSPECTD(x0,ObjParam,FixedValues,rho_leaf,wls,scale):
             input_parameters[param]=FixedValues[j]
             j=j+1
     # Start processing    
-    l,Delta_r,Delta_t,r,t=ProspectDJacobian.JacProspectD(input_parameters['N_leaf'],
+    if srf is not None:
+        # Run the model only at the wavelengths seen by the sensor
+        if not isinstance(srf, spectral_library.SensorResponse):
+            srf=spectral_library.get_sensor_response(srf)
+        band_index=srf.support
+    else:
+        band_index=ProspectD.get_band_index(wls)
+    l,r,t,Delta_r,Delta_t=ProspectDJacobian.JacProspectD_vec(input_parameters['N_leaf'],
             input_parameters['Cab'],input_parameters['Car'],input_parameters['Cbrown'], 
-            input_parameters['Cw'],input_parameters['Cm'],input_parameters['Ant'])
-    k=[k for k,wl in enumerate(l) if float(wl) in wls]
-    error=(r[k]-rho_leaf)**2
-    Delta_r=Delta_r[param_index]
-    Delta_error=2*(r[k]-rho_leaf)*Delta_r[:,k]
+            input_parameters['Cw'],input_parameters['Cm'],input_parameters['Ant'],
+            band_index=band_index)
+    r=r[0]
+    Delta_r=Delta_r[0,param_index]
+    if srf is not None:
+        r=spectral_library.convolve_srf(r, srf)
+        Delta_r=spectral_library.convolve_srf(Delta_r, srf)
+    error=(r-rho_leaf)**2
+    Delta_error=2*(r-rho_leaf)*Delta_r
     mse=0.5*np.mean(error)
     Jac_mse=0.5*np.mean(Delta_error,axis=1)
     return mse,Jac_mse
\ No newline at end of file
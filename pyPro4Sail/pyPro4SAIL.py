@@ -18,6 +18,11 @@ PACKAGE CONTENTS
 ================
 
 * :func:`run` run Pro4SAIL based on originial PyProSAIL interface at http://pyprosail.readthedocs.org/en/latest/.
+* :func:`run_soils` run Pro4SAIL for one canopy over all the soils of the soil spectral library.
+* :func:`rank_soils` ranks the soils of the soil spectral library against an observed reflectance.
+* :func:`run_vec` run Pro4SAIL for arrays of leaf, canopy and geometry parameters.
+* :func:`run_structured` run Pro4SAIL for a structured array of parameters.
+* :func:`calc_lidf_vec` Leaf Inclination Distribution Functions for a batch of Campbell and/or Verhoef parameters.
 * :func:`run_TIR` runs the thermal component of 4SAIL to estimate the broadband at-sensor thermal radiance.
 * :func:`CalcStephanBoltzmann` Blackbody Broadband radiation emission. 
 
@@ -32,14 +37,18 @@ EXAMPLE
 
 '''
 
-from  pyPro4Sail import FourSAIL, ProspectD
+from  pyPro4Sail import FourSAIL, ProspectD, spectral_library
 import numpy as np
-import os
 
 # Define Constants
-SOIL_FOLDER=os.path.join(os.path.dirname(FourSAIL.__file__), 'spectra', 'soilSpectralLibrary')
+SOIL_FOLDER=spectral_library.SOIL_FOLDER
 DEFAULT_SOIL='ProSAIL_WetSoil.txt'
 SB=5.670373e-8 #Stephan Boltzmann constant (W m-2 K-4)
+# Maximum number of samples simulated at once by run_vec
+CHUNK_SIZE=1000
+# Input parameters of run, in order
+RUN_PARAMS=('N', 'chloro', 'caroten', 'brown', 'EWT', 'LMA', 'Ant', 'LAI', 'hot_spot',
+            'solar_zenith', 'solar_azimuth', 'view_zenith', 'view_azimuth', 'LIDF')
 
 # Common leaf distributions
 PLANOPHILE = (1, 0)
@@ -49,8 +58,12 @@ EXTREMOPHILE = (0, 1)
 SPHERICAL = (-0.35, -0.15)
 UNIFORM = (0, 0)
 
+# PROSPECT-D engines of the coarse spectral grids, keyed by the grid
+_engine_cache = {}
+
 def run(N, chloro, caroten, brown, EWT, LMA, Ant, LAI, hot_spot, solar_zenith, solar_azimuth, 
-        view_zenith, view_azimuth, LIDF, skyl=0.2, soilType=DEFAULT_SOIL):
+        view_zenith, view_azimuth, LIDF, skyl=0.2, soilType=DEFAULT_SOIL,
+        spectral_grid=None, srf=None):
     ''' Runs Prospect5 4SAIL model to estimate canopy directional reflectance factor.
     
     Parameters
@@ -84,18 +97,36 @@ def run(N, chloro, caroten, brown, EWT, LMA, Ant, LAI, hot_spot, solar_zenith, s
         
             * if float, mean leaf angle for the Cambpell Spherical LIDF.
             * if tuple, (a,b) parameters of the Verhoef's bimodal LIDF |LIDF[0]| + |LIDF[1]|<=1.
-    skyl : float, optional
-       Fraction of diffuse shortwave radiation, default=0.2.
-    soilType : str, optional
+              A list of two elements is also read as (a,b).
+            * if array, see :func:`run_vec`.
+    skyl : float or array_like, optional
+       Fraction of diffuse shortwave radiation, default=0.2. An array gives
+       the fraction at each simulated wavelength.
+    soilType : str or int, optional
         filename of the soil type, defautl use inceptisol soil type,
-        see SoilSpectralLibrary folder.
+        see SoilSpectralLibrary folder. It can also be the soil index in
+        :func:`spectral_library.get_soil_library`.
+    spectral_grid : float or array_like, optional
+        run on a coarser spectral grid, either the band centres (nm) or the
+        step (nm) of a regular grid between 400 and 2500 nm. Leaf coefficients
+        and soil reflectance are band-averaged to the grid.
+        Default run at 1 nm.
+    srf : str or SensorResponse, optional
+        sensor spectral response (e.g. 'Sentinel2A'), see
+        :func:`spectral_library.get_sensor_response`. If given, the models
+        only run at the wavelengths covered by the sensor bands and the band
+        reflectance factors are returned.
     
     Returns
     -------
     wl : array_like
-        wavelenghts.
+        wavelenghts, or band centres if srf is given.
     rho_canopy : array_like
         canopy reflectance factors.
+        
+    Notes
+    -----
+    If any parameter is an array the simulation is run in batch by :func:`run_vec`.
     
     References
     ----------
@@ -108,10 +139,21 @@ def run(N, chloro, caroten, brown, EWT, LMA, Ant, LAI, hot_spot, solar_zenith, s
         http://dx.doi.org/10.1109/TGRS.2007.895844.
     '''
     
-    # Read the soil reflectance        
-    rsoil=np.genfromtxt(os.path.join(SOIL_FOLDER, soilType))
-    #wl_soil=rsoil[:,0]
-    rsoil=np.array(rsoil[:,1])
+    if isinstance(LIDF, list):
+        # (a,b) Verhoef's parameters, run_vec reads a list as one LIDF per sample
+        LIDF=tuple(LIDF)
+    # Arrays of parameters are run in batch, an array of skyl is spectral
+    if any(np.ndim(value) > 0 for value in (N, chloro, caroten, brown, EWT, LMA, Ant,
+                                             LAI, hot_spot, solar_zenith, solar_azimuth,
+                                             view_zenith, view_azimuth, soilType)) \
+            or isinstance(LIDF, np.ndarray):
+        return run_vec(N, chloro, caroten, brown, EWT, LMA, Ant, LAI, hot_spot,
+                       solar_zenith, solar_azimuth, view_zenith, view_azimuth, LIDF,
+                       skyl=skyl, soilType=soilType, spectral_grid=spectral_grid,
+                       srf=srf)
+
+    # Get the soil reflectance from the cached soil library
+    wl_soil,rsoil=spectral_library.get_soil_spectrum(soilType)
 
     # Calculate the lidf
     if type(LIDF)==tuple or type(LIDF)==list:
@@ -126,19 +168,355 @@ def run(N, chloro, caroten, brown, EWT, LMA, Ant, LAI, hot_spot, solar_zenith, s
         lidf=FourSAIL.CalcLIDF_Campbell(LIDF)
     
     # PROSPECT5 for leaf bihemispherical reflectance and transmittance
-    wl,rho_leaf,tau_leaf=ProspectD.ProspectD(N, chloro, caroten, brown, EWT, LMA, Ant)
-    
+    wl,rho_leaf,tau_leaf,rsoil,srf=_leaf_and_soil(N, chloro, caroten, brown, EWT, LMA, Ant,
+                                                  rsoil, wl_soil, spectral_grid, srf)
     # Get the relative sun-view azimth angle
     psi=abs(solar_azimuth-view_azimuth)
     # 4SAIL for canopy reflectance and transmittance factors       
-    [tss,too,tsstoo,rdd,tdd,rsd,tsd,rdo,tdo,rso,rsos,rsod,rddt,rsdt,rdot,
-             rsodt,rsost,rsot,gammasdf,gammasdb,
-             gammaso]=FourSAIL.FourSAIL(LAI,hot_spot,
-                lidf,solar_zenith,view_zenith,psi,rho_leaf,tau_leaf,rsoil)
+    rdot,rsot=FourSAIL.FourSAIL(LAI,hot_spot,
+                lidf,solar_zenith,view_zenith,psi,rho_leaf,tau_leaf,rsoil,
+                outputs=FourSAIL.REFLECTANCE_OUTPUTS)
     rho_canopy=rdot*skyl+rsot*(1-skyl)
+    if srf is not None:
+        wl=srf.center
+        rho_canopy=spectral_library.convolve_srf(rho_canopy, srf)
 
     return wl,rho_canopy
 
+def run_soils(N, chloro, caroten, brown, EWT, LMA, Ant, LAI, hot_spot, solar_zenith,
+              solar_azimuth, view_zenith, view_azimuth, LIDF, skyl=0.2, soils=None,
+              spectral_grid=None, srf=None):
+    ''' Runs Pro4SAIL for one canopy over all the soils of the soil spectral library.
+    
+    The canopy terms of 4SAIL are computed once and coupled with all the soil
+    spectra at once with :func:`FourSAIL.soil_coupling`.
+    
+    Parameters
+    ----------
+    N, chloro, caroten, brown, EWT, LMA, Ant, LAI, hot_spot : float
+        leaf and canopy parameters, see :func:`run`.
+    solar_zenith, solar_azimuth, view_zenith, view_azimuth : float
+        sun and view angles (degrees).
+    LIDF : float or tuple(float,float)
+        Campbell mean leaf angle or Verhoef's (a, b) bimodal parameters.
+    skyl : float, optional
+        Fraction of diffuse shortwave radiation, default=0.2.
+    soils : list of str or int, optional
+        soil filenames or indices in :func:`spectral_library.get_soil_library`.
+        Default all the soils of the library.
+    spectral_grid : float or array_like, optional
+        run on a coarser spectral grid, see :func:`run`.
+    srf : str or SensorResponse, optional
+        sensor spectral response, see :func:`run`.
+    
+    Returns
+    -------
+    wl : array_like
+        wavelenghts, or band centres if srf is given.
+    rho_canopy : array_like
+        canopy reflectance factors, size n_soils x n_wl.
+    '''
+    
+    library=spectral_library.get_soil_library()
+    if soils is None:
+        rsoil=library.spectra
+    else:
+        rsoil=library.spectra[[spectral_library.get_soil_index(soil) for soil in soils]]
+    wl,rho_leaf,tau_leaf,rsoil,srf=_leaf_and_soil(N, chloro, caroten, brown, EWT, LMA, Ant,
+                                                  rsoil, library.wl, spectral_grid, srf)
+    if isinstance(LIDF, list):
+        LIDF=tuple(LIDF)
+    lidf=calc_lidf_vec(LIDF, 1)[:,0]
+    psi=abs(solar_azimuth-view_azimuth)
+    # Canopy terms, the soil reflectance is not used
+    canopy=FourSAIL.FourSAIL(LAI,hot_spot,lidf,solar_zenith,view_zenith,psi,
+                             rho_leaf,tau_leaf,0.,outputs=FourSAIL.CANOPY_OUTPUTS)
+    rdot,rsot=FourSAIL.soil_coupling(*canopy, rsoil=rsoil, outputs=FourSAIL.REFLECTANCE_OUTPUTS)
+    rho_canopy=rdot*skyl+rsot*(1-skyl)
+    if srf is not None:
+        wl=srf.center
+        rho_canopy=spectral_library.convolve_srf(rho_canopy, srf)
+    return wl,rho_canopy
+
+def rank_soils(observation, N, chloro, caroten, brown, EWT, LMA, Ant, LAI, hot_spot,
+               solar_zenith, solar_azimuth, view_zenith, view_azimuth, LIDF, skyl=0.2,
+               soils=None, spectral_grid=None, srf=None):
+    ''' Ranks the soils of the soil spectral library against an observed reflectance.
+    
+    Parameters
+    ----------
+    observation : array_like
+        observed canopy reflectance factors on the wavelengths returned by
+        :func:`run_soils`, NaN values are ignored.
+    N, ..., srf :
+        canopy, geometry and spectral settings, see :func:`run_soils`.
+    
+    Returns
+    -------
+    ranking : list of str
+        soil filenames, from best to worst fit.
+    rmse : array_like
+        root mean square error of the simulated reflectance for each soil in ranking.
+    '''
+    
+    library=spectral_library.get_soil_library()
+    if soils is None:
+        soils=range(len(library.names))
+    indices=np.array([spectral_library.get_soil_index(soil) for soil in soils], dtype=int)
+    _,rho_canopy=run_soils(N, chloro, caroten, brown, EWT, LMA, Ant, LAI, hot_spot,
+                           solar_zenith, solar_azimuth, view_zenith, view_azimuth, LIDF,
+                           skyl=skyl, soils=indices, spectral_grid=spectral_grid, srf=srf)
+    rmse=np.sqrt(np.nanmean((rho_canopy-np.asarray(observation))**2, axis=-1))
+    order=np.argsort(rmse)
+    return [library.names[i] for i in indices[order]],rmse[order]
+
+def _leaf_and_soil(N, chloro, caroten, brown, EWT, LMA, Ant, rsoil, wl_soil,
+                   spectral_grid=None, srf=None):
+    # PROSPECT-D leaf spectra and soil spectra on the simulated wavelengths
+    if srf is not None:
+        if spectral_grid is not None:
+            raise ValueError('srf and spectral_grid cannot be used together')
+        if not isinstance(srf, spectral_library.SensorResponse):
+            srf=spectral_library.get_sensor_response(srf)
+        wl,rho_leaf,tau_leaf=ProspectD.ProspectD_bands(srf.support, N, chloro, caroten,
+                                                       brown, EWT, LMA, Ant)
+        rsoil=rsoil[...,srf.support]
+    elif spectral_grid is None:
+        wl,rho_leaf,tau_leaf=ProspectD.ProspectD(N, chloro, caroten, brown, EWT, LMA, Ant)
+    else:
+        engine=_grid_engine(spectral_grid)
+        wl=engine.wl
+        rho_leaf,tau_leaf=engine.run([N, chloro, caroten, brown, EWT, LMA, Ant])
+        rho_leaf,tau_leaf=rho_leaf[0],tau_leaf[0]
+        rsoil=spectral_library.resample_spectra(rsoil, wl_soil, wl)
+    
+    return wl,rho_leaf,tau_leaf,rsoil,srf
+
+def _grid_engine(spectral_grid):
+    # PROSPECT-D engine of a coarse spectral grid, built once per grid
+    if np.ndim(spectral_grid) == 0:
+        key=float(spectral_grid)
+    else:
+        key=tuple(float(wl) for wl in spectral_grid)
+    try:
+        return _engine_cache[key]
+    except KeyError:
+        pass
+    engine=ProspectD.ProspectDEngine(grid=spectral_grid)
+    _engine_cache[key]=engine
+    return engine
+
+def calc_lidf_vec(LIDF, n_samples, n_elements=18):
+    '''Leaf Inclination Distribution Functions for a batch of samples.
+
+    Parameters
+    ----------
+    LIDF : float, tuple, array_like or list
+        Leaf Inclination Distribution Function parameters, the Python type
+        selects the LIDF.
+
+            * if float, mean leaf angle for the Campbell LIDF of all samples.
+            * if tuple (a,b), Verhoef's bimodal LIDF of all samples.
+            * if 1D array of size n_samples, mean leaf angle for the Campbell LIDF of each sample.
+            * if 2D array of size n_samples x 2, (a,b) Verhoef's LIDF of each sample.
+            * if list, always one element per sample, either a float (Campbell)
+              or a tuple (Verhoef), so both LIDFs can be mixed.
+    n_samples : int
+        number of samples.
+    n_elements : int, optional
+        Total number of equally spaced inclination angles.
+
+    Returns
+    -------
+    lidf : 2D array
+        Leaf Inclination Distribution Function, size n_elements x n_samples.
+    '''
+
+    def verhoef(a, b):
+        if abs(a)+abs(b) > 1:
+            raise ValueError("|LIDFa| + |LIDFb| > 1 in Verhoef's bimodal LIDF distribution")
+        return FourSAIL.CalcLIDF_Verhoef(a, b, n_elements=n_elements)
+
+    def verhoef_vec(ab):
+        if np.any(np.abs(ab[:, 0])+np.abs(ab[:, 1]) > 1):
+            raise ValueError("|LIDFa| + |LIDFb| > 1 in Verhoef's bimodal LIDF distribution")
+        return FourSAIL.CalcLIDF_Verhoef_vec(ab[:, 0], ab[:, 1], n_elements=n_elements)
+
+    if isinstance(LIDF, tuple):
+        if len(LIDF) != 2:
+            raise ValueError("Verhoef's bimodal LIDF distribution must have two elements (LIDFa, LIDFb)")
+        lidf = np.asarray(verhoef(LIDF[0], LIDF[1]))
+        return np.repeat(lidf[:, np.newaxis], n_samples, axis=1)
+    if isinstance(LIDF, list):
+        if len(LIDF) != n_samples:
+            raise ValueError('LIDF list must have one element per sample')
+        lidf = np.empty((n_elements, n_samples))
+        campbell = np.array([np.ndim(value) == 0 for value in LIDF])
+        if np.any(campbell):
+            alpha = np.array([LIDF[i] for i in np.flatnonzero(campbell)], dtype=float)
+            lidf[:, campbell] = FourSAIL.CalcLIDF_Campbell_vec(alpha, n_elements=n_elements)
+        if not np.all(campbell):
+            ab = np.array([LIDF[i] for i in np.flatnonzero(~campbell)], dtype=float)
+            lidf[:, ~campbell] = verhoef_vec(ab)
+        return lidf
+    LIDF = np.asarray(LIDF, dtype=float)
+    if LIDF.ndim == 2:
+        if LIDF.shape != (n_samples, 2):
+            raise ValueError("Verhoef's LIDF array must have size n_samples x 2")
+        return verhoef_vec(LIDF)
+    alpha = np.broadcast_to(LIDF.reshape(-1), (n_samples,))
+    return FourSAIL.CalcLIDF_Campbell_vec(alpha, n_elements=n_elements)
+
+def run_vec(N, chloro, caroten, brown, EWT, LMA, Ant, LAI, hot_spot, solar_zenith,
+            solar_azimuth, view_zenith, view_azimuth, LIDF, skyl=0.2,
+            soilType=DEFAULT_SOIL, spectral_grid=None, srf=None, chunk_size=CHUNK_SIZE):
+    ''' Runs Prospect5 4SAIL model for arrays of parameters.
+
+    All the leaf, canopy and geometry parameters, skyl and soilType are
+    broadcast against each other, and the samples are simulated in chunks with
+    the vectorised :func:`ProspectD.ProspectDEngine` and :func:`FourSAIL.FourSAIL_vec`.
+
+    Parameters
+    ----------
+    N, chloro, caroten, brown, EWT, LMA, Ant : float or array_like
+        PROSPECT-D parameters, see :func:`run`.
+    LAI, hot_spot : float or array_like
+        Leaf Area Index and hotspot parameter.
+    solar_zenith, solar_azimuth, view_zenith, view_azimuth : float or array_like
+        Sun and view angles (degrees).
+    LIDF : float, tuple, array_like or list
+        Leaf Inclination Distribution Function parameters, Campbell and
+        Verhoef's LIDFs can be mixed, see :func:`calc_lidf_vec`.
+    skyl : float or array_like, optional
+       Fraction of diffuse shortwave radiation, default=0.2.
+    soilType : str, int or array_like of int, optional
+        soil filename or index in :func:`spectral_library.get_soil_library`,
+        or path to a soil file outside the library, see
+        :func:`spectral_library.get_soil_spectrum`. An array of indices gives
+        the soil of each sample.
+    spectral_grid : float or array_like, optional
+        run on a coarser spectral grid, see :func:`run`.
+    srf : str or SensorResponse, optional
+        return sensor band reflectances, see :func:`run`.
+    chunk_size : int, optional
+        maximum number of samples simulated at once, limits memory use.
+
+    Returns
+    -------
+    wl : 1D array
+        wavelenghts, or band centres if srf is given.
+    rho_canopy : array_like
+        canopy reflectance factors, size (broadcast shape of the inputs) x n_wl.
+    '''
+
+    if srf is not None and spectral_grid is not None:
+        raise ValueError('srf and spectral_grid cannot be used together')
+    if isinstance(soilType, str):
+        # A single soil, which can be a file outside the soil spectral library
+        soil_wl, rsoil = spectral_library.get_soil_spectrum(soilType)
+        soil_spectra = np.asarray(rsoil)[np.newaxis]
+        soilType = 0
+    else:
+        soils = spectral_library.get_soil_library()
+        soil_wl, soil_spectra = soils.wl, soils.spectra
+    soilType = np.asarray(soilType, dtype=int)
+
+    params = np.broadcast_arrays(*[np.asarray(value, dtype=float) for value in
+                                   (N, chloro, caroten, brown, EWT, LMA, Ant, LAI,
+                                    hot_spot, solar_zenith, solar_azimuth,
+                                    view_zenith, view_azimuth, skyl)]
+                                 + [soilType])
+    shape = params[0].shape
+    params = [value.reshape(-1) for value in params]
+    leaf = np.column_stack(params[:7])
+    LAI, hot_spot, solar_zenith, solar_azimuth, view_zenith, view_azimuth, skyl, soilType = params[7:]
+    n_samples = leaf.shape[0]
+    lidf = calc_lidf_vec(LIDF, n_samples)
+    # Get the relative sun-view azimth angle
+    psi = np.abs(solar_azimuth-view_azimuth)
+
+    # Leaf model and soil spectra on the simulated wavelengths
+    if srf is not None:
+        if not isinstance(srf, spectral_library.SensorResponse):
+            srf = spectral_library.get_sensor_response(srf)
+        engine = ProspectD.ProspectDEngine(band_index=srf.support)
+        rsoil = soil_spectra[:, srf.support]
+        wl = srf.center
+    elif spectral_grid is not None:
+        engine = _grid_engine(spectral_grid)
+        rsoil = spectral_library.resample_spectra(soil_spectra, soil_wl, engine.wl)
+        wl = engine.wl
+    else:
+        engine = ProspectD.ProspectDEngine()
+        rsoil = soil_spectra
+        wl = engine.wl
+
+    rho_canopy = np.empty((n_samples, len(wl)))
+    # The 4SAIL intermediate arrays are allocated once for all the chunks
+    workspace = FourSAIL.FourSAILWorkspace()
+    for start in range(0, n_samples, chunk_size):
+        chunk = slice(start, min(start+chunk_size, n_samples))
+        rho_leaf, tau_leaf = engine.run(leaf[chunk])
+        rdot, rsot = FourSAIL.FourSAIL_vec(LAI[chunk], hot_spot[chunk],
+                                           lidf[:, chunk], solar_zenith[chunk],
+                                           view_zenith[chunk], psi[chunk],
+                                           rho_leaf.T, tau_leaf.T,
+                                           rsoil[soilType[chunk]].T,
+                                           outputs=FourSAIL.REFLECTANCE_OUTPUTS,
+                                           workspace=workspace)
+        rho = (rdot*skyl[chunk]+rsot*(1-skyl[chunk])).T
+        if srf is not None:
+            rho = spectral_library.convolve_srf(rho, srf)
+        rho_canopy[chunk] = rho
+
+    return wl, rho_canopy.reshape(shape+(len(wl),))
+
+def run_structured(params, LIDF=None, **kwargs):
+    ''' Runs Prospect5 4SAIL model for a structured array of parameters.
+
+    Parameters
+    ----------
+    params : structured array
+        one record per sample, with the fields named as the parameters of
+        :func:`run` (see :data:`RUN_PARAMS`). Optional fields ``skyl`` and
+        ``soilType`` (soil index) override the keyword arguments. A float
+        ``LIDF`` field is the Campbell mean leaf angle and a (2,) ``LIDF``
+        field the Verhoef's (a,b) parameters.
+    LIDF : optional
+        LIDF parameters, overrides the ``LIDF`` field, for instance to mix
+        Campbell and Verhoef's LIDFs, see :func:`calc_lidf_vec`.
+    **kwargs : optional
+        keyword arguments passed to :func:`run_vec`.
+
+    Returns
+    -------
+    wl : 1D array
+        wavelenghts, or band centres if srf is given.
+    rho_canopy : array_like
+        canopy reflectance factors, size params.shape x n_wl.
+    '''
+
+    params = np.asarray(params)
+    shape = params.shape
+    params = params.reshape(-1)
+    names = params.dtype.names
+    if names is None:
+        raise ValueError('params must be a structured array')
+    missing = [name for name in RUN_PARAMS[:-1] if name not in names]
+    if LIDF is None:
+        if 'LIDF' not in names:
+            missing.append('LIDF')
+        else:
+            LIDF = params['LIDF']
+    if missing:
+        raise ValueError('Missing parameters in structured array: %s' % ', '.join(missing))
+    for name in ('skyl', 'soilType'):
+        if name in names:
+            kwargs[name] = params[name]
+    args = [params[name] for name in RUN_PARAMS[:-1]]
+    wl, rho_canopy = run_vec(*args, LIDF=LIDF, **kwargs)
+    return wl, rho_canopy.reshape(shape+(len(wl),))
+
 def run_TIR(emisVeg, emisSoil, T_Veg, T_Soil, LAI, hot_spot, solar_zenith,solar_azimuth, view_zenith, view_azimuth, LIDF,T_VegSunlit=None, T_SoilSunlit=None, T_atm=0):
     ''' Estimates the broadband at-sensor thermal radiance using 4SAIL model.
     
@@ -215,10 +593,10 @@ def run_TIR(emisVeg, emisSoil, T_Veg, T_Soil, LAI, hot_spot, solar_zenith,solar_
     # Get the relative sun-view azimth angle
     psi=abs(solar_azimuth-view_azimuth)
     # 4SAIL for canopy reflectance and transmittance factors       
-    [tss,too,tsstoo,rdd,tdd,rsd,tsd,rdo,tdo,rso,rsos,rsod,rddt,rsdt,rdot,
-             rsodt,rsost,rsot,gammasdf,gammasdb,
+    [tss,too,rdd,tdd,rdo,tdo,rdot,gammasdf,
              gammaso]=FourSAIL.FourSAIL(LAI,hot_spot,
-                lidf,solar_zenith,view_zenith,psi,rho_leaf,tau_leaf,rsoil)
+                lidf,solar_zenith,view_zenith,psi,rho_leaf,tau_leaf,rsoil,
+                outputs=('tss','too','rdd','tdd','rdo','tdo','rdot','gammasdf','gammaso'))
     
     tso=tss*too+tss*(tdo+rsoil*rdd*too)/(1.-rsoil*rdd)
     gammad=1-rdd-tdd
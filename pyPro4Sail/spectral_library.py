@@ -1,26 +1,525 @@
 #!/usr/bin/env python
 """Spectral libraries for PROSPECT + SAIL
-Adapted from prosail Python version by 
+Adapted from prosail Python version by
 J Gomez-Dans (NCEO & UCL) j.gomez-dans@ucl.ac.uk
 https://github.com/jgomezdans/prosail/blob/master/prosail/spectral_library.py
 
+The PROSPECT-D coefficients are read from a compiled binary copy of
+``prospect_d_spectra.txt`` (``prospect_d_spectra.npy``), which is memory mapped
+instead of parsed. If the binary file is not available the text file is
+parsed as before. Use :func:`compile_spectra` to regenerate the binary file
+after editing the text file.
+
+:func:`get_spectra_grid` band-averages the coefficients to a coarser spectral
+grid (e.g. 5 or 10 nm), see :func:`averaging_matrix`.
+
+:func:`get_sensor_response` loads a spectral response function from the
+sensor library (e.g. ``Sentinel2A``) as a band-convolution operator, which is
+applied with :func:`convolve_srf`.
+
+:func:`get_soil_library` loads all the soil spectra of the soilSpectralLibrary
+folder once, from their compiled binary copy (``soil_spectra.npz``) if
+available, and :func:`get_soil_spectrum` returns a soil by name or index.
+Use :func:`compile_soil_library` after adding or editing soil files.
+
 """
+import os
 import pkgutil
 from collections import namedtuple
 from io import BytesIO
 
 import numpy as np
 
-ProspectDSpectra = namedtuple('ProspectDSpectra','wl' 
+ProspectDSpectra = namedtuple('ProspectDSpectra','wl'
                                 'nr kab kcar kbrown kw km kant')
 
+# Soil reflectance spectra, see get_soil_library
+SoilLibrary = namedtuple('SoilLibrary', 'names wl spectra')
+
+# Band-convolution operator of a sensor, see get_sensor_response
+SensorResponse = namedtuple('SensorResponse', 'bands center support weights')
+
+SPECTRA_FOLDER = os.path.dirname(os.path.abspath(__file__))
+PROSPECT_D_TEXT = 'prospect_d_spectra.txt'
+PROSPECT_D_BINARY = 'prospect_d_spectra.npy'
+SENSOR_FOLDER = os.path.join(SPECTRA_FOLDER, 'spectra', 'sensorResponseLibrary')
+SOIL_FOLDER = os.path.join(SPECTRA_FOLDER, 'spectra', 'soilSpectralLibrary')
+SOIL_BINARY = 'soil_spectra.npz'
+# Number of columns in the PROSPECT-D spectra file
+# wl, nr, kab, kcar, kant, kbrown, kw, km
+N_COLUMNS = 8
+
+def read_spectra_text():
+    """Parses the PROSPECT-D text file.
+
+    Returns
+    -------
+    spectra : 2D array
+        coefficients with the same column order than the text file
+        (wl, nr, kab, kcar, kant, kbrown, kw, km) stored as rows.
+    """
+
+    prospect_d_spectraf = pkgutil.get_data('pyPro4Sail', PROSPECT_D_TEXT)
+    spectra = np.loadtxt(BytesIO(prospect_d_spectraf), unpack=True)
+    return spectra
+
+def read_spectra_binary(filename=None):
+    """Memory maps the compiled PROSPECT-D coefficients.
+
+    Parameters
+    ----------
+    filename : str, optional
+        path to the binary file, default use the file shipped with the package.
+
+    Returns
+    -------
+    spectra : 2D array or None
+        read-only coefficients with the same layout than :func:`read_spectra_text`,
+        None if the binary file is missing or not valid.
+    """
+
+    if filename is None:
+        filename = os.path.join(SPECTRA_FOLDER, PROSPECT_D_BINARY)
+    if not os.path.isfile(filename):
+        return None
+    try:
+        spectra = np.load(filename, mmap_mode='r', allow_pickle=False)
+    except (OSError, ValueError):
+        return None
+    if spectra.ndim != 2 or spectra.shape[0] != N_COLUMNS:
+        return None
+    return spectra
+
+def compile_spectra(filename=None):
+    """Writes the binary copy of the PROSPECT-D text file.
+
+    Parameters
+    ----------
+    filename : str, optional
+        output path, default overwrite the file shipped with the package.
+
+    Returns
+    -------
+    filename : str
+        path of the binary file written.
+    """
+
+    if filename is None:
+        filename = os.path.join(SPECTRA_FOLDER, PROSPECT_D_BINARY)
+    spectra = read_spectra_text()
+    np.save(filename, np.ascontiguousarray(spectra, dtype=np.float64))
+    return filename
+
 def get_spectra():
     """Reads the spectral information and stores is for future use."""
 
     # PROSPECT-D
-    prospect_d_spectraf = pkgutil.get_data('pyPro4Sail', 'prospect_d_spectra.txt')
-    wl, nr, kab, kcar, kant, kbrown, kw, km= np.loadtxt(
-        BytesIO(prospect_d_spectraf), unpack=True)
+    spectra = read_spectra_binary()
+    if spectra is None:
+        spectra = read_spectra_text()
+    wl, nr, kab, kcar, kant, kbrown, kw, km = spectra
     #prospect_d_spectra = ProspectDSpectra(wl, nr, kab, kcar, kbrown, kw, km, kant)
 
     return wl, nr, kab, kcar, kbrown, kw, km, kant
+
+# Band-averaged spectra for each coarse grid, keyed by the grid wavelengths
+_grid_cache = {}
+
+def make_grid(step, wl_min=400, wl_max=2500):
+    """Regular spectral grid with the given step.
+
+    Parameters
+    ----------
+    step : float
+        spacing between band centres (nm).
+    wl_min, wl_max : float, optional
+        first and last band centres (nm), default the PROSPECT range.
+
+    Returns
+    -------
+    grid : 1D array
+        band centres (nm).
+    """
+
+    return np.arange(wl_min, wl_max + 0.5 * step, step, dtype=float)
+
+def averaging_matrix(wl, grid):
+    """Operator that band-averages spectra from ``wl`` to a coarser grid.
+
+    Each band of the grid covers the wavelengths from the midpoint with the
+    previous band centre up to the midpoint with the next band centre, the
+    first and last bands being symmetric around their centre.
+
+    Parameters
+    ----------
+    wl : 1D array
+        wavelengths (nm) of the input spectra.
+    grid : 1D array
+        increasing band centres (nm) of the output grid.
+
+    Returns
+    -------
+    W : 2D array
+        averaging weights, size n_grid x n_wl, so that ``W.dot(spectrum)``
+        returns the band-averaged spectrum.
+    """
+
+    wl = np.asarray(wl, dtype=float)
+    grid = np.asarray(grid, dtype=float)
+    if grid.size == 1:
+        edges = np.array([grid[0] - 0.5, grid[0] + 0.5])
+    else:
+        if np.any(np.diff(grid) <= 0):
+            raise ValueError('Spectral grid must be strictly increasing')
+        mid = 0.5 * (grid[1:] + grid[:-1])
+        edges = np.concatenate(([grid[0] - (mid[0] - grid[0])],
+                                mid,
+                                [grid[-1] + (grid[-1] - mid[-1])]))
+    band = np.digitize(wl, edges) - 1
+    W = np.zeros((grid.size, wl.size))
+    valid = np.logical_and(band >= 0, band < grid.size)
+    W[band[valid], np.flatnonzero(valid)] = 1.
+    counts = W.sum(axis=1)
+    if np.any(counts == 0):
+        raise ValueError('Bands centred at %s do not contain any wavelength'
+                         % grid[counts == 0])
+    W /= counts[:, np.newaxis]
+    return W
+
+def resample_spectra(spectra, wl, grid):
+    """Band-averages spectra to a coarser grid.
+
+    Parameters
+    ----------
+    spectra : array_like
+        spectra to average, the last dimension matching ``wl``.
+    wl : 1D array
+        wavelengths (nm) of the input spectra.
+    grid : 1D array
+        band centres (nm) of the output grid.
+
+    Returns
+    -------
+    spectra_grid : array_like
+        band-averaged spectra, the last dimension matching ``grid``.
+    """
+
+    W = averaging_matrix(wl, grid)
+    return np.dot(spectra, W.T)
+
+def get_spectra_grid(grid):
+    """PROSPECT-D coefficients band-averaged to a coarser spectral grid.
+
+    Parameters
+    ----------
+    grid : float or 1D array
+        band centres (nm) of the output grid, or the step (nm) of a regular
+        grid between 400 and 2500 nm.
+
+    Returns
+    -------
+    spectra : tuple
+        (wl, nr, kab, kcar, kbrown, kw, km, kant) with the same order than
+        :func:`get_spectra`, wl being the band centres.
+    """
+
+    if np.ndim(grid) == 0:
+        grid = make_grid(grid)
+    key = tuple(float(g) for g in grid)
+    try:
+        return _grid_cache[key]
+    except KeyError:
+        pass
+    wl, nr, kab, kcar, kbrown, kw, km, kant = get_spectra()
+    grid = np.asarray(key)
+    coefficients = resample_spectra(np.array([nr, kab, kcar, kbrown, kw, km, kant]),
+                                    wl, grid)
+    spectra = (grid,) + tuple(coefficients)
+    for value in spectra:
+        value.setflags(write=False)
+    _grid_cache[key] = spectra
+    return spectra
+
+# Sensor responses already loaded, keyed by sensor name or file path
+_sensor_cache = {}
+
+def read_srf(filename):
+    """Reads a spectral response function file.
+
+    The file has a header line with the wavelength column name followed by
+    the band names, and one row per wavelength (nm) with the relative response
+    of each band, as in the files of the sensorResponseLibrary folder.
+
+    Parameters
+    ----------
+    filename : str
+        path to the spectral response file.
+
+    Returns
+    -------
+    bands : tuple of str
+        band names.
+    wl : 1D array
+        wavelengths (nm).
+    response : 2D array
+        relative spectral response, size n_wl x n_bands.
+    """
+
+    with open(filename) as fid:
+        header = fid.readline().split()
+        data = np.loadtxt(fid, ndmin=2)
+    bands = tuple(header[1:])
+    if data.shape[1] != len(bands) + 1:
+        raise ValueError('%s: found %i response columns but %i band names'
+                         % (filename, data.shape[1] - 1, len(bands)))
+    return bands, data[:, 0], data[:, 1:]
+
+def get_sensor_response(sensor):
+    """Band-convolution operator of a sensor spectral response function.
+
+    The operator is stored in sparse form: only the library wavelengths with
+    a non-zero response in any band (``support``) are kept, so models can be
+    run just at those wavelengths and convolved with ``weights``.
+
+    Parameters
+    ----------
+    sensor : str
+        sensor name in the sensorResponseLibrary folder (e.g. 'Sentinel2A')
+        or path to a spectral response file, see :func:`read_srf`.
+
+    Returns
+    -------
+    srf : SensorResponse
+        namedtuple with
+
+            * bands : band names.
+            * center : response weighted mean wavelength (nm) of each band.
+            * support : indices of the wavelengths with non-zero response in
+              the 400-2500 nm, 1 nm PROSPECT grid.
+            * weights : normalised response at the support wavelengths,
+              size n_bands x n_support.
+    """
+
+    try:
+        return _sensor_cache[sensor]
+    except KeyError:
+        pass
+    filename = sensor
+    if not os.path.isfile(filename):
+        filename = os.path.join(SENSOR_FOLDER, sensor + '.txt')
+    bands, wl, response = read_srf(filename)
+    wl_lib = get_spectra()[0]
+    # Bring the response to the 1 nm library grid if needed
+    if wl.shape != wl_lib.shape or np.any(wl != wl_lib):
+        response = np.array([np.interp(wl_lib, wl, band, left=0., right=0.)
+                             for band in response.T]).T
+    response = np.clip(response, 0., None)
+    support = np.flatnonzero(np.any(response > 0, axis=1))
+    weights = response[support].T
+    total = weights.sum(axis=1)
+    if np.any(total == 0):
+        raise ValueError('%s: bands %s have no response between 400 and 2500 nm'
+                         % (filename, np.asarray(bands)[total == 0]))
+    weights = weights / total[:, np.newaxis]
+    center = np.dot(weights, wl_lib[support])
+    for value in (support, weights, center):
+        value.setflags(write=False)
+    srf = SensorResponse(bands, center, support, weights)
+    _sensor_cache[sensor] = srf
+    return srf
+
+def convolve_srf(spectra, srf):
+    """Band values of spectra convolved with a sensor spectral response.
+
+    Parameters
+    ----------
+    spectra : array_like
+        spectra with the wavelengths in the last dimension, either the full
+        400-2500 nm range or only the ``srf.support`` wavelengths.
+    srf : SensorResponse or str
+        sensor response, see :func:`get_sensor_response`.
+
+    Returns
+    -------
+    bands : array_like
+        band values, the last dimension of size n_bands.
+    """
+
+    if not isinstance(srf, SensorResponse):
+        srf = get_sensor_response(srf)
+    spectra = np.asarray(spectra)
+    if spectra.shape[-1] != srf.support.size:
+        spectra = spectra[..., srf.support]
+    return np.dot(spectra, srf.weights.T)
+
+# Soil spectral library, loaded on first use
+_soil_library = None
+
+def read_soil_text(folder=SOIL_FOLDER):
+    """Parses all the soil spectra text files in a folder.
+
+    Parameters
+    ----------
+    folder : str, optional
+        folder with two-column (wavelength, reflectance) text files, default
+        the soilSpectralLibrary folder shipped with the package.
+
+    Returns
+    -------
+    soils : SoilLibrary
+        namedtuple with the file names, the wavelengths (nm) and the
+        reflectance spectra, size n_soils x n_wl, sorted by file name.
+    """
+
+    names = sorted(name for name in os.listdir(folder)
+                   if os.path.isfile(os.path.join(folder, name))
+                   and name.endswith('.txt'))
+    spectra = []
+    wl = None
+    for name in names:
+        data = np.genfromtxt(os.path.join(folder, name))
+        if wl is None:
+            wl = data[:, 0]
+        elif data.shape[0] != wl.size or np.any(data[:, 0] != wl):
+            raise ValueError('%s: wavelengths differ from the rest of the library'
+                             % name)
+        spectra.append(data[:, 1])
+    return SoilLibrary(tuple(names), wl, np.array(spectra))
+
+def read_soil_binary(filename=None):
+    """Reads the compiled soil spectral library.
+
+    Parameters
+    ----------
+    filename : str, optional
+        path to the binary file, default use the file shipped with the package.
+
+    Returns
+    -------
+    soils : SoilLibrary or None
+        same as :func:`read_soil_text`, None if the binary file is missing or
+        not valid.
+    """
+
+    if filename is None:
+        filename = os.path.join(SPECTRA_FOLDER, SOIL_BINARY)
+    if not os.path.isfile(filename):
+        return None
+    try:
+        with np.load(filename, allow_pickle=False) as data:
+            soils = SoilLibrary(tuple(str(name) for name in data['names']),
+                                data['wl'],
+                                data['spectra'])
+    except (OSError, ValueError, KeyError):
+        return None
+    if soils.spectra.shape != (len(soils.names), soils.wl.size):
+        return None
+    return soils
+
+def compile_soil_library(filename=None, folder=SOIL_FOLDER):
+    """Writes the binary copy of the soil spectral library.
+
+    Parameters
+    ----------
+    filename : str, optional
+        output path, default overwrite the file shipped with the package.
+    folder : str, optional
+        folder with the soil text files.
+
+    Returns
+    -------
+    filename : str
+        path of the binary file written.
+    """
+
+    if filename is None:
+        filename = os.path.join(SPECTRA_FOLDER, SOIL_BINARY)
+    soils = read_soil_text(folder)
+    with open(filename, 'wb') as fid:
+        np.savez(fid, names=np.array(soils.names), wl=soils.wl,
+                 spectra=soils.spectra)
+    return filename
+
+def get_soil_library():
+    """Soil spectral library, read once and kept for future use.
+
+    Returns
+    -------
+    soils : SoilLibrary
+        namedtuple with the soil names, the wavelengths (nm) and the read-only
+        reflectance spectra, size n_soils x n_wl.
+    """
+
+    global _soil_library
+    if _soil_library is None:
+        soils = read_soil_binary()
+        if soils is None:
+            soils = read_soil_text()
+        for value in soils[1:]:
+            value.setflags(write=False)
+        _soil_library = soils
+    return _soil_library
+
+def get_soil_index(soil):
+    """Position of a soil in the soil spectral library.
+
+    Parameters
+    ----------
+    soil : str or int
+        soil file name, with or without the '.txt' extension, or index.
+
+    Returns
+    -------
+    index : int
+        row of the soil in ``get_soil_library().spectra``.
+    """
+
+    names = get_soil_library().names
+    if isinstance(soil, (int, np.integer)):
+        if not -len(names) <= soil < len(names):
+            raise ValueError('Soil index %i out of range, %i soils in the library'
+                             % (soil, len(names)))
+        return int(soil)
+    name = os.path.basename(soil)
+    if name not in names:
+        name = name + '.txt'
+    if name not in names:
+        raise ValueError('Soil %s not found in the soil spectral library' % soil)
+    return names.index(name)
+
+def get_soil_spectrum(soil):
+    """Reflectance spectrum of a soil.
+
+    Parameters
+    ----------
+    soil : str or int
+        soil file name or index in the soil spectral library, or path to a
+        two-column (wavelength, reflectance) text file. Relative paths are
+        relative to :data:`SOIL_FOLDER`.
+
+    Returns
+    -------
+    wl : 1D array
+        wavelengths (nm).
+    rsoil : 1D array
+        soil reflectance, read-only for the soils of the library.
+
+    Raises
+    ------
+    FileNotFoundError
+        if soil is neither in the library nor an existing file.
+    """
+
+    soils = get_soil_library()
+    if not isinstance(soil, str):
+        return soils.wl, soils.spectra[get_soil_index(soil)]
+    # An absolute path is kept as is by the join
+    path = os.path.join(SOIL_FOLDER, soil)
+    if os.path.dirname(os.path.abspath(path)) == os.path.abspath(SOIL_FOLDER):
+        name = os.path.basename(path)
+        if name in soils.names or name + '.txt' in soils.names:
+            return soils.wl, soils.spectra[get_soil_index(name)]
+    if not os.path.isfile(path):
+        raise FileNotFoundError('Soil file %s not found' % path)
+    data = np.genfromtxt(path)
+    return data[:, 0], data[:, 1]
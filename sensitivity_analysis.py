@@ -10,7 +10,7 @@ import matplotlib.pyplot as plt
 import os
 import os.path as pth
 
-from pyPro4Sail import ProspectD, FourSAIL
+from pyPro4Sail import ProspectD, FourSAIL, pyPro4SAIL
 
 from SALib.sample import saltelli
 from SALib.analyze import sobol
@@ -103,7 +103,9 @@ l, r, t = ProspectD.ProspectD_vec(samples[:,0],
                                      samples[:,6])
 
 
-lidf=FourSAIL.CalcLIDF_Campbell_vec(samples[:,8])
+# Campbell mean leaf angle of each sample, an n_samples x 2 array of (a, b)
+# would give Verhoef's bimodal LIDFs instead
+lidf=pyPro4SAIL.calc_lidf_vec(samples[:,8], samples.shape[0])
 
 # Read the soil reflectance        
 rsoil=np.genfromtxt(pth.join(
@@ -112,17 +114,18 @@ rsoil=np.genfromtxt(pth.join(
 
 #wl_soil=rsoil[:,0]
 rsoil=np.array(rsoil[:,1])
-rsoil=np.repeat(rsoil[:,np.newaxis], N_samples_canopy, axis=1)
-
-[_,_,_,_,_,_,_,_,_,_,_,_,_,_,rdot,_,_,rsot,_,_,_]=FourSAIL.FourSAIL_vec(samples[:,7],
-                                                                       np.ones(N_samples_canopy)*0.01, 
-                                                                       lidf,
-                                                                       np.ones(N_samples_canopy)*37.,
-                                                                       np.zeros(N_samples_canopy), 
-                                                                       np.zeros(N_samples_canopy),
-                                                                       r.T,
-                                                                       t.T,
-                                                                       rsoil)
+
+# The hotspot, geometry and soil are the same for all the samples and are broadcast
+rdot,rsot=FourSAIL.FourSAIL_vec(samples[:,7],
+                                0.01,
+                                lidf,
+                                37.,
+                                0.,
+                                0.,
+                                r.T,
+                                t.T,
+                                rsoil,
+                                outputs=FourSAIL.REFLECTANCE_OUTPUTS)
 
 
 rho_canopy = rdot*0.2 + rsot * (1.0 - 0.2)
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""
+Import-time benchmark for pyPro4Sail.
+
+Each module is imported in a fresh interpreter and the wall time of the import
+statement is recorded, together with the heavy dependencies that got loaded.
+The script exits with status 1 if a forward-model module loads any of
+``FORBIDDEN``, so it can be tracked in CI::
+
+    python test/benchmarkImport.py [repeats]
+"""
+import subprocess
+import sys
+
+# Modules imported by forward-only workers and the heavy packages they must not load
+FORWARD_MODULES = ('pyPro4Sail',
+                   'pyPro4Sail.FourSAIL',
+                   'pyPro4Sail.ProspectD',
+                   'pyPro4Sail.pyPro4SAIL',
+                   'pyPro4Sail.ann_inversion')
+FORBIDDEN = ('scipy', 'sklearn', 'matplotlib')
+
+SNIPPET = '''
+import sys, time
+t0 = time.perf_counter()
+import {module}
+dt = time.perf_counter() - t0
+loaded = [name for name in {forbidden!r} if name in sys.modules]
+print(dt, ','.join(loaded))
+'''
+
+def time_import(module, repeats=5):
+    '''Minimum import time (s) of ``module`` over ``repeats`` fresh interpreters.'''
+
+    times = []
+    loaded = ''
+    for _ in range(repeats):
+        out = subprocess.check_output([sys.executable, '-c',
+                                       SNIPPET.format(module=module,
+                                                      forbidden=FORBIDDEN)])
+        dt, _, loaded = out.decode().strip().partition(' ')
+        times.append(float(dt))
+    return min(times), loaded
+
+def main(repeats=5):
+    failed = False
+    # Baseline cost of numpy, which every module needs anyway
+    numpy_time, _ = time_import('numpy', repeats)
+    print('%-28s %10s %10s  %s' % ('module', 'time (ms)', '-numpy', 'heavy modules'))
+    print('%-28s %10.1f %10s' % ('numpy', 1e3 * numpy_time, ''))
+    for module in FORWARD_MODULES:
+        dt, loaded = time_import(module, repeats)
+        print('%-28s %10.1f %10.1f  %s' % (module, 1e3 * dt,
+                                           1e3 * (dt - numpy_time), loaded))
+        if loaded:
+            failed = True
+    return failed
+
+if __name__ == '__main__':
+    repeats = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    sys.exit(1 if main(repeats) else 0)
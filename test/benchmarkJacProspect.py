@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+Speed and accuracy of the batched PROSPECT-D Jacobian.
+
+The leaf reflectance and transmittance Jacobians of a random set of leaves are
+computed with a loop of :func:`ProspectDJacobian.JacProspectD` calls and with
+a single :func:`ProspectDJacobian.JacProspectD_vec` call, for the full
+spectrum and for a set of sensor bands. Run times per leaf and the maximum
+absolute difference to the loop are reported::
+
+    python test/benchmarkJacProspect.py [n_leaves]
+"""
+import sys
+import time
+
+import numpy as np
+
+from pyPro4Sail import ProspectD, ProspectDJacobian
+
+# Sentinel-2 like band centres (nm)
+WLS = (490, 560, 665, 705, 740, 783, 842, 865, 1610, 2190)
+# Maximum number of leaves run with the JacProspectD loop
+MAX_LOOP = 200
+
+def random_leaves(n_leaves, seed=0):
+    '''N, Cab, Car, Cbrown, Cw, Cm and Ant of each leaf.'''
+
+    rng = np.random.default_rng(seed)
+    return np.column_stack((rng.uniform(1.0, 3.0, n_leaves),
+                            rng.uniform(0.0, 100.0, n_leaves),
+                            rng.uniform(0.0, 20.0, n_leaves),
+                            rng.uniform(0.0, 1.0, n_leaves),
+                            rng.uniform(0.001, 0.04, n_leaves),
+                            rng.uniform(0.002, 0.02, n_leaves),
+                            rng.uniform(0.0, 10.0, n_leaves)))
+
+def main(n_leaves=2000):
+    leaves = random_leaves(n_leaves)
+    n_loop = min(n_leaves, MAX_LOOP)
+    print('%i leaves, loop run on the first %i' % (n_leaves, n_loop))
+    print('%-10s %14s %14s %8s %12s' % ('bands', 'loop us/leaf', 'vec us/leaf',
+                                         'speedup', 'max abs diff'))
+    for name, band_index in (('full', None), ('sensor', ProspectD.get_band_index(WLS))):
+        t0 = time.perf_counter()
+        loop = []
+        for leaf in leaves[:n_loop]:
+            _, _, _, Delta_rho, Delta_tau = ProspectDJacobian.JacProspectD(*leaf)
+            if band_index is not None:
+                Delta_rho, Delta_tau = Delta_rho[:, band_index], Delta_tau[:, band_index]
+            loop.append((Delta_rho, Delta_tau))
+        time_loop = (time.perf_counter() - t0) / n_loop
+        t0 = time.perf_counter()
+        _, _, _, Delta_rho, Delta_tau = ProspectDJacobian.JacProspectD_vec(*leaves.T,
+                                                                           band_index=band_index)
+        time_vec = (time.perf_counter() - t0) / n_leaves
+        loop = np.array(loop)
+        diff = max(np.max(np.abs(Delta_rho[:n_loop] - loop[:, 0])),
+                   np.max(np.abs(Delta_tau[:n_loop] - loop[:, 1])))
+        print('%-10s %14.1f %14.1f %8.1f %12.2e' % (name, 1e6 * time_loop, 1e6 * time_vec,
+                                                    time_loop / time_vec, diff))
+
+if __name__ == '__main__':
+    with np.errstate(divide='ignore', invalid='ignore'):
+        main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
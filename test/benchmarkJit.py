@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+Speed of the per-wavelength 4SAIL paths used by ``FCost_ProSail_wl``.
+
+The canopy reflectance of a random set of canopies is computed for a few
+observations and sensor bands with the interpreted :func:`FourSAIL.FourSAIL_wl`
+loop over observations and bands, with the NumPy backend of
+:func:`FourSAILJit.canopy_reflectance_wl` and, if Numba is installed, with its
+compiled kernels. Run times per canopy and the maximum absolute difference to
+the interpreted loop are reported::
+
+    python test/benchmarkJit.py [n_canopies]
+"""
+import sys
+import time
+
+import numpy as np
+
+from pyPro4Sail import FourSAIL, FourSAILJit, ProspectD
+
+# Sentinel-2 like band centres (nm) and observation geometries (sza, vza, psi)
+WLS = (490, 560, 665, 705, 740, 783, 842, 865, 1610, 2190)
+GEOMETRIES = ((30., 0., 0.), (35., 20., 90.), (40., 30., 180.))
+
+def random_canopies(n_canopies, seed=0):
+    '''LAI, hotspot and Campbell mean leaf angle of each canopy.'''
+
+    rng = np.random.default_rng(seed)
+    return np.column_stack((rng.uniform(0.1, 6.0, n_canopies),
+                            rng.uniform(0.01, 0.5, n_canopies),
+                            rng.uniform(30.0, 80.0, n_canopies)))
+
+def interpreted(lai, hotspot, lidf, sza, vza, psi, rho, tau, rsoil, skyl):
+    '''Double loop over observations and bands, as FCost_ProSail_wl used to do.'''
+
+    rho_canopy = np.empty((len(sza), len(rho)))
+    for obs in range(len(sza)):
+        for j in range(len(rho)):
+            rdot, rsot = FourSAIL.FourSAIL_wl(lai, hotspot, lidf, sza[obs], vza[obs], psi[obs],
+                                              rho[j], tau[j], rsoil[j],
+                                              outputs=FourSAIL.REFLECTANCE_OUTPUTS)
+            rho_canopy[obs, j] = rdot*skyl+rsot*(1-skyl)
+    return rho_canopy
+
+def main(n_canopies=200):
+    _, rho, tau = ProspectD.ProspectD_bands(ProspectD.get_band_index(WLS),
+                                            1.5, 40., 8., 0., 0.01, 0.009, 1.)
+    rsoil = np.linspace(0.1, 0.3, len(WLS))
+    sza, vza, psi = np.array(GEOMETRIES).T
+    canopies = random_canopies(n_canopies)
+    lidfs = [np.array(FourSAIL.CalcLIDF_Campbell(alpha)) for alpha in canopies[:, 2]]
+
+    backends = ['interpreted', 'numpy']
+    if FourSAILJit.HAS_NUMBA:
+        # Compile the kernels before timing
+        FourSAILJit.canopy_reflectance_wl(1., 0.1, lidfs[0], sza, vza, psi, rho, tau, rsoil,
+                                          0.2, backend='numba')
+        backends.append('numba')
+    else:
+        print('Numba is not installed, only the NumPy backend is benchmarked')
+    results = {}
+    for backend in backends:
+        t0 = time.perf_counter()
+        if backend == 'interpreted':
+            result = [interpreted(lai, hotspot, lidf, sza, vza, psi, rho, tau, rsoil, 0.2)
+                      for (lai, hotspot, _), lidf in zip(canopies, lidfs)]
+        else:
+            result = [FourSAILJit.canopy_reflectance_wl(lai, hotspot, lidf, sza, vza, psi,
+                                                        rho, tau, rsoil, 0.2, backend=backend)
+                      for (lai, hotspot, _), lidf in zip(canopies, lidfs)]
+        dt = time.perf_counter() - t0
+        results[backend] = (dt, np.array(result))
+    reference_time, reference = results['interpreted']
+    print('%i canopies, %i observations x %i bands' % (n_canopies, len(sza), len(WLS)))
+    print('%-12s %12s %8s %12s' % ('backend', 'us/canopy', 'speedup', 'max abs diff'))
+    for backend in backends:
+        dt, result = results[backend]
+        print('%-12s %12.1f %8.1f %12.2e' % (backend, 1e6 * dt / n_canopies,
+                                             reference_time / dt,
+                                             np.max(np.abs(result - reference))))
+
+if __name__ == '__main__':
+    with np.errstate(divide='ignore', invalid='ignore'):
+        main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
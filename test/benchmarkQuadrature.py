@@ -0,0 +1,85 @@
+# -*- coding: utf-8 -*-
+"""
+Accuracy and speed of the leaf inclination quadratures of 4SAIL.
+
+The canopy reflectance of a random set of canopies with Campbell and with
+Verhoef bimodal LIDFs and sun-view geometries is computed with the default 18
+equally spaced angle bins and with Gauss-Legendre quadratures of increasing
+number of nodes. The
+reference is a 900 bin (0.1 degree) integration. The reported time is the one
+of the leaf angle weighted sums, which scales with the number of
+:func:`FourSAIL.volscatt` evaluations::
+
+    python test/benchmarkQuadrature.py [n_samples]
+"""
+import sys
+import time
+
+import numpy as np
+
+from pyPro4Sail import FourSAIL, ProspectD
+
+REFERENCE_ANGLES = 900
+# Best of REPEATS timings
+REPEATS = 5
+QUADRATURES = (('bins', 18), ('gauss', 6), ('gauss', 8), ('gauss', 10), ('gauss', 12))
+LIDF_TYPES = ('campbell', 'verhoef')
+
+def random_canopies(n_samples, seed=0):
+    '''LAI, Campbell mean leaf angle, Verhoef a and b, sun zenith, view zenith
+    and relative azimuth.'''
+
+    rng = np.random.default_rng(seed)
+    lidf_a = rng.uniform(-1.0, 1.0, n_samples)
+    lidf_b = (1.0 - np.abs(lidf_a)) * rng.uniform(-1.0, 1.0, n_samples)
+    return np.column_stack((rng.uniform(0.5, 6.0, n_samples),
+                            rng.uniform(20.0, 85.0, n_samples),
+                            lidf_a,
+                            lidf_b,
+                            rng.uniform(0.0, 60.0, n_samples),
+                            rng.uniform(0.0, 50.0, n_samples),
+                            rng.uniform(0.0, 180.0, n_samples)))
+
+def simulate(canopies, rho, tau, rsoil, lidf_type, n_angles, quadrature):
+    '''Canopy reflectance factors, size n_wl x n_samples, and weighted sums time.'''
+
+    lai, alpha, lidf_a, lidf_b, sza, vza, psi = canopies.T
+    if lidf_type == 'campbell':
+        lidf = FourSAIL.CalcLIDF_Campbell_vec(alpha, n_elements=n_angles, quadrature=quadrature)
+    else:
+        lidf = FourSAIL.CalcLIDF_Verhoef_vec(lidf_a, lidf_b, n_elements=n_angles,
+                                             quadrature=quadrature)
+    dt = np.inf
+    for _ in range(REPEATS):
+        t0 = time.perf_counter()
+        FourSAIL.weighted_sum_over_lidf_vec(lidf, sza, vza, psi, quadrature)
+        dt = min(dt, time.perf_counter() - t0)
+    rdot, rsot = FourSAIL.FourSAIL_vec(lai, 0.05, lidf, sza, vza, psi, rho, tau, rsoil,
+                                       outputs=FourSAIL.REFLECTANCE_OUTPUTS,
+                                       quadrature=quadrature)
+    return 0.2 * rdot + 0.8 * rsot, dt
+
+def main(n_samples=500):
+    wl, rho, tau = ProspectD.ProspectD(1.5, 40., 8., 0., 0.01, 0.009, 1.)
+    rho, tau, wl = rho[::10], tau[::10], wl[::10]
+    rsoil = np.full(wl.shape, 0.15)
+    canopies = random_canopies(n_samples)
+    print('%i canopies, %i wavelengths, reference %i bins'
+          % (n_samples, wl.size, REFERENCE_ANGLES))
+    for lidf_type in LIDF_TYPES:
+        reference, _ = simulate(canopies, rho, tau, rsoil, lidf_type, REFERENCE_ANGLES, 'bins')
+        print('%s LIDF' % lidf_type)
+        print('%-12s %10s %10s %10s %14s' % ('quadrature', 'max', 'p95', 'rmse',
+                                             'sums us/sample'))
+        for quadrature, n_angles in QUADRATURES:
+            rho_canopy, dt = simulate(canopies, rho, tau, rsoil, lidf_type, n_angles,
+                                      quadrature)
+            error = np.abs(rho_canopy - reference)
+            print('%-12s %10.2e %10.2e %10.2e %14.2f'
+                  % ('%s %i' % (quadrature, n_angles), np.max(error),
+                     np.percentile(np.max(error, axis=0), 95), np.sqrt(np.mean(error**2)),
+                     1e6 * dt / n_samples))
+
+if __name__ == '__main__':
+    with np.errstate(divide='ignore', invalid='ignore'):
+        main(int(sys.argv[1]) if len(sys.argv) > 1 else 500)
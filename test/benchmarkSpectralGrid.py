@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""
+Accuracy and speed of running PROSPECT-D + 4SAIL on a coarse spectral grid.
+
+A random set of leaves and canopies is simulated at 1 nm and on regular
+grids of increasing step. The reference is the 1 nm simulation band-averaged to
+the same grid, so the reported error is the loss caused by averaging the
+absorption coefficients and soil spectra before, instead of after, running
+the models::
+
+    python test/benchmarkSpectralGrid.py [n_samples]
+"""
+import sys
+import time
+
+import numpy as np
+
+from pyPro4Sail import FourSAIL, ProspectD, spectral_library
+from pyPro4Sail.pyPro4SAIL import DEFAULT_SOIL
+
+STEPS = (5, 10, 20)
+
+def random_samples(n_samples, seed=0):
+    '''PROSPECT-D parameters and LAI, leaf angle and sun zenith angle.'''
+
+    rng = np.random.default_rng(seed)
+    leaves = np.column_stack((rng.uniform(1.0, 3.0, n_samples),
+                              rng.uniform(0.0, 100.0, n_samples),
+                              rng.uniform(0.0, 25.0, n_samples),
+                              rng.uniform(0.0, 1.0, n_samples),
+                              rng.uniform(0.001, 0.05, n_samples),
+                              rng.uniform(0.001, 0.02, n_samples),
+                              rng.uniform(0.0, 10.0, n_samples)))
+    canopies = np.column_stack((rng.uniform(0.1, 6.0, n_samples),
+                                rng.uniform(30.0, 80.0, n_samples),
+                                rng.uniform(0.0, 60.0, n_samples)))
+    return leaves, canopies
+
+def simulate(engine, rsoil, leaves, canopies):
+    '''Canopy reflectance factors for each sample, size n_samples x n_wl.'''
+
+    rho_leaf, tau_leaf = engine.run(leaves)
+    rho_canopy = np.empty(rho_leaf.shape)
+    for i, (lai, leaf_angle, sza) in enumerate(canopies):
+        lidf = FourSAIL.CalcLIDF_Campbell(leaf_angle)
+        out = FourSAIL.FourSAIL(lai, 0.01, lidf, sza, 0., 0.,
+                                rho_leaf[i], tau_leaf[i], rsoil)
+        rho_canopy[i] = 0.2 * out[14] + 0.8 * out[17]
+    return rho_leaf.copy(), rho_canopy
+
+def main(n_samples=200):
+    leaves, canopies = random_samples(n_samples)
+    wl_soil, rsoil = spectral_library.get_soil_spectrum(DEFAULT_SOIL)
+
+    engine = ProspectD.ProspectDEngine()
+    t0 = time.perf_counter()
+    rho_leaf, rho_canopy = simulate(engine, rsoil, leaves, canopies)
+    time_ref = time.perf_counter() - t0
+    print('%-8s %8s %10s %10s %10s %10s %8s' % ('step', 'n_wl', 'leaf max', 'leaf rmse',
+                                                 'canopy max', 'canopy rmse', 'speedup'))
+    print('%-8s %8i %10s %10s %10s %10s %8.1f' % ('1 nm', engine.wl.size, '-', '-',
+                                                   '-', '-', 1.))
+    for step in STEPS:
+        grid_engine = ProspectD.ProspectDEngine(grid=step)
+        grid = grid_engine.wl
+        rsoil_grid = spectral_library.resample_spectra(rsoil, wl_soil, grid)
+        t0 = time.perf_counter()
+        rho_leaf_grid, rho_canopy_grid = simulate(grid_engine, rsoil_grid,
+                                                  leaves, canopies)
+        time_grid = time.perf_counter() - t0
+        error_leaf = rho_leaf_grid - spectral_library.resample_spectra(
+                rho_leaf, engine.wl, grid)
+        error_canopy = rho_canopy_grid - spectral_library.resample_spectra(
+                rho_canopy, engine.wl, grid)
+        print('%-8s %8i %10.2e %10.2e %10.2e %10.2e %8.1f'
+              % ('%g nm' % step, grid.size,
+                 np.max(np.abs(error_leaf)), np.sqrt(np.mean(error_leaf**2)),
+                 np.max(np.abs(error_canopy)), np.sqrt(np.mean(error_canopy**2)),
+                 time_ref / time_grid))
+
+if __name__ == '__main__':
+    with np.errstate(divide='ignore', invalid='ignore'):
+        main(int(sys.argv[1]) if len(sys.argv) > 1 else 200)
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+Accuracy and speed of the interpolated leaf angle weighted coefficients.
+
+A scene of random pixels, each with its own Campbell mean leaf angle, LAI and
+sun-view geometry, is run with :func:`FourSAIL.FourSAIL_vec` using the exact
+:func:`FourSAIL.weighted_sum_over_lidf_vec` and using
+:class:`FourSAIL.CampbellSumsTable` tables of decreasing grid steps. The
+table size and build time, the time of the geometry stage and the maximum
+and RMS error of the canopy reflectance factors are reported::
+
+    python test/benchmarkSumsTable.py [n_pixels]
+"""
+import sys
+import time
+
+import numpy as np
+
+from pyPro4Sail import FourSAIL, ProspectD
+
+# Grid steps (degrees) of mean leaf angle, zenith and relative azimuth
+STEPS = ((2.5, 2.5, 10.), (2.5, 2.5, 5.), (1., 2.5, 10.), (2.5, 1., 5.))
+
+def random_pixels(n_pixels, seed=0):
+    '''LAI, Campbell mean leaf angle, sun zenith, view zenith and relative azimuth.'''
+
+    rng = np.random.default_rng(seed)
+    return np.column_stack((rng.uniform(0.5, 6.0, n_pixels),
+                            rng.uniform(0.0, 90.0, n_pixels),
+                            rng.uniform(0.0, 80.0, n_pixels),
+                            rng.uniform(0.0, 80.0, n_pixels),
+                            rng.uniform(0.0, 180.0, n_pixels)))
+
+def main(n_pixels=100000):
+    wl, rho, tau = ProspectD.ProspectD(1.5, 40., 8., 0., 0.01, 0.009, 1.)
+    rho, tau, wl = rho[::20], tau[::20], wl[::20]
+    rsoil = np.full(wl.shape, 0.15)
+    lai, alpha, sza, vza, psi = random_pixels(n_pixels).T
+
+    t0 = time.perf_counter()
+    weighted_sums = FourSAIL.weighted_sum_over_lidf_vec(FourSAIL.CalcLIDF_Campbell_vec(alpha),
+                                                        sza, vza, psi)
+    time_exact = time.perf_counter() - t0
+    reference = np.array(FourSAIL.FourSAIL_vec(lai, 0.05, None, sza, vza, psi, rho, tau, rsoil,
+                                               outputs=FourSAIL.REFLECTANCE_OUTPUTS,
+                                               weighted_sums=weighted_sums))
+    print('%i pixels, %i wavelengths' % (n_pixels, wl.size))
+    print('%-16s %8s %8s %10s %10s %10s' % ('steps', 'MB', 'build s', 'sums s',
+                                             'max', 'rmse'))
+    print('%-16s %8s %8s %10.2f %10s %10s' % ('exact', '-', '-', time_exact, '-', '-'))
+    for steps in STEPS:
+        t0 = time.perf_counter()
+        table = FourSAIL.CampbellSumsTable(*steps)
+        time_build = time.perf_counter() - t0
+        t0 = time.perf_counter()
+        weighted_sums = table(alpha, sza, vza, psi)
+        time_table = time.perf_counter() - t0
+        rho_canopy = np.array(FourSAIL.FourSAIL_vec(lai, 0.05, None, sza, vza, psi,
+                                                    rho, tau, rsoil,
+                                                    outputs=FourSAIL.REFLECTANCE_OUTPUTS,
+                                                    weighted_sums=weighted_sums))
+        error = np.abs(rho_canopy - reference)
+        print('%-16s %8.1f %8.2f %10.2f %10.2e %10.2e'
+              % ('%g/%g/%g' % steps, table.nbytes / 1e6, time_build, time_table,
+                 np.max(error), np.sqrt(np.mean(error**2))))
+
+if __name__ == '__main__':
+    with np.errstate(divide='ignore', invalid='ignore'):
+        main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
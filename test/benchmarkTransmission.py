@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+"""
+Speed and accuracy of the fast exponential integral in PROSPECT-D.
+
+Runs :func:`ProspectD.ProspectD_vec` for a random set of leaves with the scipy
+exponential integral and with ``fast_expint=True``, and reports the run times
+and the maximum absolute difference in the transmission term and in the leaf
+reflectance and transmittance::
+
+    python test/benchmarkTransmission.py [n_leaves]
+"""
+import sys
+import time
+
+import numpy as np
+
+from pyPro4Sail import ProspectD
+
+def random_leaves(n_leaves, seed=0):
+    '''Uniformly distributed PROSPECT-D parameters within the LOPEX'93 ranges.'''
+
+    rng = np.random.default_rng(seed)
+    return (rng.uniform(1.0, 3.0, n_leaves),
+            rng.uniform(0.0, 100.0, n_leaves),
+            rng.uniform(0.0, 25.0, n_leaves),
+            rng.uniform(0.0, 1.0, n_leaves),
+            rng.uniform(0.001, 0.05, n_leaves),
+            rng.uniform(0.001, 0.02, n_leaves),
+            rng.uniform(0.0, 10.0, n_leaves))
+
+def best_time(function, repeats=3):
+    '''Minimum run time (s) and result of ``function`` over ``repeats`` runs.'''
+
+    times = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - t0)
+    return min(times), result
+
+def main(n_leaves=2000):
+    params = random_leaves(n_leaves)
+    k = np.linspace(1e-6, 50, 1000001)
+
+    t_exact, e1_exact = best_time(lambda: ProspectD.exp1(k))
+    t_fast, e1_fast = best_time(lambda: ProspectD.exp1(k, fast_expint=True))
+    print('E1 on %i points: scipy %.1f ms, fast %.1f ms (x%.1f)'
+          % (k.size, 1e3 * t_exact, 1e3 * t_fast, t_exact / t_fast))
+    print('  max abs error of k**2*E1(k): %.2e'
+          % np.max(np.abs(k**2 * (e1_fast - e1_exact))))
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        t_exact, (_, rho_exact, tau_exact) = best_time(
+                lambda: ProspectD.ProspectD_vec(*params))
+        t_fast, (_, rho_fast, tau_fast) = best_time(
+                lambda: ProspectD.ProspectD_vec(*params, fast_expint=True))
+    print('ProspectD_vec on %i leaves: scipy %.1f ms, fast %.1f ms (x%.1f)'
+          % (n_leaves, 1e3 * t_exact, 1e3 * t_fast, t_exact / t_fast))
+    print('  max abs error rho: %.2e, tau: %.2e'
+          % (np.max(np.abs(rho_fast - rho_exact)),
+             np.max(np.abs(tau_fast - tau_exact))))
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 2000)
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+"""
+Scaling of the vectorised volume scattering in 4SAIL with the number of samples.
+
+:func:`FourSAIL.weighted_sum_over_lidf_vec` is run for random sun-view
+geometries and Campbell LIDFs, so the geometry cache is bypassed, with the
+leaf angle x sample kernels and with the former loop over the leaf angles.
+The maximum difference is computed against the scalar
+:func:`FourSAIL.volscatt` on the first samples::
+
+    python test/benchmarkVolscatt.py [max_samples]
+"""
+import sys
+import time
+
+import numpy as np
+
+from pyPro4Sail import FourSAIL
+
+# Number of samples compared with the scalar volscatt reference
+N_REFERENCE = 1000
+
+def random_geometries(n_samples, seed=0):
+    '''Campbell LIDFs and sun zenith, view zenith and relative azimuth angles.'''
+
+    rng = np.random.default_rng(seed)
+    lidf = FourSAIL.CalcLIDF_Campbell_vec(rng.uniform(10.0, 80.0, n_samples))
+    return (lidf,
+            rng.uniform(0.0, 70.0, n_samples),
+            rng.uniform(0.0, 60.0, n_samples),
+            rng.uniform(0.0, 180.0, n_samples))
+
+def loop_over_angles(lidf, tts, tto, psi):
+    '''Weighted sums with one volscatt_vec call per leaf angle.'''
+
+    n_angles = lidf.shape[0]
+    cts = np.cos(np.radians(tts))
+    cto = np.cos(np.radians(tto))
+    angle_step = 90.0 / n_angles
+    sums = np.zeros((5, tts.size))
+    for i, ttl in enumerate(np.arange(n_angles) * angle_step + angle_step * 0.5):
+        chi_s, chi_o, frho, ftau = FourSAIL.volscatt_vec(tts, tto, psi, ttl)
+        sums += lidf[i] * np.array([chi_s / cts, chi_o / cto,
+                                    np.cos(np.radians(ttl))**2 * np.ones(tts.size),
+                                    frho * np.pi / (cts * cto),
+                                    ftau * np.pi / (cts * cto)])
+    return sums
+
+def scalar_reference(lidf, tts, tto, psi):
+    '''Weighted sums with the scalar volscatt, one call per sample and leaf angle.'''
+
+    n_angles = lidf.shape[0]
+    angles, _ = FourSAIL.leaf_angles(n_angles)
+    sums = np.zeros((5, tts.size))
+    for j in range(tts.size):
+        cts = np.cos(np.radians(tts[j]))
+        cto = np.cos(np.radians(tto[j]))
+        for i, ttl in enumerate(angles):
+            chi_s, chi_o, frho, ftau = FourSAIL.volscatt(tts[j], tto[j], psi[j], ttl)
+            sums[:, j] += lidf[i, j] * np.array([chi_s / cts, chi_o / cto,
+                                                 np.cos(np.radians(ttl))**2,
+                                                 frho * np.pi / (cts * cto),
+                                                 ftau * np.pi / (cts * cto)])
+    return sums
+
+def best_time(function, repeats=3):
+    '''Minimum run time (s) and result of ``function`` over ``repeats`` runs.'''
+
+    times = []
+    for _ in range(repeats):
+        t0 = time.perf_counter()
+        result = function()
+        times.append(time.perf_counter() - t0)
+    return min(times), result
+
+def main(max_samples=1000000):
+    print('%10s %12s %12s %10s %12s %10s' % ('n_samples', 'loop (ms)', 'array (ms)',
+                                             'speedup', 'us/sample', 'max diff'))
+    n_samples = 1000
+    while n_samples <= max_samples:
+        args = random_geometries(n_samples)
+        repeats = 3 if n_samples < 1000000 else 1
+        t_loop, _ = best_time(lambda: loop_over_angles(*args), repeats)
+        t_array, sums = best_time(
+                lambda: np.array(FourSAIL.weighted_sum_over_lidf_vec(*args)), repeats)
+        n_reference = min(n_samples, N_REFERENCE)
+        ref = scalar_reference(*(arg[..., :n_reference] for arg in args))
+        print('%10i %12.1f %12.1f %10.1f %12.3f %10.1e'
+              % (n_samples, 1e3 * t_loop, 1e3 * t_array, t_loop / t_array,
+                 1e6 * t_array / n_samples, np.max(np.abs(sums[:, :n_reference] - ref))))
+        n_samples *= 10
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000)
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+"""
+Regression checks of the batched 4SAIL.
+
+The in-place J1 and J2 transmission helpers are compared with
+:func:`FourSAIL.Jfunc1_vec` and :func:`FourSAIL.Jfunc2`, and
+:func:`FourSAIL.FourSAIL_vec` run with a reused workspace and out= buffers
+with a loop of :func:`FourSAIL.FourSAIL` calls.
+:func:`FourSAIL.FourSAIL_geometries` is compared with
+:func:`FourSAIL.FourSAIL_vec` for one canopy in many geometries, and the runs
+of many leaves through one :class:`FourSAIL.FourSAILPlan` with
+:func:`FourSAIL.FourSAIL`. The canopy terms coupled with a soil library by
+:func:`FourSAIL.soil_coupling` are compared with a FourSAIL run per soil.
+The checks run with pytest or as a script::
+
+    python test/testFourSAILVec.py
+"""
+import numpy as np
+
+from pyPro4Sail import FourSAIL, ProspectD, pyPro4SAIL, spectral_library
+
+# LAI, hotspot, sun zenith, view zenith and relative azimuth of each sample
+SAMPLES = np.array(((0.5, 0.05, 30., 20., 90.),
+                    (2., 0.1, 30., 30., 0.),
+                    (3., 0.01, 0., 0., 0.),
+                    (4., 0.2, 60., 45., 180.),
+                    (6., 0.05, 20., 70., 30.)))
+TOL = 1e-9
+
+def leaves(n_samples=len(SAMPLES), step=25):
+    '''Leaf reflectance and transmittance of each sample, size n_wl x n_samples.'''
+
+    spectra = [ProspectD.ProspectD(1.2 + 0.3 * i, 20. + 10. * i, 8., 0.1 * i, 0.01, 0.009, 1.)
+               for i in range(n_samples)]
+    rho = np.array([spectrum[1][::step] for spectrum in spectra]).T
+    tau = np.array([spectrum[2][::step] for spectrum in spectra]).T
+    return rho, tau
+
+def reference(lidf, rho, tau, rsoil, outputs=FourSAIL.OUTPUTS):
+    '''Outputs of a loop of FourSAIL calls, one array per output.'''
+
+    results = [FourSAIL.FourSAIL(lai, hotspot, lidf, tts, tto, psi, rho[:, i], tau[:, i],
+                                 rsoil[:, i], outputs=outputs)
+               for i, (lai, hotspot, tts, tto, psi) in enumerate(SAMPLES)]
+    return [np.array([result[k] for result in results]).T for k in range(len(outputs))]
+
+def assert_outputs(outputs, expected):
+    for output, value in zip(outputs, expected):
+        assert np.max(np.abs(np.asarray(output) - value)) < TOL
+
+def test_transmission_helpers():
+    rng = np.random.default_rng(0)
+    k = rng.uniform(0.3, 3., 50)
+    t = rng.uniform(0.1, 8., 50)
+    # Half of the pairs near the k=l singularity
+    l = np.vstack((rng.uniform(0., 2., (10, 50)), k + rng.uniform(-1e-4, 1e-4, (10, 50)) / t))
+    shape = l.shape
+    work = [np.empty(shape) for _ in range(4)]
+    mask = np.empty(shape, dtype=bool)
+    j1 = FourSAIL._jfunc1_inplace(k, l, t, *work, mask)
+    assert np.max(np.abs(j1 - FourSAIL.Jfunc1_vec(k, l, t))) < TOL
+    j2 = FourSAIL._jfunc2_inplace(k, l, t, np.empty(shape), np.empty(shape))
+    assert np.max(np.abs(j2 - FourSAIL.Jfunc2(k, l, t))) < TOL
+    assert np.max(np.abs(FourSAIL._jfunc1_broadcast(k, l, t) - j1)) < TOL
+
+def test_workspace_out():
+    lidf = FourSAIL.CalcLIDF_Campbell(57.)
+    rho, tau = leaves()
+    rsoil = np.full(rho.shape, 0.15)
+    expected = reference(lidf, rho, tau, rsoil)
+    lai, hotspot, tts, tto, psi = SAMPLES.T
+    assert_outputs(FourSAIL.FourSAIL_vec(lai, hotspot, lidf, tts, tto, psi, rho, tau, rsoil),
+                   expected)
+    workspace = FourSAIL.FourSAILWorkspace()
+    for _ in range(2):
+        # The second run reuses the arrays of the first one
+        assert_outputs(FourSAIL.FourSAIL_vec(lai, hotspot, lidf, tts, tto, psi, rho, tau,
+                                             rsoil, workspace=workspace), expected)
+    out = [np.empty(rho.shape) for _ in FourSAIL.REFLECTANCE_OUTPUTS]
+    rdot, rsot = FourSAIL.FourSAIL_vec(lai, hotspot, lidf, tts, tto, psi, rho, tau, rsoil,
+                                       outputs=FourSAIL.REFLECTANCE_OUTPUTS,
+                                       workspace=workspace, out=out)
+    assert rdot is out[0] and rsot is out[1]
+    assert_outputs(out, reference(lidf, rho, tau, rsoil, FourSAIL.REFLECTANCE_OUTPUTS))
+
+def test_geometries():
+    lidf = FourSAIL.CalcLIDF_Campbell(57.)
+    rho, tau = leaves(1)
+    rho, tau = rho[:, 0], tau[:, 0]
+    rsoil = np.full(rho.shape, 0.15)
+    # Repeated sun and view zenith angles, including the hotspot and nadir
+    tts, tto, psi = (angle.reshape(-1) for angle in
+                     np.meshgrid((0., 30., 60.), (0., 30., 45.), (0., 90., 180.), indexing='ij'))
+    for lai, hotspot in ((0.5, 0.05), (3., 0.1), (3., 0.)):
+        expected = FourSAIL.FourSAIL_vec(lai, hotspot, lidf, tts, tto, psi, rho, tau, rsoil)
+        geometries = FourSAIL.FourSAIL_geometries(lai, hotspot, lidf, tts, tto, psi,
+                                                  rho, tau, rsoil)
+        for output, value in zip(geometries, expected):
+            assert np.shape(output) == np.shape(value)
+        assert_outputs(geometries, expected)
+
+def test_plan():
+    lidf = FourSAIL.CalcLIDF_Campbell(57.)
+    rho, tau = leaves()
+    rsoil = np.full(rho.shape, 0.15)
+    lai, hotspot, tts, tto, psi = SAMPLES.T
+    for index in range(len(SAMPLES)):
+        # One canopy and geometry, one leaf at a time
+        plan = FourSAIL.FourSAILPlan(lai[index], hotspot[index], lidf, tts[index], tto[index],
+                                     psi[index])
+        for leaf in range(rho.shape[1]):
+            expected = FourSAIL.FourSAIL(lai[index], hotspot[index], lidf, tts[index],
+                                         tto[index], psi[index], rho[:, leaf], tau[:, leaf],
+                                         rsoil[:, leaf])
+            assert_outputs(plan.run(rho[:, leaf], tau[:, leaf], rsoil[:, leaf]), expected)
+    # All the canopies, the outputs requested in several runs
+    plan = FourSAIL.FourSAILPlan(lai, hotspot, lidf, tts, tto, psi)
+    for outputs in (FourSAIL.REFLECTANCE_OUTPUTS, FourSAIL.CANOPY_OUTPUTS, FourSAIL.OUTPUTS):
+        assert_outputs(plan.run(rho, tau, rsoil, outputs=outputs),
+                       reference(lidf, rho, tau, rsoil, outputs))
+    # The gap fractions shared by the runs cannot be modified by the caller
+    tss, too, tsstoo = plan.run(rho, tau, rsoil, outputs=('tss', 'too', 'tsstoo'))
+    assert not (tss.flags.writeable or too.flags.writeable or tsstoo.flags.writeable)
+
+def test_soil_coupling():
+    lidf = FourSAIL.CalcLIDF_Campbell(57.)
+    library = spectral_library.get_soil_library()
+    rho, tau = leaves(1, step=1)
+    rho, tau = rho[:, 0], tau[:, 0]
+    for lai, hotspot, tts, tto, psi in SAMPLES:
+        canopy = FourSAIL.FourSAIL(lai, hotspot, lidf, tts, tto, psi, rho, tau, 0.,
+                                   outputs=FourSAIL.CANOPY_OUTPUTS)
+        coupled = FourSAIL.soil_coupling(*canopy, rsoil=library.spectra)
+        for soil, rsoil in enumerate(library.spectra):
+            expected = FourSAIL.FourSAIL(lai, hotspot, lidf, tts, tto, psi, rho, tau, rsoil,
+                                         outputs=FourSAIL.SOIL_OUTPUTS)
+            assert_outputs([output[soil] for output in coupled], expected)
+    # Whole Pro4SAIL run with all the soils
+    leaf, canopy = (1.5, 40., 8., 0., 0.01, 0.009, 1.), (3., 0.05, 30., 0., 20., 90.)
+    _, rho_canopy = pyPro4SAIL.run_soils(*leaf, *canopy, 57.)
+    for soil in range(len(library.names)):
+        _, expected = pyPro4SAIL.run(*leaf, *canopy, 57., soilType=soil)
+        assert np.max(np.abs(rho_canopy[soil] - expected)) < TOL
+
+if __name__ == '__main__':
+    for test in (test_transmission_helpers, test_workspace_out, test_geometries, test_plan,
+                 test_soil_coupling):
+        test()
+        print('%s ok' % test.__name__)
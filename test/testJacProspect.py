@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+"""
+Regression checks of the batched PROSPECT-D Jacobian.
+
+:func:`ProspectDJacobian.JacProspectD_vec` is compared with a loop of
+:func:`ProspectDJacobian.JacProspectD` calls, for the full spectrum and a set
+of sensor bands, and with central finite differences of
+:func:`ProspectD.ProspectD`. The derivatives with respect to Cw and Cm reach
+a few thousands, so the errors are relative to max(1, |derivative|). In
+nearly opaque bands the scalar Stokes derivatives lose a few digits to
+cancellation, there the batched ones match the finite differences. The
+checks run with pytest or as a script::
+
+    python test/testJacProspect.py
+"""
+import numpy as np
+
+from pyPro4Sail import ProspectD, ProspectDJacobian
+
+# Sentinel-2 like band centres (nm)
+WLS = (490, 560, 665, 705, 740, 783, 842, 865, 1610, 2190)
+TOL = 1e-9
+# Jacobian agreement with the scalar JacProspectD, bounded by its cancellation errors
+JAC_TOL = 1e-8
+# Relative step of the finite differences, and their truncation and round-off error
+FD_STEP = 1e-5
+FD_TOL = 1e-7
+# Nearly opaque leaf below 450 nm
+OPAQUE_LEAF = (1.08, 87.6, 16., 0.08, 0.027, 0.02, 0.4)
+
+def random_leaves(n_leaves, seed=0):
+    '''N, Cab, Car, Cbrown, Cw, Cm and Ant of each leaf.'''
+
+    rng = np.random.default_rng(seed)
+    return np.column_stack((rng.uniform(1.0, 3.0, n_leaves),
+                            rng.uniform(0.0, 100.0, n_leaves),
+                            rng.uniform(0.0, 20.0, n_leaves),
+                            rng.uniform(0.0, 1.0, n_leaves),
+                            rng.uniform(0.001, 0.04, n_leaves),
+                            rng.uniform(0.002, 0.02, n_leaves),
+                            rng.uniform(0.0, 10.0, n_leaves)))
+
+def relative_error(value, reference):
+    return np.max(np.abs(value - reference) / np.maximum(1., np.abs(reference)))
+
+def test_jacobian_loop():
+    leaves = random_leaves(50)
+    band_index = ProspectD.get_band_index(WLS)
+    _, rho, tau, Delta_rho, Delta_tau = ProspectDJacobian.JacProspectD_vec(*leaves.T)
+    _, _, _, bands_rho, bands_tau = ProspectDJacobian.JacProspectD_vec(*leaves.T,
+                                                                       band_index=band_index)
+    for i, leaf in enumerate(leaves):
+        _, rho_i, tau_i, Delta_rho_i, Delta_tau_i = ProspectDJacobian.JacProspectD(*leaf)
+        assert relative_error(rho[i], rho_i) < TOL
+        assert relative_error(tau[i], tau_i) < TOL
+        assert relative_error(Delta_rho[i], Delta_rho_i) < JAC_TOL
+        assert relative_error(Delta_tau[i], Delta_tau_i) < JAC_TOL
+        # The band subset must not change the batched results
+        assert relative_error(bands_rho[i], Delta_rho[i][:, band_index]) < TOL
+        assert relative_error(bands_tau[i], Delta_tau[i][:, band_index]) < TOL
+
+def test_jacobian_finite_differences():
+    leaves = np.vstack((random_leaves(5, seed=1), OPAQUE_LEAF))
+    _, _, _, Delta_rho, Delta_tau = ProspectDJacobian.JacProspectD_vec(*leaves.T)
+    for i, leaf in enumerate(leaves):
+        for param in range(leaf.size):
+            step = FD_STEP * max(abs(leaf[param]), 1e-2)
+            forward, backward = leaf.copy(), leaf.copy()
+            forward[param] += step
+            backward[param] -= step
+            _, rho_f, tau_f = ProspectD.ProspectD(*forward)
+            _, rho_b, tau_b = ProspectD.ProspectD(*backward)
+            assert relative_error(Delta_rho[i, param], (rho_f - rho_b) / (2. * step)) < FD_TOL
+            assert relative_error(Delta_tau[i, param], (tau_f - tau_b) / (2. * step)) < FD_TOL
+
+if __name__ == '__main__':
+    for test in (test_jacobian_loop, test_jacobian_finite_differences):
+        test()
+        print('%s ok' % test.__name__)
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+"""
+Regression checks of the compiled per-wavelength 4SAIL kernels.
+
+The 'numba' and 'numpy' backends of :func:`FourSAILJit.canopy_reflectance_wl`
+are compared on regular canopies and on near-degenerate inputs: leaves that
+neither reflect nor transmit, vanishing LAI, a black soil and non-absorbing
+leaves, where both backends must give NaN. The checks run
+with pytest or as a script::
+
+    python test/testJit.py
+"""
+import numpy as np
+import pytest
+
+pytest.importorskip('numba')
+
+from pyPro4Sail import FourSAIL, FourSAILJit, ProspectD
+
+TTS = (0., 30., 30., 60.)
+TTO = (0., 30., 10., 45.)
+PSI = (0., 0., 90., 180.)
+
+def compare(lai, hotspot, rho, tau, rsoil, LIDF=57.):
+    lidf = FourSAIL.CalcLIDF_Campbell(LIDF)
+    reflectance = [FourSAILJit.canopy_reflectance_wl(lai, hotspot, lidf, TTS, TTO, PSI,
+                                                     rho, tau, rsoil, 0.2, backend=backend)
+                   for backend in FourSAILJit.BACKENDS]
+    assert np.all(np.isfinite(reflectance[1]))
+    assert np.max(np.abs(reflectance[0] - reflectance[1])) < 1e-9
+
+def test_jit_backends():
+    _, rho, tau = ProspectD.ProspectD(1.5, 40., 8., 0., 0.01, 0.009, 1.)
+    rho, tau = rho[::100], tau[::100]
+    for lai in (0.5, 3.):
+        for hotspot in (0., 0.05):
+            compare(lai, hotspot, rho, tau, np.full(rho.shape, 0.15))
+
+def test_jit_degenerate():
+    _, rho, tau = ProspectD.ProspectD(1.5, 40., 8., 0., 0.01, 0.009, 1.)
+    rho, tau = rho[::100], tau[::100]
+    zero = np.zeros(rho.shape)
+    for lai in (0., 1e-12, 1e-6, 3.):
+        # Leaves that neither reflect nor transmit
+        compare(lai, 0.05, zero, zero, np.full(rho.shape, 0.15))
+        compare(lai, 0.05, zero + 1e-12, zero + 1e-12, np.full(rho.shape, 0.15))
+        # Black soil
+        compare(lai, 0.05, rho, tau, zero)
+        compare(lai, 0.05, zero, zero, zero)
+
+def test_jit_non_absorbing():
+    # rho+tau=1 has no finite solution, the backends must not differ in how they fail
+    lidf = FourSAIL.CalcLIDF_Campbell(57.)
+    half = np.full(3, 0.5)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        reflectance = [FourSAILJit.canopy_reflectance_wl(2., 0.05, lidf, TTS, TTO, PSI,
+                                                         half, half, np.full(3, 0.15), 0.2,
+                                                         backend=backend)
+                       for backend in FourSAILJit.BACKENDS]
+    np.testing.assert_array_equal(np.isnan(reflectance[0]), np.isnan(reflectance[1]))
+
+if __name__ == '__main__':
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for test in (test_jit_backends, test_jit_degenerate, test_jit_non_absorbing):
+            test()
+            print('%s ok' % test.__name__)
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+Regression checks of the vectorised Leaf Inclination Distribution Functions.
+
+:func:`FourSAIL.CalcLIDF_Verhoef_vec` is compared with the scalar
+:func:`FourSAIL.CalcLIDF_Verhoef` over a grid of (a, b) pairs with
+|a|+|b|<=1 and several numbers of angles, the roots of the implicit Verhoef
+equation are checked at the Gauss-Legendre nodes and the mean leaf angle of
+the Gauss-Legendre weights is compared with the one of a fine angle binning.
+The checks run with pytest or as a script::
+
+    python test/testLIDF.py
+"""
+import numpy as np
+
+from pyPro4Sail import FourSAIL
+
+N_ELEMENTS = (10, 18, 36, 90)
+GAUSS_NODES = (10, 24)
+# Number of angle bins of the reference mean leaf angle
+REFERENCE_BINS = 900
+
+def verhoef_grid(n_steps=41, max_sum=1.):
+    '''(a, b) pairs of a regular grid with |a|+|b|<=max_sum.'''
+
+    a, b = np.meshgrid(np.linspace(-1, 1, n_steps), np.linspace(-1, 1, n_steps))
+    valid = np.abs(a) + np.abs(b) <= max_sum + 1e-12
+    return a[valid], b[valid]
+
+def mean_angle(lidf, angles):
+    return np.sum(lidf * angles[:, np.newaxis], axis=0)
+
+def test_verhoef_vec_bins():
+    a, b = verhoef_grid()
+    for n_elements in N_ELEMENTS:
+        lidf = FourSAIL.CalcLIDF_Verhoef_vec(a, b, n_elements)
+        reference = np.array([FourSAIL.CalcLIDF_Verhoef(a_i, b_i, n_elements)
+                              for a_i, b_i in zip(a, b)]).T
+        assert np.all(lidf >= -1e-12), n_elements
+        assert np.allclose(np.sum(lidf, axis=0), 1.)
+        assert np.max(np.abs(lidf - reference)) < 1e-6, n_elements
+
+def test_verhoef_roots():
+    a, b = verhoef_grid()
+    for n_elements in GAUSS_NODES:
+        angles, _ = FourSAIL.leaf_angles(n_elements, 'gauss')
+        p = np.repeat(2. * np.radians(angles), a.size)
+        a_flat, b_flat = np.tile(a, n_elements), np.tile(b, n_elements)
+        x = FourSAIL._solve_verhoef(a_flat, b_flat, p)
+        residual = x - a_flat * np.sin(x) - 0.5 * b_flat * np.sin(2. * x) - p
+        assert np.max(np.abs(residual)) < 1e-7, n_elements
+
+def test_verhoef_vec_gauss():
+    # The density is singular at some angle for |a|+|b|=1, where the
+    # Gauss-Legendre quadrature converges slowly
+    a, b = verhoef_grid(max_sum=0.9)
+    angles, _ = FourSAIL.leaf_angles(REFERENCE_BINS, 'bins')
+    reference = mean_angle(FourSAIL.CalcLIDF_Verhoef_vec(a, b, REFERENCE_BINS), angles)
+    for n_elements in GAUSS_NODES:
+        lidf = FourSAIL.CalcLIDF_Verhoef_vec(a, b, n_elements, 'gauss')
+        angles, _ = FourSAIL.leaf_angles(n_elements, 'gauss')
+        assert np.all(lidf >= 0), n_elements
+        assert np.allclose(np.sum(lidf, axis=0), 1.)
+        assert np.max(np.abs(mean_angle(lidf, angles) - reference)) < 2., n_elements
+
+if __name__ == '__main__':
+    for test in (test_verhoef_vec_bins, test_verhoef_roots, test_verhoef_vec_gauss):
+        test()
+        print('%s ok' % test.__name__)
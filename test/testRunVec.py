@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+"""
+Regression checks of the batch Pro4SAIL run.
+
+:func:`pyPro4SAIL.run_vec` is compared with a loop of scalar
+:func:`pyPro4SAIL.run` calls on bare soils (LAI=0), canopies without hotspot
+effect (hot_spot=0), including the hotspot geometry, and with a soil file
+outside the soil spectral library. A per-wavelength skyl is checked to stay
+spectral in a single run, a list LIDF to give one LIDF per sample and
+:func:`pyPro4SAIL.run_structured` to keep the shape of its parameters. Soil
+names are resolved in the soil spectral library folder and a missing soil
+file is an error. The PROSPECT-D engine of a coarse spectral grid is built
+once and reused by the later runs. The checks run with pytest or as a script::
+
+    python test/testRunVec.py
+"""
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from pyPro4Sail import pyPro4SAIL, spectral_library
+
+LEAF = (1.5, 40., 8., 0., 0.01, 0.009, 1.)
+# LAI, hot_spot, solar_zenith, solar_azimuth, view_zenith, view_azimuth
+CANOPIES = ((0., 0.05, 30., 0., 20., 90.),
+            (2., 0., 30., 0., 20., 90.),
+            (2., 0., 30., 0., 30., 0.),
+            (2., 0., 0., 0., 0., 0.),
+            (2., 0.05, 30., 0., 30., 0.),
+            (4., 0.1, 45., 0., 10., 180.))
+LIDFS = (57., (-0.35, -0.15))
+
+def compare(LIDF, soilType=pyPro4SAIL.DEFAULT_SOIL, skyl=0.2):
+    canopies = np.array(CANOPIES)
+    reference = np.array([pyPro4SAIL.run(*LEAF, *canopy, LIDF, skyl=skyl,
+                                         soilType=soilType)[1] for canopy in canopies])
+    if isinstance(LIDF, tuple):
+        LIDF = np.tile(LIDF, (len(canopies), 1))
+    _, rho_canopy = pyPro4SAIL.run_vec(*LEAF, *canopies.T, LIDF, skyl=skyl, soilType=soilType)
+    assert np.all(np.isfinite(rho_canopy))
+    # run uses the fixed-point Verhoef LIDF and run_vec its Newton solution
+    assert np.max(np.abs(rho_canopy - reference)) < 1e-6
+
+def test_run_vec_edge_cases():
+    for LIDF in LIDFS:
+        compare(LIDF)
+
+def test_run_spectral_skyl():
+    # A per-wavelength skyl is spectral in a single run, not a batch of samples
+    wl, reference = pyPro4SAIL.run(*LEAF, *CANOPIES[-1], LIDFS[0], skyl=0.2)
+    _, rho_canopy = pyPro4SAIL.run(*LEAF, *CANOPIES[-1], LIDFS[0],
+                                   skyl=np.full(wl.shape, 0.2))
+    assert rho_canopy.shape == reference.shape
+    assert np.max(np.abs(rho_canopy - reference)) < 1e-12
+
+def test_calc_lidf_vec_list():
+    # A list of two elements is two samples, not the (a,b) of a Verhoef's LIDF
+    lidf = pyPro4SAIL.calc_lidf_vec([57., (-0.35, -0.15)], 2)
+    assert np.allclose(lidf[:, 0], pyPro4SAIL.calc_lidf_vec(57., 1)[:, 0])
+    assert np.allclose(lidf[:, 1], pyPro4SAIL.calc_lidf_vec((-0.35, -0.15), 1)[:, 0])
+    try:
+        pyPro4SAIL.calc_lidf_vec([-0.35, -0.15], 3)
+    except ValueError:
+        pass
+    else:
+        raise AssertionError('a list LIDF must have one element per sample')
+
+def test_run_structured_shape():
+    names = pyPro4SAIL.RUN_PARAMS[:-1]
+    params = np.empty((2, 3), dtype=[(name, float) for name in names + ('LIDF',)])
+    for name, value in zip(names, LEAF + CANOPIES[-1]):
+        params[name] = value
+    params['LIDF'] = LIDFS[0]
+    params['LAI'] = np.arange(1., 7.).reshape(2, 3)
+    wl, rho_canopy = pyPro4SAIL.run_structured(params)
+    assert rho_canopy.shape == (2, 3, len(wl))
+    for index in np.ndindex(params.shape):
+        _, reference = pyPro4SAIL.run(*(params[index][name] for name in names), LIDFS[0])
+        assert np.max(np.abs(rho_canopy[index] - reference)) < 1e-12
+
+def test_soil_spectrum_paths():
+    library = spectral_library.get_soil_library()
+    index = spectral_library.get_soil_index(pyPro4SAIL.DEFAULT_SOIL)
+    name, _ = os.path.splitext(pyPro4SAIL.DEFAULT_SOIL)
+    absolute = os.path.join(spectral_library.SOIL_FOLDER, pyPro4SAIL.DEFAULT_SOIL)
+    for soil in (pyPro4SAIL.DEFAULT_SOIL, name, index, absolute):
+        _, rsoil = spectral_library.get_soil_spectrum(soil)
+        assert np.array_equal(rsoil, library.spectra[index])
+    folder = tempfile.mkdtemp()
+    try:
+        # A missing file is not looked up by its name in the library
+        missing = os.path.join(folder, pyPro4SAIL.DEFAULT_SOIL)
+        for soil in (missing, 'missing_soil.txt'):
+            try:
+                spectral_library.get_soil_spectrum(soil)
+            except FileNotFoundError:
+                pass
+            else:
+                raise AssertionError('%s must not be found' % soil)
+    finally:
+        shutil.rmtree(folder)
+
+def test_spectral_grid_engine():
+    grid = np.arange(405., 2500., 10.)
+    wl, reference = pyPro4SAIL.run(*LEAF, *CANOPIES[-1], LIDFS[0], spectral_grid=grid)
+    engine = pyPro4SAIL._grid_engine(grid)
+    assert pyPro4SAIL._grid_engine(list(grid)) is engine
+    # A run of another leaf on the same grid does not change the results
+    pyPro4SAIL.run(2.5, *LEAF[1:], *CANOPIES[-1], LIDFS[0], spectral_grid=grid)
+    _, rho_canopy = pyPro4SAIL.run(*LEAF, *CANOPIES[-1], LIDFS[0], spectral_grid=grid)
+    assert np.array_equal(rho_canopy, reference)
+    canopies = np.array(CANOPIES)
+    _, rho_canopy = pyPro4SAIL.run_vec(*LEAF, *canopies.T, LIDFS[0], spectral_grid=grid)
+    assert pyPro4SAIL._grid_engine(grid) is engine
+    for canopy, rho in zip(canopies, rho_canopy):
+        _, reference = pyPro4SAIL.run(*LEAF, *canopy, LIDFS[0], spectral_grid=grid)
+        assert np.max(np.abs(rho - reference)) < 1e-12
+
+def test_run_vec_soil_file():
+    folder = tempfile.mkdtemp()
+    try:
+        soil_file = os.path.join(folder, 'soil.txt')
+        shutil.copy(os.path.join(spectral_library.SOIL_FOLDER, pyPro4SAIL.DEFAULT_SOIL),
+                    soil_file)
+        compare(LIDFS[0], soilType=soil_file)
+    finally:
+        shutil.rmtree(folder)
+
+if __name__ == '__main__':
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for test in (test_run_vec_edge_cases, test_run_spectral_skyl, test_calc_lidf_vec_list,
+                     test_run_structured_shape, test_soil_spectrum_paths,
+                     test_spectral_grid_engine, test_run_vec_soil_file):
+            test()
+            print('%s ok' % test.__name__)
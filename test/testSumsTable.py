@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""
+Regression checks of the interpolated leaf angle weighted coefficients.
+
+:class:`FourSAIL.CampbellSumsTable` is compared with
+:func:`FourSAIL.weighted_sum_over_lidf_vec` at the grid nodes and out of the
+grid, where both must agree, as must the 4SAIL runs using them. Within the
+grid the canopy reflectance error of the default table must stay below the
+error of the 18 angle LIDF discretisation, and a table refined to a
+tolerance must meet it.
+The checks run with pytest or as a script::
+
+    python test/testSumsTable.py
+"""
+import numpy as np
+
+from pyPro4Sail import FourSAIL, ProspectD
+
+# Number of leaf inclination angles of the reference LIDF discretisation
+REFERENCE_ELEMENTS = 90
+TOL = 0.01
+
+def random_pixels(n_pixels, seed=0):
+    '''LAI, Campbell mean leaf angle, sun zenith, view zenith and relative azimuth.'''
+
+    rng = np.random.default_rng(seed)
+    return np.column_stack((rng.uniform(0.5, 6.0, n_pixels),
+                            rng.uniform(0.0, 90.0, n_pixels),
+                            rng.uniform(0.0, 80.0, n_pixels),
+                            rng.uniform(0.0, 80.0, n_pixels),
+                            rng.uniform(0.0, 180.0, n_pixels)))
+
+def exact_sums(alpha, tts, tto, psi, n_elements=18):
+    lidf = FourSAIL.CalcLIDF_Campbell_vec(alpha, n_elements)
+    return np.array(FourSAIL.weighted_sum_over_lidf_vec(lidf, tts, tto, psi))
+
+def test_sums_table_direct():
+    table = FourSAIL.CampbellSumsTable()
+    # Grid nodes
+    alpha, tts, tto, psi = (grid.reshape(-1) for grid in
+                            np.meshgrid(table.alpha[::5], table.zenith[::4],
+                                        table.zenith[::3], table.psi[::6], indexing='ij'))
+    sums = np.array(table(alpha, tts, tto, psi))
+    assert np.max(np.abs(sums - exact_sums(alpha, tts, tto, psi))) < 1e-9
+    # Out of the grid
+    alpha, tts, tto, psi = (30., 60.), (85., 20.), (10., 89.), (90., 0.)
+    sums = np.array(table(alpha, tts, tto, psi))
+    assert np.max(np.abs(sums - exact_sums(alpha, tts, tto, psi))) < 1e-12
+
+def test_sums_table_run():
+    # 4SAIL with the table coefficients at grid nodes and with the direct sums
+    wl, rho, tau = ProspectD.ProspectD(1.5, 40., 8., 0., 0.01, 0.009, 1.)
+    rho, tau = rho[::50], tau[::50]
+    table = FourSAIL.CampbellSumsTable()
+    alpha, tts, tto, psi = (np.array(value) for value in
+                            ((20., 57.5, 90.), (30., 0., 60.), (30., 45., 20.), (0., 90., 180.)))
+    rdot, rsot = FourSAIL.FourSAIL_vec(2., 0.05, None, tts, tto, psi, rho, tau, 0.15,
+                                       outputs=FourSAIL.REFLECTANCE_OUTPUTS,
+                                       weighted_sums=table(alpha, tts, tto, psi))
+    for i in range(alpha.size):
+        expected = FourSAIL.FourSAIL(2., 0.05, FourSAIL.CalcLIDF_Campbell(alpha[i]),
+                                     tts[i], tto[i], psi[i], rho, tau, 0.15,
+                                     outputs=FourSAIL.REFLECTANCE_OUTPUTS)
+        assert np.max(np.abs(rdot[:, i] - expected[0])) < 1e-9
+        assert np.max(np.abs(rsot[:, i] - expected[1])) < 1e-9
+
+def test_sums_table_reflectance():
+    wl, rho, tau = ProspectD.ProspectD(1.5, 40., 8., 0., 0.01, 0.009, 1.)
+    rho, tau = rho[::50], tau[::50]
+    rsoil = np.full(rho.shape, 0.15)
+    lai, alpha, tts, tto, psi = random_pixels(20000).T
+    table = FourSAIL.CampbellSumsTable()
+
+    def reflectance(weighted_sums):
+        return np.array(FourSAIL.FourSAIL_vec(lai, 0.05, None, tts, tto, psi, rho, tau, rsoil,
+                                              outputs=FourSAIL.REFLECTANCE_OUTPUTS,
+                                              weighted_sums=weighted_sums))
+
+    exact = reflectance(exact_sums(alpha, tts, tto, psi))
+    discretisation = np.max(np.abs(exact - reflectance(
+            exact_sums(alpha, tts, tto, psi, REFERENCE_ELEMENTS))))
+    interpolation = np.max(np.abs(reflectance(table(alpha, tts, tto, psi)) - exact))
+    assert interpolation <= discretisation, (interpolation, discretisation)
+
+def test_sums_table_tol():
+    table = FourSAIL.CampbellSumsTable(tol=TOL)
+    assert np.all(table.max_error() <= TOL)
+    # The default grid needs to be refined to meet TOL
+    assert table.nbytes > FourSAIL.CampbellSumsTable().nbytes
+
+if __name__ == '__main__':
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for test in (test_sums_table_direct, test_sums_table_run, test_sums_table_reflectance,
+                     test_sums_table_tol):
+            test()
+            print('%s ok' % test.__name__)